@@ -0,0 +1,176 @@
+import argparse
+import random
+import tracemalloc
+from time import perf_counter
+from cannon_sim import CannonHuntStrategy, Engine, EngineStats, MapRegistry, NpcRegistry, PlayerRegistry, PrecomputedWalkabilityStrategy, SimpleHuntStrategy
+from synthetic import build_synthetic_engine, synthetic_map_config
+
+# Benchmarks run on generated spots so they work without the game data checked out.
+# Each prints one row per configuration so results can be diffed between commits.
+
+def build_crowded_spot(cannon_count, npc_count, area_size=64, seed=0, stats=None, fast_forward=True, map_registry=None):
+  # An open area_size x area_size spot with npcs spread over it and every player cannoning near the middle
+  rng = random.Random(seed)
+  if map_registry is None:
+    map_registry = MapRegistry({})
+  npc_registry = NpcRegistry()
+  player_registry = PlayerRegistry()
+  walkability_strategy = PrecomputedWalkabilityStrategy(map_registry, npc_registry, player_registry)
+  hunt_strategy = SimpleHuntStrategy(map_registry, npc_registry, player_registry)
+  cannon_strategy = CannonHuntStrategy(map_registry, npc_registry, player_registry)
+
+  # Players stand on a grid 3 tiles apart with their cannon to the south east
+  per_row = max(1, int(cannon_count ** 0.5))
+  middle = area_size // 2
+  player_tiles = set()
+  for i in range(cannon_count):
+    tile = (middle + 3 * (i % per_row), middle + 3 * (i // per_row))
+    player_tiles.add(tile)
+    player = player_registry.create_player(tile, cannon_strategy)
+    player.place_cannon((tile[0] + 1, tile[1] - 1))
+
+  occupied = set(player_tiles)
+  while len(occupied) - len(player_tiles) < npc_count:
+    tile = (rng.randrange(area_size), rng.randrange(area_size))
+    if tile in occupied:
+      continue
+    occupied.add(tile)
+    npc_registry.create_npc(tile[0], tile[1], walkability_strategy, hunt_strategy, opts={'hitpoints': 29, 'combat_level': 22, 'wander_range': 8, 'max_range': 10, 'respawn_time': 70})
+
+  return Engine(map_registry, npc_registry, player_registry, stats, fast_forward)
+
+def bench_cannons(cannon_counts, npc_count, ticks, seed=0):
+  rows = []
+  for cannon_count in cannon_counts:
+    stats = EngineStats()
+    engine = build_crowded_spot(cannon_count, npc_count, seed=seed, stats=stats)
+    random.seed(seed)
+    start = perf_counter()
+    engine.perform_ticks(ticks)
+    elapsed = perf_counter() - start
+    kills = sum(npc.times_died for npc in engine.npc_registry.registered_npcs)
+    # The player timers phase is where cannons fire, so it isolates the cost of targeting
+    cannon_seconds = stats.times['phase.player_timers']
+    rows.append({
+      'cannons': cannon_count,
+      'npcs': npc_count,
+      'ticks': ticks,
+      'seconds': elapsed,
+      'ticks_per_second': ticks / elapsed,
+      'cannon_seconds': cannon_seconds,
+      'us_per_cannon_tick': 1e6 * cannon_seconds / (cannon_count * ticks),
+      'kills': kills,
+    })
+  return rows
+
+def bench_sparse(npc_counts, area_size, ticks, seed=0):
+  # One cannon with a few npcs spread over a big area, so most ticks nothing is in range.
+  # Runs with and without fast forwarding have to end with the same kills.
+  rows = []
+  for npc_count in npc_counts:
+    results = {}
+    # The first run fills the clearance map so both timed runs only measure the simulation
+    map_registry = MapRegistry({})
+    for fast_forward in [None, False, True]:
+      engine = build_crowded_spot(1, npc_count, area_size, seed=seed, fast_forward=bool(fast_forward), map_registry=map_registry)
+      random.seed(seed)
+      start = perf_counter()
+      engine.perform_ticks(ticks)
+      elapsed = perf_counter() - start
+      results[fast_forward] = (elapsed, sum(npc.times_died for npc in engine.npc_registry.registered_npcs))
+    rows.append({
+      'npcs': npc_count,
+      'area_size': area_size,
+      'ticks': ticks,
+      'seconds': results[False][0],
+      'fast_forward_seconds': results[True][0],
+      'speedup': results[False][0] / results[True][0],
+      'kills': results[False][1],
+      'fast_forward_kills': results[True][1],
+    })
+  return rows
+
+# Spots more crowded than this many npcs per tile are left out of the scaling benchmark
+MAX_NPC_DENSITY = 1 / 8
+
+def bench_scaling(npc_counts, map_sizes, ticks, seed=0, sizes=(1,)):
+  # Generated maps with walls and objects (see synthetic.py). Each configuration is run twice from the same seed:
+  # the first run is on a fresh map registry, so building its clearance map is part of the cold time, the second
+  # reuses that map and is timed on its own. Memory per npc is what building the engine allocates, the map aside.
+  rows = []
+  for map_size in map_sizes:
+    player_tile = (map_size // 2, map_size // 2)
+    map_config = synthetic_map_config(map_size, map_size, seed, clear=[player_tile, (player_tile[0] + 1, player_tile[1] - 1)])
+    for npc_count in npc_counts:
+      if npc_count > map_size * map_size * MAX_NPC_DENSITY:
+        continue
+      map_registry = MapRegistry(map_config)
+      tracemalloc.start()
+      engine = build_synthetic_engine(map_size, map_size, npc_count, sizes, seed, map_registry)
+      engine_bytes = tracemalloc.get_traced_memory()[0]
+      tracemalloc.stop()
+
+      random.seed(seed)
+      start = perf_counter()
+      engine.perform_ticks(ticks)
+      cold = perf_counter() - start
+
+      engine = build_synthetic_engine(map_size, map_size, npc_count, sizes, seed, map_registry)
+      random.seed(seed)
+      start = perf_counter()
+      engine.perform_ticks(ticks)
+      elapsed = perf_counter() - start
+      rows.append({
+        'map_size': map_size,
+        'npcs': npc_count,
+        'ticks': ticks,
+        'cold_seconds': cold,
+        'seconds': elapsed,
+        'ticks_per_second': ticks / elapsed,
+        'us_per_npc_tick': 1e6 * elapsed / (npc_count * ticks),
+        'bytes_per_npc': engine_bytes // npc_count,
+        'kills': sum(npc.times_died for npc in engine.npc_registry.registered_npcs),
+      })
+  return rows
+
+def print_rows(rows):
+  if not rows:
+    return
+  columns = list(rows[0].keys())
+  print('\t'.join(columns))
+  for row in rows:
+    print('\t'.join(f'{row[c]:.4f}' if isinstance(row[c], float) else str(row[c]) for c in columns))
+
+def main(argv=None):
+  parser = argparse.ArgumentParser(description='Simulator performance benchmarks')
+  subparsers = parser.add_subparsers(dest='benchmark', required=True)
+
+  cannons = subparsers.add_parser('cannons', help='Cost of adding players with cannons to one crowded spot')
+  cannons.add_argument('--counts', type=int, nargs='+', default=[1, 2, 4, 8, 16])
+  cannons.add_argument('--npcs', type=int, default=200)
+  cannons.add_argument('--ticks', type=int, default=1000)
+  cannons.add_argument('--seed', type=int, default=0)
+
+  sparse = subparsers.add_parser('sparse', help='Spots where nothing is in range of the cannon most of the time, with and without fast forwarding')
+  sparse.add_argument('--npcs', type=int, nargs='+', default=[5, 10, 20, 40])
+  sparse.add_argument('--area-size', type=int, default=128)
+  sparse.add_argument('--ticks', type=int, default=6000)
+  sparse.add_argument('--seed', type=int, default=0)
+
+  scaling = subparsers.add_parser('scaling', help='Ticks per second and memory per npc on generated maps of growing size and population')
+  scaling.add_argument('--npcs', type=int, nargs='+', default=[10, 100, 1000, 10000])
+  scaling.add_argument('--map-sizes', type=int, nargs='+', default=[64, 256, 1024], help=f'Map widths, populations over {MAX_NPC_DENSITY} npcs a tile are skipped')
+  scaling.add_argument('--npc-sizes', type=int, nargs='+', default=[1], help='Npc sizes to mix')
+  scaling.add_argument('--ticks', type=int, default=500)
+  scaling.add_argument('--seed', type=int, default=0)
+
+  args = parser.parse_args(argv)
+  if args.benchmark == 'cannons':
+    print_rows(bench_cannons(args.counts, args.npcs, args.ticks, args.seed))
+  elif args.benchmark == 'sparse':
+    print_rows(bench_sparse(args.npcs, args.area_size, args.ticks, args.seed))
+  elif args.benchmark == 'scaling':
+    print_rows(bench_scaling(args.npcs, args.map_sizes, args.ticks, args.seed, tuple(args.npc_sizes)))
+
+if __name__ == '__main__':
+  main()
@@ -1,13 +1,15 @@
+import asyncio
+import csv
 import math
 import random
-from create_map import Mask, create_map_config
+from collections import defaultdict
+from pathlib import Path
+from time import perf_counter
+from create_map import Mask, create_map_config, create_multicombat_map, region_for
 from typing import Tuple, Union
 from create_map import relevant_npcs
 # For champion challenge
-# TODO: Support aggression/huntrange
 # TODO: Accuracy checks for the cannon
-# TODO: Support tiles that block (ex water, dont think i need to support flying npcs)
-# TODO: Support multiple planes, not necessarily at the same time (lesser demons for ex)
 
 # For other
 # TODO: Refactor a lot of this mess
@@ -25,27 +27,358 @@ def debug(msg):
   if DEBUG == True:
     print(msg)
 
+# Bump whenever a change alters simulation results, cached results from other versions are ignored (see result_cache.py)
+SIMULATOR_VERSION = 1
+
 def cheb(point1, point2):
   return max(abs(point1[0] - point2[0]), abs(point1[1] - point2[1]))
 
 def euclidean(point1, point2):
   return math.sqrt((point1[0] - point2[0])**2 + (point1[1] - point2[1])**2)
 
+def euclidean_squared(point1, point2):
+  # Same ordering as euclidean without the sqrt, use when only comparing distances
+  return (point1[0] - point2[0])**2 + (point1[1] - point2[1])**2
+
+class EngineStats:
+  # Call counts and accumulated time (seconds) for the hot paths of a run.
+  # Method timings are inclusive, so recursive walkability probes are counted in their caller too.
+  def __init__(self) -> None:
+    self.counts = defaultdict(int)
+    self.times = defaultdict(float)
+
+  def increment(self, name, amount=1):
+    self.counts[name] += amount
+
+  def add_time(self, name, seconds):
+    self.times[name] += seconds
+
+  def merge(self, other: 'EngineStats'):
+    # Combine stats from another run (ex. one returned by a worker process) into this one
+    for name, count in other.counts.items():
+      self.counts[name] += count
+    for name, seconds in other.times.items():
+      self.times[name] += seconds
+    return self
+
+  def __add__(self, other: 'EngineStats'):
+    return EngineStats().merge(self).merge(other)
+
+  def report(self):
+    names = sorted(set(self.counts) | set(self.times), key=lambda name: (-self.times.get(name, 0), name))
+    lines = []
+    for name in names:
+      seconds = self.times.get(name)
+      timing = f'{seconds:10.4f}s' if seconds is not None else ' ' * 11
+      lines.append(f'{name:<32} {self.counts.get(name, 0):>12} {timing}')
+    return '\n'.join(lines)
+
+
+class _EventRecorder:
+  # Wraps entity methods per instance for as long as someone is pulling events (see Engine.events),
+  # and puts back whatever was there before when done, so engines nobody watches run the plain methods.
+  # Events are tuples starting with their kind:
+  #   ('move', slot, x, y)        npc moved to x, y
+  #   ('hit', slot, damage, hp)   npc took damage and has hp left, from the cannon or the player
+  #   ('death', slot, x, y)       npc died at x, y
+  #   ('respawn', slot, x, y)     npc came back at its respawn tile
+  #   ('cannon', player, dx, dy)  the player's cannon turned to face dx, dy
+  #   ('target', player, slot)    the player's cannon picked an npc to fire at
+  def __init__(self, engine):
+    self.events = []
+    self._wrapped = []
+    for npc in engine.npc_registry.registered_npcs:
+      self._watch_npc(npc)
+    for index, player in enumerate(engine.player_registry.registered_players):
+      cannon = player.cannon()
+      if cannon is not None:
+        self._watch_cannon(index, cannon)
+
+  def _wrap(self, entity, name, make_wrapper):
+    self._wrapped.append((entity, name, entity.__dict__.get(name)))
+    setattr(entity, name, make_wrapper(getattr(entity, name)))
+
+  def _watch_npc(self, npc):
+    events = self.events
+    slot = npc.slot_index
+
+    def wrap_move(move):
+      def move_and_record():
+        start = npc._x, npc._y
+        move()
+        if (npc._x, npc._y) != start:
+          events.append(('move', slot, npc._x, npc._y))
+      return move_and_record
+    self._wrap(npc, 'move', wrap_move)
+
+    def wrap_take_damage(take_damage):
+      def take_damage_and_record(amount, attacker):
+        # Recorded first so the hit comes before the death it causes
+        damage_taken = min(amount, npc.hitpoints)
+        events.append(('hit', slot, damage_taken, npc.hitpoints - damage_taken))
+        take_damage(amount, attacker)
+      return take_damage_and_record
+    self._wrap(npc, 'take_damage', wrap_take_damage)
+
+    def wrap_die(die):
+      def die_and_record():
+        events.append(('death', slot, npc._x, npc._y))
+        die()
+      return die_and_record
+    self._wrap(npc, 'die', wrap_die)
+
+    def wrap_respawn(respawn):
+      def respawn_and_record():
+        respawn()
+        events.append(('respawn', slot, npc._x, npc._y))
+      return respawn_and_record
+    self._wrap(npc, 'respawn', wrap_respawn)
+
+  def _watch_cannon(self, index, cannon):
+    events = self.events
+
+    def wrap_turn(turn):
+      def turn_and_record():
+        turn()
+        events.append(('cannon', index, cannon.direction[0], cannon.direction[1]))
+      return turn_and_record
+    self._wrap(cannon, 'turn', wrap_turn)
+
+    def wrap_get_target(get_target):
+      def get_target_and_record():
+        npc = get_target()
+        if npc is not None:
+          events.append(('target', index, npc.slot_index))
+        return npc
+      return get_target_and_record
+    self._wrap(cannon, 'get_target', wrap_get_target)
+
+  def take(self):
+    events = self.events[:]
+    self.events.clear()
+    return events
+
+  def detach(self):
+    for entity, name, previous in reversed(self._wrapped):
+      if previous is None:
+        delattr(entity, name)
+      else:
+        setattr(entity, name, previous)
+    self._wrapped = []
 
 class Engine:
-  def __init__(self, map_registry, npc_registry, player_registry) -> None:
+  # Ticks to run normally before looking for another quiet window when there wasn't one
+  QUIET_RECHECK_TICKS = 8
+
+  def __init__(self, map_registry, npc_registry, player_registry, stats: 'EngineStats | None' = None, fast_forward=True) -> None:
     self.map_registry = map_registry
     self.npc_registry = npc_registry
     self.player_registry = player_registry
-    pass
+    # Instrumentation is only wired up when a stats object is passed in, otherwise the tick loop is untouched
+    self.stats = stats
+    # (object, attribute, what its __dict__ held before) for every attribute set by _attach_stats
+    self._instrumented = []
+    # Skip cannon targeting (and hunting) while no npc can possibly be found, see _count_quiet_ticks
+    self.fast_forward = fast_forward
 
   def perform_ticks(self, ticks):
+    if self.stats is not None:
+      # Strategies can be shared with other engines, so they're only instrumented while this one runs
+      self._attach_stats()
+      try:
+        self._perform_ticks(ticks)
+      finally:
+        self._detach_stats()
+      return
+    self._perform_ticks(ticks)
+
+  def _perform_ticks(self, ticks):
+    if not self.fast_forward:
+      for _ in range(ticks):
+        self.perform_tick()
+      return
+
+    # Quiet windows are only trusted within one call, anything can be changed between calls
+    quiet_ticks = 0
+    recheck_in = 0
     for _ in range(ticks):
-      self.perform_tick()
+      if quiet_ticks == 0 and recheck_in == 0:
+        quiet_ticks = self._count_quiet_ticks()
+        if quiet_ticks == 0:
+          recheck_in = self.QUIET_RECHECK_TICKS
+      if quiet_ticks > 0:
+        quiet_ticks -= 1
+        self.perform_tick(quiet=True)
+      else:
+        recheck_in -= 1
+        self.perform_tick()
+
+  def _quiet_flags(self, ticks):
+    # The quiet flag for each of the next ticks (forever when ticks is None), fast forwarding like perform_ticks
+    quiet_ticks = 0
+    recheck_in = 0
+    tick = 0
+    while ticks is None or tick < ticks:
+      tick += 1
+      if not self.fast_forward:
+        yield False
+        continue
+      if quiet_ticks == 0 and recheck_in == 0:
+        quiet_ticks = self._count_quiet_ticks()
+        if quiet_ticks == 0:
+          recheck_in = self.QUIET_RECHECK_TICKS
+      if quiet_ticks > 0:
+        quiet_ticks -= 1
+        yield True
+      else:
+        recheck_in -= 1
+        yield False
+
+  def events(self, ticks=None):
+    # Runs a tick each time the caller asks for the next batch and yields (tick, events) with tick counting from 1
+    # (see _EventRecorder for the events). Nothing runs ahead of the consumer, and nothing is recorded once the
+    # generator is closed. Like perform_ticks, quiet windows assume the engine is only changed by the ticks
+    # themselves, start a new iteration after changing it from outside.
+    if self.stats is not None:
+      self._attach_stats()
+    recorder = _EventRecorder(self)
+    try:
+      for tick, quiet in enumerate(self._quiet_flags(ticks), 1):
+        self.perform_tick(quiet)
+        yield tick, recorder.take()
+    finally:
+      recorder.detach()
+      self._detach_stats()
+
+  async def aevents(self, ticks=None):
+    # events for asyncio consumers, giving the event loop a turn after every tick
+    iterator = self.events(ticks)
+    try:
+      for batch in iterator:
+        yield batch
+        await asyncio.sleep(0)
+    finally:
+      iterator.close()
+
+  def _get_watched_areas(self):
+    # (x1, y1, x2, y2) boxes an npc coordinate has to be in to be found this tick: the box around every cannon's
+    # target areas, and the hunt range around each player when there are aggressive npcs.
+    # Boxes rather than the exact areas keep checking an npc down to a couple of comparisons.
+    areas = []
+    for player in self.player_registry.registered_players:
+      cannon = player.cannon()
+      if cannon is not None:
+        target_areas = cannon.get_target_areas()
+        areas.append((
+          min(x - radius for x, _, radius in target_areas),
+          min(y - radius for _, y, radius in target_areas),
+          max(x + radius for x, _, radius in target_areas),
+          max(y + radius for _, y, radius in target_areas),
+        ))
+      hunt_range = self.npc_registry.max_hunt_range
+      if hunt_range is not None:
+        areas.append((player.x - hunt_range, player.y - hunt_range, player.x + hunt_range, player.y + hunt_range))
+    return areas
+
+  def _count_quiet_ticks(self):
+    # Number of ticks, starting with the next one, in which no npc can be in a watched area when the players act.
+    # Npcs move at most one tile a tick and dead npcs reappear at their respawn tile, so the distance from each npc
+    # to the closest area bounds how long it stays out of all of them. This is checked before the npcs move.
+    areas = self._get_watched_areas()
+    if not areas:
+      return 0
+    quiet_ticks = None
+    for npc in self.npc_registry.registered_npcs:
+      x, y = npc.respawn_coordinate
+      respawn_distance = min(max(x1 - x, x - x2, y1 - y, y - y2) for x1, y1, x2, y2 in areas)
+      if npc.is_dead():
+        # Respawns on the timers phase of its last dead tick, then moves that same tick
+        npc_quiet_ticks = npc.respawn_time_remaining + respawn_distance - 2
+      else:
+        x, y = npc.coordinate
+        distance = min(max(x1 - x, x - x2, y1 - y, y - y2) for x1, y1, x2, y2 in areas)
+        # A player already fighting it can kill it this tick, so it may come back at its respawn tile
+        npc_quiet_ticks = min(distance - 1, npc.respawn_time + respawn_distance - 1)
+      if npc_quiet_ticks <= 0:
+        return 0
+      if quiet_ticks is None or npc_quiet_ticks < quiet_ticks:
+        quiet_ticks = npc_quiet_ticks
+    return quiet_ticks if quiet_ticks is not None else 0
+
+  def _attach_stats(self):
+    # Strategies are shared between entities, so wrap each one once
+    for npc in self.npc_registry.registered_npcs:
+      self._instrument(npc.walkability_strategy, 'is_walkable_tile', 'walkability.is_walkable_tile')
+      if npc.hunt_strategy is not None:
+        self._instrument(npc.hunt_strategy, 'has_line_of_sight', 'hunt.has_line_of_sight')
+    for player in self.player_registry.registered_players:
+      self._instrument(player._cannon_strategy, 'get_target', 'cannon.get_target')
+      self._instrument(player._cannon_strategy, 'has_line_of_sight', 'cannon.has_line_of_sight')
+
+    # Phases of perform_tick, timed per call. An idle npc's quiet tick is all movement.
+    for npc in self.npc_registry.registered_npcs:
+      self._time_calls(npc, 'perform_timers', 'phase.npc_timers')
+      self._time_calls(npc, 'perform_queue', 'phase.npc_queue')
+      self._time_calls(npc, 'perform_move', 'phase.npc_move')
+      self._time_calls(npc, 'perform_idle_move', 'phase.npc_move')
+      self._time_calls(npc, 'perform_interact', 'phase.npc_interact')
+    self._time_calls(self, 'perform_hunts', 'phase.npc_hunt')
+    for player in self.player_registry.registered_players:
+      self._time_calls(player, 'perform_queue', 'phase.player_queue')
+      self._time_calls(player, 'perform_timers', 'phase.player_timers')
+      self._time_calls(player, 'perform_idle_timers', 'phase.player_timers')
+      self._time_calls(player, 'perform_interact', 'phase.player_interact')
+
+    perform_tick = self.perform_tick
+    counts = self.stats.counts
+    def perform_counted_tick(quiet=False):
+      perform_tick(quiet)
+      counts['ticks'] += 1
+      if quiet:
+        counts['ticks.quiet'] += 1
+    self._set_instrumented(self, 'perform_tick', perform_counted_tick)
+
+  def _detach_stats(self):
+    # Puts back whatever was there before _attach_stats
+    for instrumented, name, previous in reversed(self._instrumented):
+      if previous is None:
+        delattr(instrumented, name)
+      else:
+        setattr(instrumented, name, previous)
+    self._instrumented = []
+
+  def _set_instrumented(self, instrumented, name, value):
+    self._instrumented.append((instrumented, name, instrumented.__dict__.get(name)))
+    setattr(instrumented, name, value)
 
-  def perform_tick(self):
+  def _instrument(self, strategy, method_name, stat_name):
+    if any(instrumented is strategy and name == method_name for instrumented, name, _ in self._instrumented):
+      return
+    if not any(instrumented is strategy and name == 'stats' for instrumented, name, _ in self._instrumented):
+      self._set_instrumented(strategy, 'stats', self.stats)
+    self._time_calls(strategy, method_name, stat_name)
+
+  def _time_calls(self, instrumented, method_name, stat_name):
+    method = getattr(instrumented, method_name)
+    counts = self.stats.counts
+    times = self.stats.times
+    def timed(*args, **kwargs):
+      start = perf_counter()
+      try:
+        return method(*args, **kwargs)
+      finally:
+        times[stat_name] += perf_counter() - start
+        counts[stat_name] += 1
+    self._set_instrumented(instrumented, method_name, timed)
+
+  def perform_tick(self, quiet=False):
+    # quiet is set by perform_ticks when it knows no cannon or hunting npc would find anything this tick.
+    # With stats, _attach_stats times each phase by wrapping the methods called here.
     # Process client input
     for npc in self.npc_registry.registered_npcs:
+      if quiet and npc.is_idle():
+        npc.perform_idle_move()
+        continue
       # Each npc do
       #   stalls end
       npc.perform_timers()
@@ -57,6 +390,10 @@ class Engine:
       #   * interaction with players/npcs (determine pathing the next tick?)
       npc.perform_interact()
 
+    # Aggressive npcs look for players to attack
+    if self.npc_registry.max_hunt_range is not None and not quiet:
+      self.perform_hunts()
+
     # Does this matter at all for a v0? prob not
     for player in self.player_registry.registered_players:
       # Each player do
@@ -64,18 +401,41 @@ class Engine:
       #   queue (take damage)
       #   timers (poison?)
       player.perform_queue()
-      player.perform_timers() # This fires the cannon
+      if quiet:
+        player.perform_idle_timers()
+      else:
+        player.perform_timers() # This fires the cannon
       player.perform_interact()
       #   area queue
       #   interaction with items/objects
       #   * (not v0) movement
       #   * (not v0) interaction with players/npcs
 
+  def perform_hunts(self):
+    # Hunting is driven from the players: only npcs within the largest hunt range of a player are looked at,
+    # however many npcs the spot has
+    hunt_range = self.npc_registry.max_hunt_range
+    for player in self.player_registry.registered_players:
+      if player.is_tolerant_of_aggression():
+        continue
+      # In singles an npc won't go for a player that is already fighting
+      if player.is_in_combat() and not player.is_in_multicombat():
+        continue
+      npcs = self.npc_registry.get_living_npcs_in_range(player.coordinate, hunt_range, player.plane)
+      for npc in sorted(npcs, key=lambda npc: npc.slot_index):
+        if npc.can_hunt(player):
+          npc.hunt(player)
+
 class Action:
+  __slots__ = ()
+
   def act_on(self, entity):
     raise NotImplementedError
 
 class DamageAction(Action):
+  # Never changed once queued, so the same action can be queued again
+  __slots__ = ('damage', 'attacker')
+
   def __init__(self, damage: int, attacker: Union['Npc', 'Player']):
     self.damage = damage
     self.attacker = attacker
@@ -83,7 +443,14 @@ class DamageAction(Action):
   def act_on(self, entity: Union['Npc', 'Player']):
     entity.take_damage(self.damage, self.attacker)
 
+def damage_actions(attacker, max_hit):
+  # A DamageAction for every damage from 0 to max_hit, queued again for each hit instead of allocating one
+  return [DamageAction(damage, attacker) for damage in range(max_hit + 1)]
+
 class WalkabilityStrategy:
+  # Set by the Engine when instrumentation is enabled
+  stats = None
+
   def __init__(self, map_registry, npc_registry, player_registry) -> None:
     self.map_registry = map_registry
     self.npc_registry = npc_registry
@@ -144,24 +511,28 @@ class SimpleWalkabilityStrategy(WalkabilityStrategy):
             return True
     return False
 
-  def is_walkable_tile(self, old_coord, new_coord, moving_npc):
-    # Not walkable if there is an npc there or object that restricts movement
+  def _is_occupied(self, new_coord, moving_npc):
     # Check relevant tiles for blocking npcs
-    # TODO: This should be refactored, checking other tiles walkability in _are_objects_blocking is weird
-    # Can probably be optimized if thats pulled out.
     for i in range(moving_npc.size):
       for j in range(moving_npc.size):
-        for npc in self.npc_registry.get_living_npcs_in_tile(new_coord[0] + i, new_coord[1] + j):
+        for npc in self.npc_registry.get_living_npcs_in_tile(new_coord[0] + i, new_coord[1] + j, moving_npc.plane):
           # If collides with another npc return false
           # TODO: Allow if the transparent flag is set
           # TODO: Should this account for the Npc trying to walk on itself?
           if npc == moving_npc:
             continue
           if npc.collides_with(new_coord, moving_npc.size):
-            return False
-        for player in self.player_registry.registered_players:
-          if player.coordinate == (new_coord[0] + i, new_coord[1] + j):
-            return False
+            return True
+        if self.player_registry.is_tile_occupied(new_coord[0] + i, new_coord[1] + j, moving_npc.plane):
+          return True
+    return False
+
+  def is_walkable_tile(self, old_coord, new_coord, moving_npc):
+    # Not walkable if there is an npc there or object that restricts movement
+    # TODO: This should be refactored, checking other tiles walkability in _are_objects_blocking is weird
+    # Can probably be optimized if thats pulled out.
+    if self._is_occupied(new_coord, moving_npc):
+      return False
 
     # Is there something on the current tiles blocking me?
     if self._are_objects_blocking(old_coord, new_coord, moving_npc):
@@ -173,54 +544,234 @@ class SimpleWalkabilityStrategy(WalkabilityStrategy):
 
     return True
 
-from collections import defaultdict
+# The 8 single tile steps an Npc can take, indexes into a ClearanceMap entry
+STEP_DIRECTIONS = [(0, 1), (1, 1), (1, 0), (1, -1), (0, -1), (-1, -1), (-1, 0), (-1, 1)]
+STEP_DIRECTION_INDEXES = {direction: i for i, direction in enumerate(STEP_DIRECTIONS)}
+
+class _SizedMover:
+  # Stands in for an Npc of a given size when working out static step results
+  def __init__(self, size):
+    self.size = size
+    self.plane = 0
+
+class _StaticStepChecker(SimpleWalkabilityStrategy):
+  # Runs the simple walkability checks as if nothing was standing on the map,
+  # recording every footprint the simple strategy would have checked for occupants
+  MAX_REMEMBERED_STEPS = 1 << 16
+
+  def __init__(self, map_registry):
+    super().__init__(map_registry, None, None)
+    self.checked_footprints = []
+    # Diagonal steps check the straight steps around them, which neighbouring tiles check too.
+    # Only kept for the last few thousand tiles, neighbours are mostly filled in close together.
+    self._steps = {}
+
+  def _is_occupied(self, new_coord, moving_npc):
+    self.checked_footprints.append(new_coord)
+    return False
+
+  def is_walkable_tile(self, old_coord, new_coord, moving_npc):
+    key = (old_coord, new_coord, moving_npc.size)
+    walkable = self._steps.get(key)
+    if walkable is None:
+      if len(self._steps) >= self.MAX_REMEMBERED_STEPS:
+        self._steps = {}
+      walkable = super().is_walkable_tile(old_coord, new_coord, moving_npc)
+      self._steps[key] = walkable
+    return walkable
+
+class ClearanceMap:
+  # For each tile and step direction, the largest Npc size (up to max_size) that static objects let take that step.
+  # A size n Npc checks a superset of the tiles a size n - 1 Npc checks, so one number per direction covers every size.
+  # Entries are filled per tile on first use. The map never changes during a simulation, so clearance maps are kept
+  # on the MapRegistry and shared by every run.
+  def __init__(self, map_registry, max_size):
+    self.max_size = max_size
+    self._checker = _StaticStepChecker(map_registry)
+    self._movers = [_SizedMover(size) for size in range(1, max_size + 1)]
+    self._clearances = {}
+    self._occupancy_offsets = {}
+
+  def get_clearances(self, tile):
+    clearances = self._clearances.get(tile)
+    if clearances is None:
+      clearances = bytes(self._compute_clearance(tile, direction) for direction in STEP_DIRECTIONS)
+      self._clearances[tile] = clearances
+      # Footprints are only wanted from get_occupancy_offsets
+      self._checker.checked_footprints.clear()
+    return clearances
+
+  def _compute_clearance(self, tile, direction):
+    new_tile = (tile[0] + direction[0], tile[1] + direction[1])
+    clearance = 0
+    for mover in self._movers:
+      if not self._checker.is_walkable_tile(tile, new_tile, mover):
+        break
+      clearance = mover.size
+    return clearance
+
+  def get_occupancy_offsets(self, size, direction):
+    # Footprints SimpleWalkabilityStrategy checks for occupants when taking a step, relative to the start tile.
+    # Diagonal steps check the orthogonal steps they are made of, so there is more than one.
+    offsets = self._occupancy_offsets.get((size, direction))
+    if offsets is None:
+      empty_checker = _StaticStepChecker(MapRegistry({}))
+      empty_checker.is_walkable_tile((0, 0), direction, _SizedMover(size))
+      offsets = list(dict.fromkeys(empty_checker.checked_footprints))
+      self._occupancy_offsets[(size, direction)] = offsets
+    return offsets
+
+  def precompute(self, bottom_left, top_right):
+    for x in range(bottom_left[0], top_right[0] + 1):
+      for y in range(bottom_left[1], top_right[1] + 1):
+        self.get_clearances((x, y))
+
+class PrecomputedWalkabilityStrategy(SimpleWalkabilityStrategy):
+  # Same results as SimpleWalkabilityStrategy, but static objects are looked up in a ClearanceMap
+  # so a step only costs the occupancy checks for the footprints it covers, whatever the Npc size
+  def is_walkable_tile(self, old_coord, new_coord, moving_npc):
+    direction = (new_coord[0] - old_coord[0], new_coord[1] - old_coord[1])
+    index = STEP_DIRECTION_INDEXES.get(direction)
+    if index is None:
+      return super().is_walkable_tile(old_coord, new_coord, moving_npc)
+
+    size = moving_npc.size
+    clearance_map = self.map_registry.get_clearance_map(size)
+    if clearance_map.get_clearances(old_coord)[index] < size:
+      return False
+    for offset in clearance_map.get_occupancy_offsets(size, direction):
+      if self._is_occupied((old_coord[0] + offset[0], old_coord[1] + offset[1]), moving_npc):
+        return False
+    return True
+
+# Npc stats table, one row per npc id. Blank cells fall back to the Npc defaults.
+NPC_DEFINITIONS_PATH = Path(__file__).parent / 'npc_definitions.csv'
+_npc_definitions = {}
+def load_npc_definitions(path=NPC_DEFINITIONS_PATH):
+  # Parsed once per file, the rows are shared by every registry and must not be modified
+  path = Path(path)
+  if path not in _npc_definitions:
+    definitions = {}
+    with path.open(newline='') as definitions_file:
+      for row in csv.DictReader(definitions_file):
+        definition = {}
+        for field, value in row.items():
+          if value is None or value == '':
+            continue
+          definition[field] = value if field == 'name' else int(value)
+        definitions[definition['id']] = definition
+    _npc_definitions[path] = definitions
+  return _npc_definitions[path]
+
 class NpcRegistry:
-  def __init__(self) -> None:
+  def __init__(self, npc_definitions=None) -> None:
+    self.npc_definitions = npc_definitions if npc_definitions is not None else load_npc_definitions()
     self._initialize_state()
 
   def _initialize_state(self):
     # Give us a clean slate to work from
     self._npcs = []
     self.current_slot = 0
-    self.npc_chunk_lookup = defaultdict(lambda: defaultdict(dict))
-    self.npc_tile_lookup = defaultdict(lambda: defaultdict(dict))
+    # Lookups for each plane as (tile lookup, chunk lookup, position lookup), created when an npc is added to the plane
+    self._plane_lookups = {}
+    self.npc_tile_lookup, self.npc_chunk_lookup, self.npc_position_lookup = self._lookups(0)
+    # Bumped whenever an npc moves, dies or is created so per-tick query caches know to refresh
+    self.version = 0
+    # Distance from a player that aggressive npcs need to be searched for, None if there are none
+    self.max_hunt_range = None
 
   def reset(self):
+    # The version keeps counting up so caches filled before the reset aren't mistaken for current ones
+    version = self.version
     self._initialize_state()
+    self.version = version + 1
 
   @property
   def registered_npcs(self):
     return self._npcs
 
-  def create_npc(self, x, y, walkability_strategy, hunt_strategy, opts={}):
-    npc = Npc(self._next_slot(), x, y, self, walkability_strategy, hunt_strategy, opts)
+  def _lookups(self, plane):
+    lookups = self._plane_lookups.get(plane)
+    if lookups is None:
+      # Npcs keyed by their (south west) coordinate only in the position lookup, used for range queries
+      lookups = (defaultdict(lambda: defaultdict(dict)), defaultdict(lambda: defaultdict(dict)), defaultdict(dict))
+      self._plane_lookups[plane] = lookups
+    return lookups
+
+  def create_npc(self, x, y, walkability_strategy, hunt_strategy, opts={}, plane=0):
+    npc = Npc(self._next_slot(), x, y, self, walkability_strategy, hunt_strategy, opts, plane)
+    self.version += 1
 
     # Add them to the chunk for tracking
     chunk = self._get_chunk(x, y)
     self._add_to_chunk(npc, chunk[0], chunk[1])
     self._add_to_tile(npc, x, y)
+    self._lookups(plane)[2][(x, y)][npc.slot_index] = npc
 
     # Add to registered npc list
     self._npcs.append(npc)
 
-    return npc
-
-  def get_npcs_in_tile(self, tile_x, tile_y):
-    return self.npc_tile_lookup[tile_x][tile_y].values()
+    if npc.aggressive:
+      # The query is on the npc's south west tile, so large npcs can hunt from farther away
+      reach = npc.hunt_range + npc.size - 1
+      self.max_hunt_range = reach if self.max_hunt_range is None else max(self.max_hunt_range, reach)
 
-  def get_living_npcs_in_tile(self, tile_x, tile_y):
-    return [n for n in self.npc_tile_lookup[tile_x][tile_y].values() if n.is_dead() is False]
-
-  def get_npcs_in_chunk(self, chunk_x, chunk_y):
-    return self.npc_chunk_lookup[chunk_x][chunk_y].values()
+    return npc
 
-  def get_living_npcs_in_chunk(self, chunk_x, chunk_y):
-    return [n for n in self.get_npcs_in_chunk(chunk_x, chunk_y) if n.is_dead() is False]
+  def get_npcs_in_tile(self, tile_x, tile_y, plane=0):
+    tile_lookup = self.npc_tile_lookup if plane == 0 else self._lookups(plane)[0]
+    return tile_lookup[tile_x][tile_y].values()
+
+  def get_living_npcs_in_tile(self, tile_x, tile_y, plane=0):
+    tile_lookup = self.npc_tile_lookup if plane == 0 else self._lookups(plane)[0]
+    return [n for n in tile_lookup[tile_x][tile_y].values() if n.is_dead() is False]
+
+  def get_npcs_in_chunk(self, chunk_x, chunk_y, plane=0):
+    chunk_lookup = self.npc_chunk_lookup if plane == 0 else self._lookups(plane)[1]
+    return chunk_lookup[chunk_x][chunk_y].values()
+
+  def get_living_npcs_in_chunk(self, chunk_x, chunk_y, plane=0):
+    return [n for n in self.get_npcs_in_chunk(chunk_x, chunk_y, plane) if n.is_dead() is False]
+
+  # Queries covering more tiles than this walk the overlapping 8x8 chunks instead of every tile
+  TILE_SCAN_LIMIT = 25
+  def get_living_npcs_in_range(self, center, radius, plane=0):
+    # Living npcs whose coordinate (south west tile) is within Chebyshev distance radius of center
+    cx, cy = center
+    npcs = []
+    if (2*radius + 1)**2 <= self.TILE_SCAN_LIMIT:
+      position_lookup = self.npc_position_lookup if plane == 0 else self._lookups(plane)[2]
+      for x in range(cx - radius, cx + radius + 1):
+        for y in range(cy - radius, cy + radius + 1):
+          occupants = position_lookup.get((x, y))
+          if occupants:
+            for npc in occupants.values():
+              if not npc._is_dead:
+                npcs.append(npc)
+      return npcs
+
+    chunk_lookup = self.npc_chunk_lookup if plane == 0 else self._lookups(plane)[1]
+    for chunk_x in range((cx - radius) // 8, (cx + radius) // 8 + 1):
+      chunks = chunk_lookup.get(chunk_x)
+      if not chunks:
+        continue
+      for chunk_y in range((cy - radius) // 8, (cy + radius) // 8 + 1):
+        chunk = chunks.get(chunk_y)
+        if not chunk:
+          continue
+        for npc in chunk.values():
+          if not npc._is_dead and abs(npc._x - cx) <= radius and abs(npc._y - cy) <= radius:
+            npcs.append(npc)
+    return npcs
 
   def update_npc_location(self, npc, old_coord, new_coord):
+    self.version += 1
 
     self._remove_from_tile(npc, old_coord[0], old_coord[1])
     self._add_to_tile(npc, new_coord[0], new_coord[1])
+    position_lookup = self.npc_position_lookup if npc.plane == 0 else self._lookups(npc.plane)[2]
+    position_lookup[old_coord].pop(npc.slot_index, None)
+    position_lookup[new_coord][npc.slot_index] = npc
 
     old_chunk = self._get_chunk(old_coord[0], old_coord[1])
     new_chunk = self._get_chunk(new_coord[0], new_coord[1])
@@ -228,33 +779,36 @@ class NpcRegistry:
       self._remove_from_chunk(npc, old_chunk[0], old_chunk[1])
       self._add_to_chunk(npc, new_chunk[0], new_chunk[1])
 
+  # Used to pick out the spawns for the default spots, stats live in npc_definitions.csv
   GUARD_IDS = {3269, 11942, 11943, 11944, 3270, 11945, 3271, 11946, 11947, 3273, 3274}
   SKELETON_IDS = {70, 71, 72, 73}
   def get_npc_stats(self, npc_struct):
+    # Npcs missing from the table can't be attacked. The returned dict is shared, copy it before changing it.
     npc_id = npc_struct['id']
-    if npc_id in self.GUARD_IDS:
-      return {'id': npc_id, 'max_range': 4, 'wander_range': 2, 'hitpoints': 22, 'combat_level': 10, 'name': 'Guard'}
-    if npc_id in self.SKELETON_IDS:
-      return {'id': npc_id, 'respawn_time': 70, 'max_range': 10, 'wander_range': 8, 'hitpoints': 29, 'combat_level': 22, 'name': 'Skeleton'}
-    return {'id': npc_id, 'combat_level': 0 }
+    definition = self.npc_definitions.get(npc_id)
+    if definition is None:
+      return {'id': npc_id, 'combat_level': 0}
+    return definition
 
   def _add_to_tile(self, npc, tile_x, tile_y):
+    tile_lookup = self.npc_tile_lookup if npc.plane == 0 else self._lookups(npc.plane)[0]
     size = npc.size
     for i in range(size):
       for j in range(size):
-        self.npc_tile_lookup[tile_x + i][tile_y + j][npc.slot_index] = npc
+        tile_lookup[tile_x + i][tile_y + j][npc.slot_index] = npc
 
   def _remove_from_tile(self, npc, tile_x, tile_y):
+    tile_lookup = self.npc_tile_lookup if npc.plane == 0 else self._lookups(npc.plane)[0]
     size = npc.size
     for i in range(size):
       for j in range(size):
-        self.npc_tile_lookup[tile_x + i][tile_y + j].pop(npc.slot_index, None)
+        tile_lookup[tile_x + i][tile_y + j].pop(npc.slot_index, None)
 
   def _add_to_chunk(self, npc, chunk_x, chunk_y):
-    self.npc_chunk_lookup[chunk_x][chunk_y][npc.slot_index] = npc
+    self._lookups(npc.plane)[1][chunk_x][chunk_y][npc.slot_index] = npc
 
   def _remove_from_chunk(self, npc, chunk_x, chunk_y):
-    self.npc_chunk_lookup[chunk_x][chunk_y].pop(npc.slot_index, None)
+    self._lookups(npc.plane)[1][chunk_x][chunk_y].pop(npc.slot_index, None)
 
   def _get_chunk(self, x, y):
     return (x // 8, y // 8)
@@ -282,11 +836,12 @@ class NpcMovement:
     self.successful = successful
 
 class Npc:
-  def __init__(self, slot_index: int, x: int, y: int, npc_registry, walkability_strategy, hunt_strategy=None, opts={}):
+  def __init__(self, slot_index: int, x: int, y: int, npc_registry, walkability_strategy, hunt_strategy=None, opts={}, plane=0):
     self.queue = []
     self.slot_index = slot_index
     self._x = x
     self._y = y
+    self.plane = plane
     self.respawn_coordinate = (x, y)
     self.travel_path = []
 
@@ -301,9 +856,18 @@ class Npc:
     self.maxrange = opts.get('max_range', 7)
     self.size = opts.get('size', 1)
     self.attack_range = opts.get('attack_range', 1)
+    self.aggressive = bool(opts.get('aggressive', 0))
+    self.hunt_range = opts.get('hunt_range', 0)
     self.hunt_strategy = hunt_strategy
+    # Where this Npc's random draws come from, the shared module unless a sweep gives it a stream of its own
+    self.rng = random
+    # Players don't move during a sim, so these only depend on where the player and this Npc stand
+    self._can_follow_cache = {}
+    self._follow_targets = {}
     self.respawn()
     self.times_died = 0
+    # Queued on the player every tick this Npc is in melee range
+    self._melee_action = DamageAction(0, self)
 
     # TODO: This feels kinda hacky
     self.map_registry = walkability_strategy.map_registry
@@ -321,7 +885,7 @@ class Npc:
     return (x <= sw_x <= x2 or x <= ne_x <= x2) and (y <= sw_y <= y2 or y <= ne_y <= y2)
 
   def is_in_multicombat(self):
-    self.map_registry.is_in_multicombat(self.coordinate)
+    return self.map_registry.is_in_multicombat(self.coordinate)
 
   def is_dead(self):
     return self._is_dead
@@ -329,6 +893,10 @@ class Npc:
   def is_attackable(self):
     return self._combat_level != 0
 
+  def is_idle(self):
+    # Alive and wandering with nothing queued, so its timers, queue and interaction have nothing to do
+    return not self._is_dead and self._mode == NpcMode.WANDER and self.interacting_with is None and not self.queue
+
   def respawn(self):
     self._is_dead = False
     self.hitpoints = self.max_hitpoints
@@ -348,8 +916,9 @@ class Npc:
     self.hitpoints = 0
     self.respawn_time_remaining = self.respawn_time
     # TODO: Does the queue actually get cleared on death? Is there a death queue? Do we care here?
-    self.queue = []
+    self.queue.clear()
     self.times_died += 1
+    self.npc_registry.version += 1
     self.set_interaction(None)
     if self.kill_credit_player:
       self.kill_credit_player.give_loot(self)
@@ -365,13 +934,16 @@ class Npc:
     self.queue.append(action)
 
   def perform_queue(self):
-    new_queue = []
-    for action in self.queue:
+    # Queues are emptied in place, most ticks there is nothing queued and nothing is allocated
+    queue = self.queue
+    if not queue:
+      return
+    for action in queue:
       # If action causes the npc to die, the queue will clear and we need to break
       action.act_on(self)
-      if self.is_dead():
+      if self._is_dead:
         break
-    self.queue = new_queue
+    queue.clear()
 
   def take_damage(self, amount, attacker):
     damage_taken = min(amount, self.hitpoints)
@@ -397,6 +969,13 @@ class Npc:
     self.interacting_with = entity
 
   def can_follow(self, player):
+    can_follow = self._can_follow_cache.get(player.coordinate)
+    if can_follow is None:
+      can_follow = self._can_follow_from_spawn(player)
+      self._can_follow_cache[player.coordinate] = can_follow
+    return can_follow
+
+  def _can_follow_from_spawn(self, player):
     # MELEE (non halberd)
     # Can I in any world (without obstacles) attack?
 
@@ -414,6 +993,25 @@ class Npc:
 
     return False
 
+  def can_hunt(self, player):
+    # Only idle aggressive npcs go looking for a fight
+    if not self.aggressive or self.mode != NpcMode.WANDER or self.interacting_with is not None:
+      return False
+    # Distance from the closest tile the npc covers
+    px, py = player.coordinate
+    dist_x = max(self.x - px, px - (self.x + self.size - 1), 0)
+    dist_y = max(self.y - py, py - (self.y + self.size - 1), 0)
+    if max(dist_x, dist_y) > self.hunt_range:
+      return False
+    if not self.can_follow(player):
+      return False
+    return self.hunt_strategy.has_line_of_sight(self.coordinate, player.coordinate)
+
+  def hunt(self, player):
+    debug(f'Npc {self.slot_index} is hunting {player}')
+    self.set_interaction(player)
+    self.mode = NpcMode.PLAYERFOLLOW
+
   def can_attack(self, player_coordinate):
     # This only works for regular melee
     x, y = player_coordinate
@@ -469,12 +1067,30 @@ class Npc:
         delta = (-self.maxrange, -self.maxrange) # SOUTH WEST CORNER
     self.destination_tile = (self.respawn_coordinate[0] + delta[0], self.respawn_coordinate[1] + delta[1])
 
+  def perform_idle_move(self):
+    # perform_move for an idle npc in a quiet tick, only the wandering step has anything to do
+    self.wander()
+    self.move()
+
   def wander(self):
-    should_pick_new_dest = random.randint(0, 7) == 0
+    rng = self.rng
+    should_pick_new_dest = rng.randint(0, 7) == 0
     if should_pick_new_dest:
-      self.destination_tile = (random.randint(-self.wanderrange, self.wanderrange) + self.respawn_coordinate[0], random.randint(-self.wanderrange, self.wanderrange) + self.respawn_coordinate[1])
+      self.destination_tile = (rng.randint(-self.wanderrange, self.wanderrange) + self.respawn_coordinate[0], rng.randint(-self.wanderrange, self.wanderrange) + self.respawn_coordinate[1])
 
   def follow(self):
+    key = (self.coordinate, self.interacting_with.coordinate)
+    destination_tile = self._follow_targets.get(key)
+    if destination_tile is None:
+      destination_tile = self._find_follow_target()
+      if destination_tile is None:
+        # Player is on top of the Npc, which is random every time
+        return
+      self._follow_targets[key] = destination_tile
+    self.destination_tile = destination_tile
+
+  def _find_follow_target(self):
+    # Returns the tile to path to, or None after picking a random one because the player is on top of the Npc
     # Assumes the destination tile is one of the ones next to the player
     x = self.interacting_with.x
     y = self.interacting_with.y
@@ -485,17 +1101,16 @@ class Npc:
 
     # If we have LOS and can attack, set dest tile to this
     if self.hunt_strategy.has_line_of_sight(self.coordinate, self.interacting_with.coordinate) and self.can_attack(self.interacting_with.coordinate):
-      self.destination_tile = self.coordinate
-      return
+      return self.coordinate
 
     # If the player is on top of the Npc, move randomly
     if self.collides_with(self.interacting_with.coordinate, 1):
-      direction = 1 if random.random() < 0.5 else -1
-      if random.random() < 0.5:
+      direction = 1 if self.rng.random() < 0.5 else -1
+      if self.rng.random() < 0.5:
         self.destination_tile = (x+direction, y)
       else:
         self.destination_tile = (x, y+direction)
-      return
+      return None
 
     north_tile_distance = cheb(north_tile, self.coordinate)
     south_tile_distance = cheb(south_tile, self.coordinate)
@@ -508,13 +1123,13 @@ class Npc:
     min_dist = min(north_tile_distance, south_tile_distance, east_tile_distance, west_tile_distance)
     # Order of checks here is important since an Npc on the NE/NW tile will path to the N tile and SE/SW paths S
     if min_dist == north_tile_distance:
-      self.destination_tile = north_tile
+      return north_tile
     elif min_dist == south_tile_distance:
-      self.destination_tile = south_tile
+      return south_tile
     elif min_dist == east_tile_distance:
-      self.destination_tile = east_tile
+      return east_tile
     else:
-      self.destination_tile = west_tile
+      return west_tile
 
   def move(self):
     # Moving to the destination
@@ -571,7 +1186,7 @@ class Npc:
           self.queue_damage(self.interacting_with)
 
   def queue_damage(self, target):
-    target.add_to_queue(DamageAction(0, self))
+    target.add_to_queue(self._melee_action)
 
   @property
   def x(self):
@@ -602,6 +1217,9 @@ class Npc:
       self._destination_tile = coord
 
 class HuntStrategy:
+  # Set by the Engine when instrumentation is enabled
+  stats = None
+
   def __init__(self, map_registry, npc_registry, player_registry):
     self.map_registry = map_registry
     self.npc_registry = npc_registry
@@ -650,11 +1268,15 @@ class HuntStrategy:
         y = self._zero_fill_right_shift(y_big, 16)
         if self.map_registry.get_objs((x, y)).get('projectile_flags', 0) & x_flags != 0:
           # Hit something on the x axis
+          if self.stats is not None:
+            self.stats.increment('los.steps', abs(x - coord[0]))
           return False
         y_big += slope
         next_y = self._zero_fill_right_shift(y_big, 16)
         if next_y != y and self.map_registry.get_objs((x, next_y)).get('projectile_flags', 0) & y_flags != 0:
           # Hit something on the y axis
+          if self.stats is not None:
+            self.stats.increment('los.steps', abs(x - coord[0]))
           return False
     else:
       y = coord[1]
@@ -669,12 +1291,18 @@ class HuntStrategy:
 
         if self.map_registry.get_objs((x, y)).get('projectile_flags', 0) & y_flags != 0:
           # Hit something on the y axis
+          if self.stats is not None:
+            self.stats.increment('los.steps', abs(y - coord[1]))
           return False
         x_big += slope
         next_x = self._zero_fill_right_shift(x_big, 16)
         if next_x != x and self.map_registry.get_objs((next_x, y)).get('projectile_flags', 0) & x_flags != 0:
           # Hit something on the x axis
+          if self.stats is not None:
+            self.stats.increment('los.steps', abs(y - coord[1]))
           return False
+    if self.stats is not None:
+      self.stats.increment('los.steps', max(dx_abs, dy_abs))
     return True
 
 class SimpleHuntStrategy(HuntStrategy):
@@ -693,31 +1321,69 @@ class CannonHuntStrategy(HuntStrategy):
 
     return True
   
+  def __init__(self, map_registry, npc_registry, player_registry):
+    super().__init__(map_registry, npc_registry, player_registry)
+    # Range queries shared by every cannon using this strategy, valid until an npc moves or dies.
+    # Npcs don't change during the player phase, so cannons firing in the same tick reuse each other's queries.
+    self._range_cache = {}
+    self._range_cache_version = None
+
+  def get_living_npcs_in_range(self, center, radius, plane=0):
+    if self._range_cache_version != self.npc_registry.version:
+      self._range_cache = {}
+      self._range_cache_version = self.npc_registry.version
+    key = (center, radius, plane)
+    npcs = self._range_cache.get(key)
+    if npcs is None:
+      npcs = self.npc_registry.get_living_npcs_in_range(center, radius, plane)
+      self._range_cache[key] = npcs
+    return npcs
+
+  def _in_chunk_order(self, center, npcs, plane):
+    # Equally close npcs are targeted in the order the cannon has always walked the chunks around the center:
+    # east to west, north to south, then by when they entered the chunk
+    candidates = set(npcs)
+    center_chunk = (center[0] // 8, center[1] // 8)
+    ordered = []
+    for x_chunk_offset in [1, 0, -1]:
+      for y_chunk_offset in [1, 0, -1]:
+        for npc in self.npc_registry.get_npcs_in_chunk(center_chunk[0] + x_chunk_offset, center_chunk[1] + y_chunk_offset, plane):
+          if npc in candidates:
+            ordered.append(npc)
+    return ordered
+
+  # Cook code ahead
+  ORDINAL_CANNON_DISTANCES = [2, 5, 12]
+  CARDINAL_CANNON_DISTANCES = [3, 7, 14]
+  CANNON_RANGES = [1, 2, 5]
+
   def get_target(self, cannon):
     # TODO: Edge case - Cannon would have targeted an npc in singles, but the player is in combat. If an npc is in multi a few tiles farther from the center, will it cannon?
     origin = cannon.coordinate
     direction = cannon.direction
-    # Cook code ahead
-    ordinal_cannon_distances = [2, 5, 12]
-    cardinal_cannon_distances = [3, 7, 14]
-    cannon_ranges = [1, 2, 5]
+    ordinal_cannon_distances = self.ORDINAL_CANNON_DISTANCES
+    cardinal_cannon_distances = self.CARDINAL_CANNON_DISTANCES
+    cannon_ranges = self.CANNON_RANGES
 
     is_cardinal = (direction[0] + direction[1]) % 2 != 0
     distances = cardinal_cannon_distances if is_cardinal else ordinal_cannon_distances
+    player_in_combat = cannon.player.is_in_combat()
     for i in range(3):
       center = (origin[0] + direction[0] * distances[i], origin[1] + direction[1] * distances[i])
-      center_chunk = (center[0]//8, center[1]//8)
 
       npcs_in_range = []
-      for x_chunk_offset in [1, 0, -1]:
-        for y_chunk_offset in [1, 0, -1]:
-          chunk = (center_chunk[0] + x_chunk_offset, center_chunk[1] + y_chunk_offset)
-          for npc in self.npc_registry.get_living_npcs_in_chunk(chunk[0], chunk[1]):
-            if npc.is_attackable():
-              if npc.is_in_multicombat() or not cannon.player.is_in_combat():
-                if cheb(center, npc.coordinate) <= cannon_ranges[i]:
-                  npcs_in_range.append(npc)
-      npcs_in_range.sort(key=lambda npc: euclidean(center, npc.coordinate))
+      for npc in self.get_living_npcs_in_range(center, cannon_ranges[i], cannon.plane):
+        if npc.is_attackable():
+          if not player_in_combat or npc.is_in_multicombat():
+            npcs_in_range.append(npc)
+      if len(npcs_in_range) > 1:
+        npcs_in_range.sort(key=lambda npc: euclidean_squared(center, npc.coordinate))
+        if euclidean_squared(center, npcs_in_range[0].coordinate) == euclidean_squared(center, npcs_in_range[1].coordinate):
+          npcs_in_range = self._in_chunk_order(center, npcs_in_range, cannon.plane)
+          npcs_in_range.sort(key=lambda npc: euclidean_squared(center, npc.coordinate))
+      if self.stats is not None:
+        self.stats.increment('cannon.spatial_queries')
+        self.stats.increment('cannon.candidates_sorted', len(npcs_in_range))
 
       if len(npcs_in_range) > 0:
         # The LOS check seems to happen after selecting a target, and if that target can't be hit the cannon does not fire
@@ -735,9 +1401,17 @@ class Cannon:
     self._x = x
     self._y = y
     self.player = player
+    # Cannons are always on the plane of the player that set them up
+    self.plane = player.plane
     # X, Y (positive is right and up resp.)
     self.direction = (0, 1)
     self.hunt_strategy = hunt_strategy
+    # Damage is uniform over min_hit..max_hit
+    self.min_hit = 0
+    self.max_hit = 30
+    self.rng = random
+    # Indexed by damage, grown if max_hit is raised (see damage_actions)
+    self._damage_actions = damage_actions(player, self.max_hit)
 
     self.MOVEMENTS = {
       0: {1: (1, 1), -1: (-1, -1)},
@@ -756,14 +1430,26 @@ class Cannon:
   def turn(self):
     self.direction = self.MOVEMENTS[self.direction[0]][self.direction[1]]
 
+  def get_target_areas(self):
+    # (x, y, radius) of the 24 areas the cannon checks over a full turn, see CannonHuntStrategy.get_target
+    areas = []
+    for direction in STEP_DIRECTIONS:
+      is_cardinal = (direction[0] + direction[1]) % 2 != 0
+      distances = CannonHuntStrategy.CARDINAL_CANNON_DISTANCES if is_cardinal else CannonHuntStrategy.ORDINAL_CANNON_DISTANCES
+      for distance, radius in zip(distances, CannonHuntStrategy.CANNON_RANGES):
+        areas.append((self._x + direction[0] * distance, self._y + direction[1] * distance, radius))
+    return areas
+
   def fire(self):
     npc = self.get_target()
     if npc:
       self.queue_damage(npc)
 
   def queue_damage(self, npc: Npc):
-    damage = random.randint(0, 30)
-    npc.add_to_queue(DamageAction(damage, self.player))
+    damage = self.rng.randint(self.min_hit, self.max_hit)
+    if damage >= len(self._damage_actions):
+      self._damage_actions = damage_actions(self.player, damage)
+    npc.add_to_queue(self._damage_actions[damage])
   
   def get_target(self):
     return self.hunt_strategy.get_target(self)
@@ -771,19 +1457,48 @@ class Cannon:
 class PlayerRegistry:
   def __init__(self) -> None:
     self._players = []
+    # Number of players standing on each (x, y, plane), checked on every walkability probe
+    self.player_tile_lookup = {}
 
   @property
   def registered_players(self):
     return self._players
 
-  def create_player(self, coordinate, cannon_strategy):
-    player = Player(coordinate, cannon_strategy)
+  def create_player(self, coordinate, cannon_strategy, plane=0):
+    player = Player(coordinate, cannon_strategy, self, plane)
     self._players.append(player)
+    self._add_to_tile(player.coordinate, plane)
     return player
 
+  def is_tile_occupied(self, tile_x, tile_y, plane=0):
+    return (tile_x, tile_y, plane) in self.player_tile_lookup
+
+  def get_players_in_tile(self, tile_x, tile_y, plane=0):
+    if not self.is_tile_occupied(tile_x, tile_y, plane):
+      return []
+    return [p for p in self._players if p.coordinate == (tile_x, tile_y) and p.plane == plane]
+
+  def update_player_location(self, player, old_coord, new_coord):
+    self._remove_from_tile(old_coord, player.plane)
+    self._add_to_tile(new_coord, player.plane)
+
+  def _add_to_tile(self, coordinate, plane):
+    key = (coordinate[0], coordinate[1], plane)
+    self.player_tile_lookup[key] = self.player_tile_lookup.get(key, 0) + 1
+
+  def _remove_from_tile(self, coordinate, plane):
+    key = (coordinate[0], coordinate[1], plane)
+    remaining = self.player_tile_lookup.get(key, 0) - 1
+    if remaining > 0:
+      self.player_tile_lookup[key] = remaining
+    else:
+      self.player_tile_lookup.pop(key, None)
+
 class Player:
-  def __init__(self, coordinate, cannon_strategy):
+  def __init__(self, coordinate, cannon_strategy, player_registry=None, plane=0):
     self.queue = []
+    self.player_registry = player_registry
+    self.plane = plane
     self._cannon = None
     self._x = coordinate[0] 
     self._y = coordinate[1] 
@@ -793,20 +1508,40 @@ class Player:
     self.in_combat_with = None
     self.time_to_next_attack = 0
     self.attack_speed = 5
+    # TODO: THIS IS FANG DAMAGE RANGE
+    self.min_hit = 5
+    self.max_hit = 30
+    self.rng = random
+    self._damage_actions = damage_actions(self, self.max_hit)
+    # Aggressive npcs ignore a player that has stayed in the area this long (10 minutes), None to never become tolerant
+    self.aggression_tolerance = 1000
+    self.ticks_in_area = 0
 
     # TODO: This feels hacky
     self.map_registry = cannon_strategy.map_registry
 
   def perform_queue(self):
-    new_queue = []
-    for action in self.queue:
+    queue = self.queue
+    if not queue:
+      return
+    for action in queue:
       action.act_on(self)
-    self.queue = new_queue
+    queue.clear()
 
   def perform_timers(self):
+    self.ticks_in_area += 1
     if self.cannon():
       self.cannon().process_tick()
 
+  def perform_idle_timers(self):
+    # perform_timers for a tick where the cannon can't have a target, it only turns
+    self.ticks_in_area += 1
+    if self.cannon():
+      self.cannon().turn()
+
+  def is_tolerant_of_aggression(self):
+    return self.aggression_tolerance is not None and self.ticks_in_area >= self.aggression_tolerance
+
   def perform_interact(self):
     # interact with npcs
     # TODO: This will not work for non-melee enemies
@@ -840,6 +1575,8 @@ class Player:
   
   @coordinate.setter
   def coordinate(self, new_coordinate):
+    if self.player_registry:
+      self.player_registry.update_player_location(self, self.coordinate, tuple(new_coordinate))
     self._x = new_coordinate[0]
     self._y = new_coordinate[1]
 
@@ -858,51 +1595,119 @@ class Player:
     return self.in_combat_with == entity
 
   def is_in_multicombat(self):
-    self.map_registry.is_in_multicombat(self.coordinate)
+    return self.map_registry.is_in_multicombat(self.coordinate)
 
   def add_to_queue(self, action: Action):
     self.queue.append(action)
 
   def queue_damage(self, npc: Npc):
-    # TODO: THIS IS FANG DAMAGE RANGE
-    damage = random.randint(5, 30)
-    npc.add_to_queue(DamageAction(damage, self))
+    damage = self.rng.randint(self.min_hit, self.max_hit)
+    if damage >= len(self._damage_actions):
+      self._damage_actions = damage_actions(self, damage)
+    npc.add_to_queue(self._damage_actions[damage])
 
 class MapRegistry:
-  def __init__(self, map_config):
+  # Each MapRegistry answers for a single plane so the per tile queries don't need to look the plane up.
+  # Registries for the other planes of the same region are reached through for_plane.
+  def __init__(self, map_config, multicombat=None, plane=0):
     self.map_config = map_config
+    # TileBitmap of multi-combat tiles (see create_multicombat_map), everywhere is singles without one
+    self.multicombat = multicombat
+    self.plane = plane
+    self.planes = {plane: self}
+    # See PrecomputedWalkabilityStrategy
+    self.clearance_map = None
+    # Registry whose clearance map this one uses. Registries over the same map_config can point at one
+    # registry so they share a clearance map, see Scenario.get_map_registry.
+    self.clearance_owner = self
+
+  # Npcs up to this size are covered by the first clearance map built, so mixing sizes doesn't cause rebuilds
+  MIN_CLEARANCE_SIZE = 3
+  def get_clearance_map(self, size):
+    if self.clearance_owner is not self:
+      return self.clearance_owner.get_clearance_map(size)
+    clearance_map = self.clearance_map
+    if clearance_map is None or clearance_map.max_size < size:
+      clearance_map = ClearanceMap(self, max(size, self.MIN_CLEARANCE_SIZE))
+      self.clearance_map = clearance_map
+    return clearance_map
+
+  def add_plane(self, map_registry):
+    # Link another plane's registry with this one (and every plane already linked)
+    self.planes.update(map_registry.planes)
+    for linked in self.planes.values():
+      linked.planes = self.planes
+    return map_registry
+
+  def for_plane(self, plane):
+    return self.planes[plane]
 
   def get_objs(self, coordinate):
     return self.map_config.get(coordinate[0], {}).get(coordinate[1], {})
 
+  def get_objs_on_plane(self, coordinate, plane):
+    return self.planes[plane].get_objs(coordinate)
+
   def is_in_multicombat(self, coordinate):
-    # TODO: Implement method
-    return False
+    multicombat = self.multicombat
+    if multicombat is None:
+      return False
+    return multicombat.get(coordinate)
 
+# Default spot, the skeletons for the champion challenge
 c = (3378, 9749)
-map_config = create_map_config(c)
-map_registry = MapRegistry(map_config)
-def run_engine():
-  npc_registry = NpcRegistry()
+DEFAULT_CANNON_TILE = (3379, 9746)
+DEFAULT_TICKS = 6000
+
+# Compiled maps keyed by region and plane, so every run at a spot (and every spot in the region) shares one
+_map_registries = {}
+def get_map_registry(coordinate, plane=0):
+  key = (region_for(coordinate), plane)
+  if key not in _map_registries:
+    map_registry = MapRegistry(create_map_config(coordinate, plane), create_multicombat_map(coordinate, plane=plane), plane)
+    for (region, _), other_plane in _map_registries.items():
+      if region == key[0]:
+        other_plane.add_plane(map_registry)
+        break
+    _map_registries[key] = map_registry
+  return _map_registries[key]
+
+def build_engine(player_tile, cannon_tile, map_registry=None, npc_structs=None, npc_ids=None, npc_stats=None, stats=None, npc_definitions=None, walkability_strategy_class=None, plane=0, fast_forward=True):
+  # Everything is simulated on one plane, spawns on other planes are left out
+  # npc_ids limits which spawns are simulated (None for all of them)
+  # npc_stats maps an npc id to stats that override NpcRegistry.get_npc_stats
+  # npc_definitions replaces the default npc table (see load_npc_definitions)
+  if map_registry is None:
+    map_registry = get_map_registry(player_tile, plane)
+  if npc_structs is None:
+    npc_structs = relevant_npcs(player_tile, plane)
+  npc_registry = NpcRegistry(npc_definitions)
   player_registry = PlayerRegistry()
 
   # Populate npc_registry
-  npc_structs = relevant_npcs(c)
-  strategy = SimpleWalkabilityStrategy(map_registry, npc_registry, player_registry)
+  strategy = (walkability_strategy_class or PrecomputedWalkabilityStrategy)(map_registry, npc_registry, player_registry)
   hunt_strategy = SimpleHuntStrategy(map_registry, npc_registry, player_registry)
+  overridden_stats = {}
   for s in npc_structs:
-    if s['id'] in npc_registry.SKELETON_IDS:
-      npc_registry.create_npc(s['x'], s['y'], strategy, hunt_strategy, opts=npc_registry.get_npc_stats(s))
+    # Spawns without a plane (like inline scenario npcs) are on the engine's plane
+    if s.get('p', plane) != plane:
+      continue
+    if npc_ids is None or s['id'] in npc_ids:
+      opts = npc_registry.get_npc_stats(s)
+      if npc_stats and s['id'] in npc_stats:
+        # Built once per id rather than per spawn
+        if s['id'] not in overridden_stats:
+          overridden_stats[s['id']] = {**opts, **npc_stats[s['id']]}
+        opts = overridden_stats[s['id']]
+      npc_registry.create_npc(s['x'], s['y'], strategy, hunt_strategy, opts=opts, plane=plane)
 
   # Populate player_registry
-  player = player_registry.create_player(c, CannonHuntStrategy(map_registry, npc_registry, player_registry))
-  player.place_cannon((3379, 9746))
+  player = player_registry.create_player(tuple(player_tile), CannonHuntStrategy(map_registry, npc_registry, player_registry), plane)
+  player.place_cannon(tuple(cannon_tile))
 
-  # Create and run engine
-  engine = Engine(map_registry, npc_registry, player_registry)
-  ticks_to_run = 6000
-  engine.perform_ticks(ticks_to_run)
+  return Engine(map_registry, npc_registry, player_registry, stats, fast_forward)
 
+def count_kills(npc_registry):
   # KC stats
   total_deaths = 0
   for npc in npc_registry.registered_npcs:
@@ -911,10 +1716,15 @@ def run_engine():
       total_deaths += npc.times_died
   return total_deaths
 
+def run_engine(stats=None, player_tile=c, cannon_tile=DEFAULT_CANNON_TILE, npc_ids=NpcRegistry.SKELETON_IDS, npc_stats=None, ticks=DEFAULT_TICKS, map_registry=None, npc_structs=None, npc_definitions=None, plane=0):
+  engine = build_engine(player_tile, cannon_tile, map_registry, npc_structs, npc_ids, npc_stats, stats, npc_definitions, plane=plane)
+  engine.perform_ticks(ticks)
+  return count_kills(engine.npc_registry)
+
 if __name__ == '__main__':
   
   results = []
   for i in range(1000):
     print(f'Starting run {i}...')
     results.append(run_engine())
-  print(results)
\ No newline at end of file
+  print(results)
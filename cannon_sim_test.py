@@ -1,6 +1,9 @@
+import asyncio
+import random
 from unittest import TestCase, main
 from unittest.mock import Mock
 from cannon_sim import *
+from create_map import FULL_BLOCK_MOVEMENT_FLAGS, TileBitmap, TileFlagMask, create_multicombat_map, create_multicombat_map_for_zones, fold_tile_settings
 
 def is_north_tile_walkable(strategy, coord, npc):
   return strategy.is_walkable_tile(coord, (coord[0], coord[1] + 1), npc)
@@ -136,6 +139,9 @@ class SimpleWalkabilityStrategyTest(TestCase):
     self.assertTrue(is_west_tile_walkable(strategy, coord, self.npc))
     self.assertTrue(is_northwest_tile_walkable(strategy, coord, self.npc))
 
+# Large monster walkability should be the same whichever strategy is used
+WALKABILITY_STRATEGIES = [SimpleWalkabilityStrategy, PrecomputedWalkabilityStrategy]
+
 class LargeMonsterTest(TestCase):
 
   def test_is_walkable_blocks_large_monsters_with_object(self):
@@ -143,11 +149,12 @@ class LargeMonsterTest(TestCase):
     npc = npc_registry.create_npc(0, 0, StubWalkabilityStrategy(), StubHuntStrategy(), opts={'size': 2})
 
     map_registry = MapRegistry({ 1: { 0: {'movement_flags': Mask.BOTTOM, 'projectile_flags': 0 } } })
-    strategy = SimpleWalkabilityStrategy(map_registry, npc_registry, PlayerRegistry())
-    coord = (0, 0)
-    self.assertFalse(is_south_tile_walkable(strategy, coord, npc))
-    self.assertFalse(is_southwest_tile_walkable(strategy, coord, npc))
-    self.assertFalse(is_southeast_tile_walkable(strategy, coord, npc))
+    for strategy_class in WALKABILITY_STRATEGIES:
+      strategy = strategy_class(map_registry, npc_registry, PlayerRegistry())
+      coord = (0, 0)
+      self.assertFalse(is_south_tile_walkable(strategy, coord, npc))
+      self.assertFalse(is_southwest_tile_walkable(strategy, coord, npc))
+      self.assertFalse(is_southeast_tile_walkable(strategy, coord, npc))
 
   def test_is_walkable_blocks_large_monsters_diagonally_with_npc(self):
     map_registry = MapRegistry({})
@@ -159,8 +166,9 @@ class LargeMonsterTest(TestCase):
       npc = npc_registry.create_npc(0, 0, StubWalkabilityStrategy(), StubHuntStrategy(), opts={'size': 2})
       npc_registry.create_npc(x, y, StubWalkabilityStrategy(),  StubHuntStrategy()) # Create the blocking npc
 
-      strategy = SimpleWalkabilityStrategy(map_registry, npc_registry, PlayerRegistry())
-      self.assertFalse(is_southwest_tile_walkable(strategy, npc.coordinate, npc))
+      for strategy_class in WALKABILITY_STRATEGIES:
+        strategy = strategy_class(map_registry, npc_registry, PlayerRegistry())
+        self.assertFalse(is_southwest_tile_walkable(strategy, npc.coordinate, npc))
 
   def test_is_walkable_blocks_large_monsters_diagonally_with_player(self):
     map_registry = MapRegistry({})
@@ -173,8 +181,9 @@ class LargeMonsterTest(TestCase):
       player_registry = PlayerRegistry()
       player_registry.create_player((x, y), StubHuntStrategy()) # Create the blocking player
 
-      strategy = SimpleWalkabilityStrategy(map_registry, npc_registry, player_registry)
-      self.assertFalse(is_southwest_tile_walkable(strategy, npc.coordinate, npc))
+      for strategy_class in WALKABILITY_STRATEGIES:
+        strategy = strategy_class(map_registry, npc_registry, player_registry)
+        self.assertFalse(is_southwest_tile_walkable(strategy, npc.coordinate, npc))
 
   def test_can_attack_should_return_false_if_player_underneath(self):
     npc_registry = NpcRegistry()
@@ -325,6 +334,46 @@ class NpcRegistryTest(TestCase):
     npc = self.npc_registry.create_npc(0, 0, self.walkability_strategy, self.hunt_strategy)
     self.assertListEqual(list(self.npc_registry.get_living_npcs_in_chunk(0, 0)), [npc])
 
+  def test_get_living_npcs_in_range_should_match_chebyshev_distance(self):
+    npcs = [self.npc_registry.create_npc(x, y, self.walkability_strategy, self.hunt_strategy) for x in range(-9, 10, 3) for y in range(-9, 10, 2)]
+
+    for radius in [1, 2, 5, 9]:
+      for center in [(0, 0), (4, -3), (-7, 8)]:
+        expected = {npc.slot_index for npc in npcs if cheb(center, npc.coordinate) <= radius}
+        found = {npc.slot_index for npc in self.npc_registry.get_living_npcs_in_range(center, radius)}
+        self.assertSetEqual(found, expected)
+
+  def test_get_living_npcs_in_range_should_skip_dead_npcs(self):
+    npc = self.npc_registry.create_npc(0, 0, self.walkability_strategy, self.hunt_strategy)
+    npc.die()
+
+    self.assertListEqual(self.npc_registry.get_living_npcs_in_range((0, 0), 1), [])
+    self.assertListEqual(self.npc_registry.get_living_npcs_in_range((0, 0), 5), [])
+
+  def test_get_living_npcs_in_range_should_follow_moved_npcs(self):
+    npc = self.npc_registry.create_npc(0, 0, self.walkability_strategy, self.hunt_strategy)
+    self.npc_registry.update_npc_location(npc, (0, 0), (0, 3))
+
+    self.assertListEqual(self.npc_registry.get_living_npcs_in_range((0, 0), 1), [])
+    self.assertListEqual(self.npc_registry.get_living_npcs_in_range((0, 4), 1), [npc])
+
+  def test_get_npc_stats_should_use_definition_table(self):
+    stats = self.npc_registry.get_npc_stats({'id': 70, 'x': 0, 'y': 0})
+    self.assertEqual(stats, {'id': 70, 'name': 'Skeleton', 'hitpoints': 29, 'combat_level': 22, 'max_range': 10, 'wander_range': 8, 'respawn_time': 70})
+    self.assertEqual(self.npc_registry.get_npc_stats({'id': 3269})['max_range'], 4)
+
+  def test_get_npc_stats_should_share_definitions(self):
+    self.assertIs(self.npc_registry.get_npc_stats({'id': 70}), NpcRegistry().get_npc_stats({'id': 70}))
+
+  def test_get_npc_stats_should_make_unknown_npcs_unattackable(self):
+    npc = self.npc_registry.create_npc(0, 0, self.walkability_strategy, self.hunt_strategy, opts=self.npc_registry.get_npc_stats({'id': -1}))
+    self.assertFalse(npc.is_attackable())
+
+  def test_get_npc_stats_should_read_custom_table(self):
+    npc_registry = NpcRegistry({5: {'id': 5, 'hitpoints': 100, 'combat_level': 50, 'size': 3}})
+    npc = npc_registry.create_npc(0, 0, self.walkability_strategy, self.hunt_strategy, opts=npc_registry.get_npc_stats({'id': 5}))
+    self.assertEqual((npc.max_hitpoints, npc.size), (100, 3))
+
 class CannonHuntStrategyTest(TestCase):
   # Construct a bunch of real life test cases to make sure they work as expected
   def get_possible_cannon_coords(self, direction: Tuple[int, int]):
@@ -372,6 +421,26 @@ class CannonHuntStrategyTest(TestCase):
         self.assertEqual(strat.get_target(cannon).slot_index, npc.slot_index)
       cannon.turn()
 
+  def test_get_target_should_break_ties_in_chunk_order(self):
+    map_registry = MapRegistry({})
+    player_registry = PlayerRegistry()
+    npc_registry = NpcRegistry()
+    strat = CannonHuntStrategy(map_registry, npc_registry, player_registry)
+    player = player_registry.create_player((0, 0), strat)
+    cannon = player.place_cannon((0, 0))
+    walkability_strategy = WalkabilityStrategy(map_registry, npc_registry, player_registry)
+
+    # Both are next to the center of the first area north of the cannon, (0, 3), but the eastern one's chunk comes first
+    npc_registry.create_npc(-1, 3, walkability_strategy, StubHuntStrategy())
+    east = npc_registry.create_npc(1, 3, walkability_strategy, StubHuntStrategy())
+    self.assertEqual(strat.get_target(cannon), east)
+
+    # Within a chunk the npc that entered it first goes first
+    npc_registry.reset()
+    first = npc_registry.create_npc(0, 4, walkability_strategy, StubHuntStrategy())
+    npc_registry.create_npc(1, 3, walkability_strategy, StubHuntStrategy())
+    self.assertEqual(strat.get_target(cannon), first)
+
   def test_get_target_should_not_target_another_npc_in_single_combat(self):
     map_registry = MapRegistry({})
     player_registry = PlayerRegistry()
@@ -413,6 +482,134 @@ class CannonHuntStrategyTest(TestCase):
 
     self.assertTrue(strat.get_target(cannon) == npc2)
 
+class MulticombatTest(TestCase):
+
+  def test_tile_bitmap_should_mark_inclusive_areas(self):
+    bitmap = TileBitmap((10, 20), 8, 8)
+    bitmap.set_area((12, 21), (13, 30))
+
+    self.assertTrue(bitmap.get((12, 21)))
+    self.assertTrue(bitmap.get((13, 27)))
+    self.assertFalse(bitmap.get((14, 21)))
+    self.assertFalse(bitmap.get((12, 20)))
+    # Outside the bitmap
+    self.assertFalse(bitmap.get((12, 28)))
+    self.assertFalse(bitmap.get((0, 0)))
+
+  def test_multicombat_map_should_only_use_zones_on_its_plane(self):
+    bitmap = create_multicombat_map((70, 70), [[64, 64, 70, 70], [100, 100, 101, 101, 1]])
+
+    self.assertTrue(bitmap.get((64, 64)))
+    self.assertTrue(bitmap.get((70, 70)))
+    self.assertFalse(bitmap.get((71, 70)))
+    self.assertFalse(bitmap.get((100, 100)))
+
+  def test_entities_should_report_map_multicombat(self):
+    map_registry = MapRegistry({}, create_multicombat_map_for_zones([[0, 0, 5, 5]]))
+    npc_registry = NpcRegistry()
+    player_registry = PlayerRegistry()
+    npc = npc_registry.create_npc(5, 5, WalkabilityStrategy(map_registry, npc_registry, player_registry), StubHuntStrategy())
+    npc_outside = npc_registry.create_npc(6, 5, WalkabilityStrategy(map_registry, npc_registry, player_registry), StubHuntStrategy())
+    player = player_registry.create_player((0, 0), CannonHuntStrategy(map_registry, npc_registry, player_registry))
+
+    self.assertIs(npc.is_in_multicombat(), True)
+    self.assertIs(npc_outside.is_in_multicombat(), False)
+    self.assertIs(player.is_in_multicombat(), True)
+    self.assertIs(MapRegistry({}).is_in_multicombat((0, 0)), False)
+
+  def test_get_target_should_only_target_npcs_in_multi_while_player_in_combat(self):
+    map_registry = MapRegistry({}, create_multicombat_map_for_zones([[-2, 6, 2, 8]]))
+    player_registry = PlayerRegistry()
+    npc_registry = NpcRegistry()
+    strat = CannonHuntStrategy(map_registry, npc_registry, player_registry)
+    player = player_registry.create_player((0, 0), strat)
+    cannon = player.place_cannon((0, 0))
+    walkability_strategy = WalkabilityStrategy(map_registry, npc_registry, player_registry)
+    # Closer to the cannon, but in singles
+    npc_registry.create_npc(0, 3, walkability_strategy, StubHuntStrategy())
+    multi_npc = npc_registry.create_npc(0, 7, walkability_strategy, StubHuntStrategy())
+    player.in_combat_with = npc_registry.create_npc(-1, 0, walkability_strategy, StubHuntStrategy(), opts={'combat_level': 0})
+
+    self.assertEqual(strat.get_target(cannon), multi_npc)
+
+class AggressionTest(TestCase):
+
+  def setUp(self):
+    self.map_registry = MapRegistry({})
+    self.npc_registry = NpcRegistry()
+    self.player_registry = PlayerRegistry()
+    self.player = self.player_registry.create_player((0, 0), CannonHuntStrategy(self.map_registry, self.npc_registry, self.player_registry))
+    self.walkability_strategy = SimpleWalkabilityStrategy(self.map_registry, self.npc_registry, self.player_registry)
+    self.hunt_strategy = SimpleHuntStrategy(self.map_registry, self.npc_registry, self.player_registry)
+    self.engine = Engine(self.map_registry, self.npc_registry, self.player_registry)
+
+  def create_npc(self, x, y, opts={}):
+    return self.npc_registry.create_npc(x, y, self.walkability_strategy, self.hunt_strategy, opts={'wander_range': 0, **opts})
+
+  def test_registry_should_track_largest_hunt_range(self):
+    self.assertIsNone(self.npc_registry.max_hunt_range)
+    self.create_npc(10, 10, {'aggressive': 1, 'hunt_range': 3})
+    self.create_npc(10, 10, {'aggressive': 1, 'hunt_range': 2, 'size': 3})
+    self.create_npc(10, 10, {'hunt_range': 8})
+
+    self.assertEqual(self.npc_registry.max_hunt_range, 4)
+
+  def test_aggressive_npc_in_hunt_range_should_follow_player(self):
+    npc = self.create_npc(3, 2, {'aggressive': 1, 'hunt_range': 3})
+
+    self.engine.perform_hunts()
+
+    self.assertEqual(npc.interacting_with, self.player)
+    self.assertEqual(npc.mode, NpcMode.PLAYERFOLLOW)
+
+  def test_large_npc_should_hunt_from_its_closest_tile(self):
+    npc = self.create_npc(-4, -1, {'aggressive': 1, 'hunt_range': 3, 'size': 2})
+
+    self.engine.perform_hunts()
+
+    self.assertEqual(npc.interacting_with, self.player)
+
+  def test_npcs_out_of_range_or_passive_should_keep_wandering(self):
+    far_npc = self.create_npc(4, 0, {'aggressive': 1, 'hunt_range': 3})
+    passive_npc = self.create_npc(1, 1, {'hunt_range': 3})
+
+    self.engine.perform_hunts()
+
+    for npc in [far_npc, passive_npc]:
+      self.assertIsNone(npc.interacting_with)
+      self.assertEqual(npc.mode, NpcMode.WANDER)
+
+  def test_npc_should_not_hunt_through_walls(self):
+    self.map_registry.map_config[1] = {0: {'movement_flags': Mask.RIGHT, 'projectile_flags': Mask.RIGHT}}
+    npc = self.create_npc(3, 0, {'aggressive': 1, 'hunt_range': 3})
+
+    self.engine.perform_hunts()
+
+    self.assertIsNone(npc.interacting_with)
+
+  def test_tolerant_player_should_not_be_hunted(self):
+    npc = self.create_npc(1, 1, {'aggressive': 1, 'hunt_range': 3})
+    self.player.ticks_in_area = self.player.aggression_tolerance
+
+    self.engine.perform_hunts()
+
+    self.assertIsNone(npc.interacting_with)
+
+  def test_player_in_combat_in_singles_should_not_be_hunted(self):
+    npc = self.create_npc(1, 1, {'aggressive': 1, 'hunt_range': 3})
+    self.player.in_combat_with = self.create_npc(-1, 0)
+
+    self.engine.perform_hunts()
+
+    self.assertIsNone(npc.interacting_with)
+
+  def test_hunting_npc_should_attack_player(self):
+    self.create_npc(2, 0, {'aggressive': 1, 'hunt_range': 3})
+
+    self.engine.perform_ticks(3)
+
+    self.assertTrue(self.player.is_in_combat())
+
 class NpcInteractionTest(TestCase):
 
   def setUp(self):
@@ -508,5 +705,505 @@ class PlayerRetaliationTest(TestCase):
     self.assertTrue(player.is_in_combat_with(npc))
     self.assertEqual(player.time_to_next_attack, 0)
 
+class ActionQueueTest(TestCase):
+
+  def setUp(self):
+    self.player = PlayerRegistry().create_player((0, 0), StubHuntStrategy())
+    self.npc = NpcRegistry().create_npc(0, 1, StubWalkabilityStrategy(), StubHuntStrategy(), opts={'hitpoints': 10})
+
+  def test_queues_should_be_emptied_in_place(self):
+    npc_queue = self.npc.queue
+    player_queue = self.player.queue
+    self.npc.add_to_queue(DamageAction(3, self.player))
+    self.npc.queue_damage(self.player)
+
+    self.npc.perform_queue()
+    self.player.perform_queue()
+
+    self.assertIs(self.npc.queue, npc_queue)
+    self.assertIs(self.player.queue, player_queue)
+    self.assertEqual((npc_queue, player_queue), ([], []))
+    self.assertEqual(self.npc.hitpoints, 7)
+
+  def test_death_should_drop_the_rest_of_the_queue(self):
+    attacker = PlayerRegistry().create_player((5, 5), StubHuntStrategy())
+    for damage in [4, 6, 2]:
+      self.npc.add_to_queue(DamageAction(damage, attacker))
+    self.npc.add_to_queue(DamageAction(1, self.player))
+
+    self.npc.perform_queue()
+
+    self.assertTrue(self.npc.is_dead())
+    self.assertEqual(self.npc.queue, [])
+    self.assertEqual(self.npc.times_died, 1)
+    self.assertIs(self.npc.kill_credit_player, attacker)
+
+  def test_melee_attacks_should_reuse_their_action(self):
+    self.npc.queue_damage(self.player)
+    self.npc.queue_damage(self.player)
+
+    self.assertIs(self.player.queue[0], self.player.queue[1])
+    self.player.perform_queue()
+    self.assertTrue(self.player.is_in_combat_with(self.npc))
+
+  def test_cannon_and_player_hits_should_reuse_their_actions(self):
+    cannon = self.player.place_cannon((0, 0))
+    cannon.rng = self.player.rng = random.Random(1)
+    for _ in range(200):
+      cannon.queue_damage(self.npc)
+      self.player.queue_damage(self.npc)
+    # One action per damage value for each of them, both credited to the player
+    for actions in (self.npc.queue[0::2], self.npc.queue[1::2]):
+      self.assertEqual(len({id(action) for action in actions}), len({action.damage for action in actions}))
+    self.assertTrue(all(action.attacker is self.player for action in self.npc.queue))
+
+    # Raising the max hit grows the table
+    cannon.min_hit = cannon.max_hit = 40
+    cannon.queue_damage(self.npc)
+    self.assertEqual(self.npc.queue[-1].damage, 40)
+
+def random_map_config(rng, width, height, density=0.3):
+  # Walls, diagonal walls and solid objects scattered over a width x height area
+  masks = [Mask.TOP, Mask.RIGHT, Mask.BOTTOM, Mask.LEFT, Mask.TOP_LEFT, Mask.TOP_RIGHT, Mask.BOTTOM_LEFT, Mask.BOTTOM_RIGHT, Mask.TOP + Mask.LEFT, 15 + Mask.OBJECT]
+  map_config = {}
+  for x in range(width):
+    for y in range(height):
+      if rng.random() < density:
+        flags = rng.choice(masks)
+        map_config.setdefault(x, {})[y] = {'movement_flags': flags, 'projectile_flags': flags}
+  return map_config
+
+class PrecomputedWalkabilityStrategyTest(TestCase):
+
+  def test_should_match_simple_strategy(self):
+    rng = random.Random(1)
+    for size in [1, 2, 3, 4]:
+      map_registry = MapRegistry(random_map_config(rng, 12, 12))
+      npc_registry = NpcRegistry()
+      player_registry = PlayerRegistry()
+      player_registry.create_player((6, 6), StubHuntStrategy())
+      npc = npc_registry.create_npc(0, 0, StubWalkabilityStrategy(), StubHuntStrategy(), opts={'size': size})
+      for _ in range(6):
+        npc_registry.create_npc(rng.randrange(12), rng.randrange(12), StubWalkabilityStrategy(), StubHuntStrategy(), opts={'size': rng.choice([1, 2])})
+      simple = SimpleWalkabilityStrategy(map_registry, npc_registry, player_registry)
+      precomputed = PrecomputedWalkabilityStrategy(map_registry, npc_registry, player_registry)
+
+      for x in range(-1, 12):
+        for y in range(-1, 12):
+          for direction in STEP_DIRECTIONS:
+            new_coord = (x + direction[0], y + direction[1])
+            self.assertEqual(precomputed.is_walkable_tile((x, y), new_coord, npc), simple.is_walkable_tile((x, y), new_coord, npc), f'size {size} from {(x, y)} to {new_coord}')
+
+  def test_clearance_map_should_be_shared_and_grow_with_npc_size(self):
+    map_registry = MapRegistry({})
+    clearance_map = map_registry.get_clearance_map(1)
+    self.assertIs(map_registry.get_clearance_map(2), clearance_map)
+
+    larger_map = map_registry.get_clearance_map(5)
+    self.assertEqual(larger_map.max_size, 5)
+    self.assertIs(map_registry.get_clearance_map(1), larger_map)
+
+    # Registries over the same map can use one clearance map, whichever of them builds it first
+    zoned = MapRegistry(map_registry.map_config, create_multicombat_map_for_zones([[0, 0, 3, 3]]))
+    zoned.clearance_owner = map_registry
+    self.assertIs(zoned.get_clearance_map(7), map_registry.get_clearance_map(1))
+
+  def test_clearance_should_be_largest_size_that_can_step(self):
+    # A wall on the south side of (2, 0) stops anything covering that tile from stepping south
+    map_registry = MapRegistry({ 2: { 0: {'movement_flags': Mask.BOTTOM, 'projectile_flags': 0 } } })
+    clearance_map = map_registry.get_clearance_map(4)
+    south = STEP_DIRECTION_INDEXES[(0, -1)]
+    north = STEP_DIRECTION_INDEXES[(0, 1)]
+
+    self.assertEqual(clearance_map.get_clearances((0, 0))[south], 2)
+    self.assertEqual(clearance_map.get_clearances((2, 0))[south], 0)
+    self.assertEqual(clearance_map.get_clearances((0, 0))[north], 4)
+
+  def test_engine_runs_should_match_simple_strategy(self):
+    map_config = random_map_config(random.Random(3), 30, 30, density=0.1)
+    npc_structs = [{'id': 70, 'x': x, 'y': y} for (x, y) in [(5, 20), (12, 22), (20, 25), (25, 10), (8, 8)]]
+    results = []
+    for strategy_class in [SimpleWalkabilityStrategy, PrecomputedWalkabilityStrategy]:
+      random.seed(7)
+      engine = build_engine((15, 15), (16, 14), MapRegistry(map_config), npc_structs, walkability_strategy_class=strategy_class)
+      engine.perform_ticks(600)
+      results.append([(npc.coordinate, npc.times_died, npc.hitpoints) for npc in engine.npc_registry.registered_npcs])
+    self.assertEqual(results[0], results[1])
+
+class NpcFollowCacheTest(TestCase):
+
+  def test_can_follow_should_be_cached_per_player_tile(self):
+    npc = NpcRegistry().create_npc(0, 0, StubWalkabilityStrategy(), StubHuntStrategy(), opts={'max_range': 1})
+    player_registry = PlayerRegistry()
+    player = player_registry.create_player((2, 0), StubHuntStrategy())
+    self.assertTrue(npc.can_follow(player))
+
+    player.coordinate = (5, 0)
+    self.assertFalse(npc.can_follow(player))
+
+  def test_follow_should_not_cache_random_destinations(self):
+    map_registry = MapRegistry({})
+    npc_registry = NpcRegistry()
+    player_registry = PlayerRegistry()
+    player = player_registry.create_player((0, 0), StubHuntStrategy())
+    npc = npc_registry.create_npc(0, 0, StubWalkabilityStrategy(), SimpleHuntStrategy(map_registry, npc_registry, player_registry))
+    npc.set_interaction(player)
+
+    destinations = set()
+    for _ in range(50):
+      npc.follow()
+      destinations.add(npc.destination_tile)
+    self.assertEqual(destinations, {(1, 0), (-1, 0), (0, 1), (0, -1)})
+
+class MultiplePlayerTest(TestCase):
+
+  def test_moving_player_should_update_tile_occupancy(self):
+    player_registry = PlayerRegistry()
+    npc_registry = NpcRegistry()
+    npc = npc_registry.create_npc(0, 0, StubWalkabilityStrategy(), StubHuntStrategy())
+    player = player_registry.create_player((0, 1), StubHuntStrategy())
+    strategy = SimpleWalkabilityStrategy(MapRegistry({}), npc_registry, player_registry)
+    self.assertFalse(is_north_tile_walkable(strategy, npc.coordinate, npc))
+
+    player.coordinate = (5, 5)
+
+    self.assertTrue(is_north_tile_walkable(strategy, npc.coordinate, npc))
+    self.assertTrue(player_registry.is_tile_occupied(5, 5))
+    self.assertFalse(player_registry.is_tile_occupied(0, 1))
+
+  def test_players_sharing_a_tile_should_keep_it_occupied(self):
+    player_registry = PlayerRegistry()
+    player_registry.create_player((0, 1), StubHuntStrategy())
+    player = player_registry.create_player((0, 1), StubHuntStrategy())
+
+    player.coordinate = (5, 5)
+
+    self.assertTrue(player_registry.is_tile_occupied(0, 1))
+
+  def test_cannons_should_share_range_queries_until_an_npc_moves(self):
+    map_registry = MapRegistry({})
+    player_registry = PlayerRegistry()
+    npc_registry = NpcRegistry()
+    strat = CannonHuntStrategy(map_registry, npc_registry, player_registry)
+    cannon = player_registry.create_player((0, 0), strat).place_cannon((0, 0))
+    other_cannon = player_registry.create_player((1, 0), strat).place_cannon((0, 0))
+    npc = npc_registry.create_npc(0, 3, WalkabilityStrategy(map_registry, npc_registry, player_registry), StubHuntStrategy())
+    npc_registry.get_living_npcs_in_range = Mock(wraps=npc_registry.get_living_npcs_in_range)
+
+    self.assertEqual(strat.get_target(cannon), npc)
+    self.assertEqual(strat.get_target(other_cannon), npc)
+    self.assertEqual(npc_registry.get_living_npcs_in_range.call_count, 1)
+
+    npc._coordinate = (0, 25)
+    self.assertIsNone(strat.get_target(cannon))
+
+class MultiPlaneTest(TestCase):
+
+  def test_npcs_should_only_block_and_be_found_on_their_plane(self):
+    map_registry = MapRegistry({})
+    npc_registry = NpcRegistry()
+    player_registry = PlayerRegistry()
+    strategy = SimpleWalkabilityStrategy(map_registry, npc_registry, player_registry)
+    npc = npc_registry.create_npc(0, 0, strategy, StubHuntStrategy())
+    upstairs = npc_registry.create_npc(0, 1, strategy, StubHuntStrategy(), plane=1)
+
+    self.assertTrue(is_north_tile_walkable(strategy, npc.coordinate, npc))
+    self.assertEqual(npc_registry.get_living_npcs_in_range((0, 0), 3), [npc])
+    self.assertEqual(npc_registry.get_living_npcs_in_range((0, 0), 30, 1), [upstairs])
+    self.assertEqual(list(npc_registry.get_npcs_in_tile(0, 1, 1)), [upstairs])
+
+    upstairs._coordinate = (0, 2)
+    self.assertEqual(list(npc_registry.get_npcs_in_tile(0, 1, 1)), [])
+    self.assertEqual(npc_registry.get_living_npcs_in_range((0, 2), 0, 1), [upstairs])
+
+  def test_players_should_only_occupy_their_plane(self):
+    player_registry = PlayerRegistry()
+    player = player_registry.create_player((0, 1), StubHuntStrategy(), plane=2)
+
+    self.assertTrue(player_registry.is_tile_occupied(0, 1, 2))
+    self.assertFalse(player_registry.is_tile_occupied(0, 1))
+    self.assertEqual(player_registry.get_players_in_tile(0, 1, 2), [player])
+
+    player.coordinate = (3, 3)
+    self.assertFalse(player_registry.is_tile_occupied(0, 1, 2))
+    self.assertTrue(player_registry.is_tile_occupied(3, 3, 2))
+
+  def test_cannon_should_only_target_npcs_on_its_plane(self):
+    map_registry = MapRegistry({}, plane=1)
+    npc_registry = NpcRegistry()
+    player_registry = PlayerRegistry()
+    strat = CannonHuntStrategy(map_registry, npc_registry, player_registry)
+    cannon = player_registry.create_player((0, 0), strat, plane=1).place_cannon((0, 0))
+    npc_registry.create_npc(0, 3, WalkabilityStrategy(map_registry, npc_registry, player_registry), StubHuntStrategy())
+
+    self.assertEqual(cannon.plane, 1)
+    self.assertIsNone(strat.get_target(cannon))
+
+    upstairs = npc_registry.create_npc(0, 4, WalkabilityStrategy(map_registry, npc_registry, player_registry), StubHuntStrategy(), plane=1)
+    self.assertEqual(strat.get_target(cannon), upstairs)
+
+  def test_map_registry_planes_should_be_linked(self):
+    ground = MapRegistry({0: {0: {'movement_flags': Mask.TOP, 'projectile_flags': Mask.TOP}}})
+    upstairs = ground.add_plane(MapRegistry({}, plane=1))
+
+    self.assertIs(ground.for_plane(1), upstairs)
+    self.assertIs(upstairs.for_plane(0), ground)
+    self.assertEqual(upstairs.get_objs_on_plane((0, 0), 0), {'movement_flags': Mask.TOP, 'projectile_flags': Mask.TOP})
+    self.assertEqual(ground.get_objs_on_plane((0, 0), 1), {})
+
+  def test_build_engine_should_only_spawn_npcs_on_its_plane(self):
+    npc_structs = [{'id': 70, 'x': 2, 'y': 2, 'p': 0}, {'id': 70, 'x': 3, 'y': 3, 'p': 1}, {'id': 70, 'x': 5, 'y': 5}]
+    engine = build_engine((0, 0), (1, 1), MapRegistry({}, plane=1), npc_structs, plane=1)
+
+    # Spawns without a plane are on the engine's plane
+    self.assertEqual([npc.coordinate for npc in engine.npc_registry.registered_npcs], [(3, 3), (5, 5)])
+    self.assertEqual(engine.npc_registry.registered_npcs[0].plane, 1)
+    self.assertEqual(engine.player_registry._players[0].plane, 1)
+
+class TileFlagTest(TestCase):
+
+  def test_blocking_tiles_should_be_folded_into_movement_flags(self):
+    mapping = defaultdict(lambda: defaultdict(dict))
+    shared = {'movement_flags': Mask.LEFT, 'projectile_flags': Mask.LEFT}
+    mapping[64][65] = shared
+    mapping[64][66] = shared
+    settings = bytearray(64*64)
+    settings[1] = TileFlagMask.BLOCKING
+    settings[64*2 + 3] = TileFlagMask.ROOF
+    fold_tile_settings(mapping, (1, 1), bytes(settings))
+
+    self.assertEqual(mapping[64][65]['movement_flags'], Mask.LEFT | FULL_BLOCK_MOVEMENT_FLAGS)
+    self.assertEqual(mapping[64][65]['projectile_flags'], Mask.LEFT)
+    self.assertEqual(mapping[64][65]['tile_flags'], TileFlagMask.BLOCKING)
+    # Other tiles of the same object keep their flags
+    self.assertEqual(mapping[64][66], {'movement_flags': Mask.LEFT, 'projectile_flags': Mask.LEFT})
+    self.assertEqual(mapping[66][67], {'tile_flags': TileFlagMask.ROOF})
+
+  def test_npcs_should_not_walk_onto_blocking_tiles(self):
+    mapping = defaultdict(lambda: defaultdict(dict))
+    settings = bytearray(64*64)
+    settings[64*0 + 1] = TileFlagMask.BLOCKING
+    fold_tile_settings(mapping, (0, 0), bytes(settings))
+    for strategy_class in WALKABILITY_STRATEGIES:
+      map_registry = MapRegistry(mapping)
+      npc_registry = NpcRegistry()
+      strategy = strategy_class(map_registry, npc_registry, PlayerRegistry())
+      npc = npc_registry.create_npc(0, 0, strategy, StubHuntStrategy())
+
+      self.assertFalse(strategy.is_walkable_tile((0, 0), (0, 1), npc))
+      self.assertFalse(strategy.is_walkable_tile((1, 0), (0, 1), npc))
+      self.assertTrue(strategy.is_walkable_tile((0, 0), (1, 0), npc))
+
+class FastForwardTest(TestCase):
+
+  def build_engine(self, npc_structs, fast_forward, map_registry=None, npc_stats=None):
+    # Simple walkability so the random maps don't need clearance maps built
+    return build_engine((20, 20), (21, 19), map_registry or MapRegistry({}), npc_structs, npc_stats=npc_stats, walkability_strategy_class=SimpleWalkabilityStrategy, fast_forward=fast_forward)
+
+  def test_quiet_ticks_should_count_until_an_npc_could_be_targeted(self):
+    engine = self.build_engine([{'id': 70, 'x': 21, 'y': 60}], True)
+    npc = engine.npc_registry.registered_npcs[0]
+    # The furthest north area is centered 14 tiles away with a range of 5
+    self.assertEqual(engine._count_quiet_ticks(), (60 - 19 - 14 - 5) - 1)
+
+    npc._coordinate = (21, 39)
+    self.assertEqual(engine._count_quiet_ticks(), 0)
+
+    npc.die()
+    npc.respawn_coordinate = (21, 60)
+    self.assertEqual(engine._count_quiet_ticks(), npc.respawn_time + (60 - 19 - 14 - 5) - 2)
+
+  def test_quiet_ticks_should_account_for_npcs_killed_and_respawning(self):
+    engine = self.build_engine([{'id': 70, 'x': 21, 'y': 60}], True, npc_stats={70: {'respawn_time': 3}})
+    npc = engine.npc_registry.registered_npcs[0]
+    npc.respawn_coordinate = (21, 40)
+
+    self.assertEqual(engine._count_quiet_ticks(), 3 + (40 - 19 - 14 - 5) - 1)
+
+  def test_quiet_ticks_should_skip_targeting_and_keep_turning(self):
+    engine = self.build_engine([{'id': 70, 'x': 21, 'y': 90}], True, npc_stats={70: {'wander_range': 0}})
+    strategy = engine.player_registry.registered_players[0]._cannon_strategy
+    strategy.get_target = Mock(wraps=strategy.get_target)
+    cannon = engine.player_registry.registered_players[0].cannon()
+
+    engine.perform_ticks(20)
+
+    self.assertEqual(strategy.get_target.call_count, 0)
+    self.assertEqual(cannon.direction, (0, -1))
+    self.assertEqual(engine.player_registry.registered_players[0].ticks_in_area, 20)
+
+  def test_should_match_running_every_tick(self):
+    rng = random.Random(5)
+    stats = EngineStats()
+    kills = 0
+    for seed in range(4):
+      map_registry = MapRegistry(random_map_config(rng, 60, 60, density=0.05))
+      npc_structs = [{'id': 70, 'x': rng.randrange(60), 'y': rng.randrange(60)} for _ in range(3)]
+      npc_stats = {70: {'aggressive': seed % 2, 'hunt_range': 4, 'respawn_time': 5 + seed}}
+      results = []
+      # Instrumented runs time the same phases, quiet ticks included
+      for fast_forward, instrumented in [(False, False), (True, False), (True, True)]:
+        engine = self.build_engine(npc_structs, fast_forward, map_registry, npc_stats)
+        if instrumented:
+          engine.stats = stats
+        random.seed(seed)
+        engine.perform_ticks(600)
+        player = engine.player_registry.registered_players[0]
+        results.append((
+          [(npc.coordinate, npc.times_died, npc.hitpoints) for npc in engine.npc_registry.registered_npcs],
+          player.cannon().direction,
+          player.time_to_next_attack,
+          random.random(),
+        ))
+      self.assertEqual(results[0], results[1])
+      self.assertEqual(results[0], results[2])
+      kills += count_kills(engine.npc_registry)
+    # Both quiet and busy stretches were covered
+    self.assertGreater(kills, 0)
+    self.assertGreater(stats.counts['ticks.quiet'], 0)
+    self.assertLess(stats.counts['ticks.quiet'], stats.counts['ticks'])
+
+class EngineStatsTest(TestCase):
+
+  def _build_engine(self, stats):
+    map_registry = MapRegistry({})
+    npc_registry = NpcRegistry()
+    player_registry = PlayerRegistry()
+    walkability_strategy = SimpleWalkabilityStrategy(map_registry, npc_registry, player_registry)
+    hunt_strategy = SimpleHuntStrategy(map_registry, npc_registry, player_registry)
+    npc_registry.create_npc(0, 3, walkability_strategy, hunt_strategy, opts={'hitpoints': 1000, 'wander_range': 0})
+    player = player_registry.create_player((0, 0), CannonHuntStrategy(map_registry, npc_registry, player_registry))
+    player.place_cannon((0, 0))
+    return Engine(map_registry, npc_registry, player_registry, stats)
+
+  def test_engine_without_stats_should_not_instrument_strategies(self):
+    engine = self._build_engine(None)
+    engine.perform_ticks(8)
+
+    npc = engine.npc_registry.registered_npcs[0]
+    self.assertNotIn('is_walkable_tile', vars(npc.walkability_strategy))
+    self.assertIsNone(npc.walkability_strategy.stats)
+
+  def test_engine_with_stats_should_count_phases_and_strategy_calls(self):
+    stats = EngineStats()
+    engine = self._build_engine(stats)
+    engine.perform_ticks(8)
+
+    self.assertEqual(stats.counts['ticks'], 8)
+    self.assertEqual(stats.counts['phase.npc_move'], 8)
+    self.assertEqual(stats.counts['phase.player_timers'], 8)
+    # The cannon looks for a target once per tick
+    self.assertEqual(stats.counts['cannon.get_target'], 8)
+    self.assertGreaterEqual(stats.counts['cannon.spatial_queries'], 8)
+    # The npc starts north of the cannon, so it is a candidate at least once
+    self.assertGreaterEqual(stats.counts['cannon.candidates_sorted'], 1)
+    self.assertGreater(stats.counts['los.steps'], 0)
+    self.assertGreaterEqual(stats.times['cannon.get_target'], 0)
+
+  def test_strategies_should_only_be_instrumented_while_running(self):
+    stats = EngineStats()
+    engine = self._build_engine(stats)
+    npc = engine.npc_registry.registered_npcs[0]
+    cannon_strategy = engine.player_registry.registered_players[0]._cannon_strategy
+    engine.perform_ticks(8)
+
+    self.assertNotIn('is_walkable_tile', vars(npc.walkability_strategy))
+    self.assertNotIn('get_target', vars(cannon_strategy))
+    self.assertIsNone(cannon_strategy.stats)
+    self.assertNotIn('perform_move', vars(npc))
+    self.assertNotIn('perform_tick', vars(engine))
+    # Another engine on the same strategies runs them plain
+    Engine(engine.map_registry, engine.npc_registry, engine.player_registry).perform_ticks(8)
+    self.assertEqual(stats.counts['cannon.get_target'], 8)
+
+    list(engine.events(4))
+    self.assertNotIn('get_target', vars(cannon_strategy))
+    self.assertEqual(stats.counts['cannon.get_target'], 12)
+
+  def test_merge_should_sum_counts_and_times(self):
+    stats = EngineStats()
+    stats.increment('los.steps', 3)
+    stats.add_time('phase.npc_move', 1.5)
+    other = EngineStats()
+    other.increment('los.steps', 2)
+    other.increment('ticks')
+    other.add_time('phase.npc_move', 0.5)
+
+    merged = stats + other
+
+    self.assertEqual(merged.counts['los.steps'], 5)
+    self.assertEqual(merged.counts['ticks'], 1)
+    self.assertEqual(merged.times['phase.npc_move'], 2.0)
+    # Addition should not modify either side
+    self.assertEqual(stats.counts['los.steps'], 3)
+
+class EngineEventsTest(TestCase):
+
+  def build_engine(self, seed):
+    rng = random.Random(seed)
+    map_registry = MapRegistry(random_map_config(rng, 40, 40, density=0.05))
+    npc_structs = [{'id': 70, 'x': rng.randrange(40), 'y': rng.randrange(40)} for _ in range(6)]
+    return build_engine((20, 20), (21, 19), map_registry, npc_structs, npc_stats={70: {'respawn_time': 10}}, walkability_strategy_class=SimpleWalkabilityStrategy)
+
+  def test_should_match_running_without_events(self):
+    random.seed(3)
+    plain = self.build_engine(1)
+    plain.perform_ticks(500)
+
+    random.seed(3)
+    engine = self.build_engine(1)
+    batches = list(engine.events(500))
+
+    self.assertEqual([tick for tick, _ in batches], list(range(1, 501)))
+    self.assertEqual([(npc.coordinate, npc.times_died) for npc in engine.npc_registry.registered_npcs], [(npc.coordinate, npc.times_died) for npc in plain.npc_registry.registered_npcs])
+    events = [event for _, batch in batches for event in batch]
+    kinds = {event[0] for event in events}
+    self.assertEqual(kinds, {'move', 'hit', 'death', 'respawn', 'cannon', 'target'})
+    self.assertEqual(sum(event[0] == 'death' for event in events), count_kills(engine.npc_registry))
+    # The cannon turns every tick
+    self.assertEqual(sum(event[0] == 'cannon' for event in events), 500)
+
+    # Replaying the moves and respawns ends where the npcs are
+    positions = {npc.slot_index: npc.respawn_coordinate for npc in engine.npc_registry.registered_npcs}
+    for event in events:
+      if event[0] in ('move', 'respawn'):
+        positions[event[1]] = (event[2], event[3])
+    self.assertEqual(positions, {npc.slot_index: npc.coordinate for npc in engine.npc_registry.registered_npcs})
+
+  def test_hits_should_come_before_the_death_they_cause(self):
+    random.seed(4)
+    engine = self.build_engine(2)
+    events = [event for _, batch in engine.events(800) for event in batch]
+    death = next(index for index, event in enumerate(events) if event[0] == 'death')
+    hit = next(event for event in reversed(events[:death]) if event[0] == 'hit' and event[1] == events[death][1])
+    self.assertEqual(hit[3], 0)
+
+  def test_should_only_run_as_far_as_the_consumer_pulls(self):
+    engine = self.build_engine(1)
+    npc = engine.npc_registry.registered_npcs[0]
+    cannon = engine.player_registry.registered_players[0].cannon()
+    iterator = engine.events()
+
+    for _ in range(3):
+      next(iterator)
+    self.assertEqual(engine.player_registry.registered_players[0].ticks_in_area, 3)
+    self.assertIn('move', vars(npc))
+
+    iterator.close()
+    self.assertNotIn('move', vars(npc))
+    self.assertNotIn('turn', vars(cannon))
+    engine.perform_ticks(2)
+    self.assertEqual(engine.player_registry.registered_players[0].ticks_in_area, 5)
+
+  def test_async_events_should_yield_the_same_batches(self):
+    random.seed(5)
+    expected = list(self.build_engine(3).events(200))
+
+    async def collect():
+      return [batch async for batch in engine.aevents(200)]
+    random.seed(5)
+    engine = self.build_engine(3)
+    self.assertEqual(asyncio.run(collect()), expected)
+
 if __name__ == '__main__':
   main()
\ No newline at end of file
@@ -6,13 +6,20 @@ from pathlib import Path
 # Get 3x3 of chunks around that coord
 # Load those files and populate objects needed
 
+# Game data is loaded on first use so importing the simulator doesn't need the data dumps
 LOC_ID_TO_CONFIG_MAP = {}
-locations_config = json.load(open('./out/data_osrs/location_configs.json', 'r'))
-id_to_loc_config_map = {}
-for config in locations_config:
-  LOC_ID_TO_CONFIG_MAP[config['id']] = config
+def load_loc_configs():
+  if not LOC_ID_TO_CONFIG_MAP:
+    locations_config = json.load(open('./out/data_osrs/location_configs.json', 'r'))
+    for config in locations_config:
+      LOC_ID_TO_CONFIG_MAP[config['id']] = config
+  return LOC_ID_TO_CONFIG_MAP
 
-NPC_MAP = json.load(open('./npcs_reduced.json', 'r'))
+NPC_MAP = []
+def load_npc_map():
+  if not NPC_MAP:
+    NPC_MAP.extend(json.load(open('./npcs_reduced.json', 'r')))
+  return NPC_MAP
 
 class Mask:
   TOP = 1
@@ -29,21 +36,43 @@ class TileFlagMask:
   BLOCKING = 1
   ROOF = 4
 
+# Movement flags of a tile nothing can walk onto, same as a solid object
+FULL_BLOCK_MOVEMENT_FLAGS = Mask.TOP + Mask.LEFT + Mask.RIGHT + Mask.BOTTOM + Mask.OBJECT
+
 def tile_def_for_chunk(chunk_to_load):
+  # Settings of the 64x64 tiles in the chunk, one byte per tile indexed by 64*x + y. Empty if there is no tile dump.
   tile_file_path = Path(f'./out/data_osrs/tiles/{chunk_to_load[0]}_{chunk_to_load[1]}.json')
-  tile_mapping = defaultdict(lambda: defaultdict(int))
-
-  if tile_file_path.exists():
-    with tile_file_path.open() as tile_file:
-      tiles = json.load(tile_file)['data']
-      for i in range(64):
-        for j in range(64):
-          settings = tiles[64*i + j]['settings']
-          settings = 0 if settings is None else settings
-          tile_mapping[i][j] = settings
-  return tile_mapping
-
-def create_map_config(coordinate):
+  if not tile_file_path.exists():
+    return b''
+  with tile_file_path.open() as tile_file:
+    tiles = json.load(tile_file)['data']
+  return bytes(tile['settings'] or 0 for tile in tiles[:64*64])
+
+def fold_tile_settings(mapping, chunk, tile_settings):
+  # Tiles that can't be walked on (water, void, ...) get the same movement flags as a solid object,
+  # so walkability only ever has to look at movement_flags
+  base_x = chunk[0]*64
+  base_y = chunk[1]*64
+  for index, settings in enumerate(tile_settings):
+    if settings == 0:
+      continue
+    x = base_x + index // 64
+    y = base_y + index % 64
+    # Big objects share one dict between their tiles, so replace it rather than updating it
+    current_data = mapping[x].get(y, {})
+    result = {**current_data, 'tile_flags': settings}
+    if settings & TileFlagMask.BLOCKING:
+      result['movement_flags'] = current_data.get('movement_flags', 0) | FULL_BLOCK_MOVEMENT_FLAGS
+      result.setdefault('projectile_flags', 0)
+    mapping[x][y] = result
+
+def region_for(coordinate):
+  # create_map_config loads the 128x128 area starting at the 64x64 region holding coordinate
+  return (coordinate[0]//64, coordinate[1]//64)
+
+def create_map_config(coordinate, plane=0):
+  # Collision for one plane of the region
+  loc_configs = load_loc_configs()
   center_chunk = (coordinate[0]//64, coordinate[1]//64)
   mapping = defaultdict(lambda: defaultdict(dict))
   for i in [0, 1]:
@@ -54,15 +83,14 @@ def create_map_config(coordinate):
         with file_path.open() as chunk_file:
           locs = json.load(chunk_file)
           for loc in locs:
-            # Only do plane 0 for now, see how long it takes anyone to notice
-            if loc['plane'] != 0:
+            if loc['plane'] != plane:
               continue
 
             current_data = mapping[chunk_to_load[0]*64 + loc['x']][chunk_to_load[1]*64 + loc['y']]
             existing_blockers = current_data['movement_flags'] if current_data else 0
             existing_projectile_flags = current_data['projectile_flags'] if current_data else 0
 
-            blocks_projectiles = LOC_ID_TO_CONFIG_MAP[loc['id']].get('blocks_projectiles', True)
+            blocks_projectiles = loc_configs[loc['id']].get('blocks_projectiles', True)
             rotation = loc.get('rotation', 0)
             typee = loc['type']
             blockers = 0
@@ -84,11 +112,11 @@ def create_map_config(coordinate):
             # Special weird case of bigger objects
             if typee == 10:
               if rotation % 2 == 0:
-                dim_x = LOC_ID_TO_CONFIG_MAP[loc['id']].get('dim_x', 1)
-                dim_y = LOC_ID_TO_CONFIG_MAP[loc['id']].get('dim_y', 1)
+                dim_x = loc_configs[loc['id']].get('dim_x', 1)
+                dim_y = loc_configs[loc['id']].get('dim_y', 1)
               else:
-                dim_x = LOC_ID_TO_CONFIG_MAP[loc['id']].get('dim_y', 1)
-                dim_y = LOC_ID_TO_CONFIG_MAP[loc['id']].get('dim_x', 1)
+                dim_x = loc_configs[loc['id']].get('dim_y', 1)
+                dim_y = loc_configs[loc['id']].get('dim_x', 1)
               blockers = Mask.TOP + Mask.LEFT + Mask.RIGHT + Mask.BOTTOM
               projectile_flags = blockers if blocks_projectiles else 0
               result = {'movement_flags': existing_blockers | blockers, 'projectile_flags': existing_projectile_flags | projectile_flags}
@@ -96,24 +124,82 @@ def create_map_config(coordinate):
                 for z in range(dim_y):
                   mapping[chunk_to_load[0]*64 + loc['x'] + w][chunk_to_load[1]*64 + loc['y'] + z] = result
 
-      tile_defs = tile_def_for_chunk(chunk_to_load)
-      for w in range(64):
-        for z in range(64):
-          if tile_defs[w][z] != 0:
-            mapping[chunk_to_load[0]*64 + w][chunk_to_load[1]*64 + z]['tile_flags'] = tile_defs[w][z]
+      # Tile dumps only hold the surface
+      if plane != 0:
+        continue
+      fold_tile_settings(mapping, chunk_to_load, tile_def_for_chunk(chunk_to_load))
 
   return mapping
 
-def relevant_npcs(coordinate):
+class TileBitmap:
+  # One byte per tile over a width x height area starting at origin, tiles outside of it read as unset
+  def __init__(self, origin, width, height):
+    self.origin = origin
+    self.width = width
+    self.height = height
+    self.data = bytearray(width * height)
+
+  def get(self, coordinate):
+    x = coordinate[0] - self.origin[0]
+    y = coordinate[1] - self.origin[1]
+    if 0 <= x < self.width and 0 <= y < self.height:
+      return self.data[x * self.height + y] != 0
+    return False
+
+  def set_area(self, bottom_left, top_right, value=1):
+    # Inclusive corners, clipped to the bitmap
+    min_x = max(bottom_left[0] - self.origin[0], 0)
+    max_x = min(top_right[0] - self.origin[0], self.width - 1)
+    min_y = max(bottom_left[1] - self.origin[1], 0)
+    max_y = min(top_right[1] - self.origin[1], self.height - 1)
+    if min_y > max_y:
+      return
+    column = bytes([value]) * (max_y - min_y + 1)
+    for x in range(min_x, max_x + 1):
+      start = x * self.height + min_y
+      self.data[start:start + len(column)] = column
+
+# Multi-combat zones as inclusive rectangles [x1, y1, x2, y2] (optionally with a plane as a fifth value)
+MULTICOMBAT_ZONES_PATH = Path('./out/data_osrs/multicombat_zones.json')
+def load_multicombat_zones(path=MULTICOMBAT_ZONES_PATH):
+  path = Path(path)
+  if not path.exists():
+    return []
+  with path.open() as zones_file:
+    return json.load(zones_file)
+
+def create_multicombat_map(coordinate, zones=None, plane=0):
+  # Bitmap over the same 128x128 area create_map_config loads
+  if zones is None:
+    zones = load_multicombat_zones()
+  center_chunk = (coordinate[0]//64, coordinate[1]//64)
+  bitmap = TileBitmap((center_chunk[0]*64, center_chunk[1]*64), 128, 128)
+  for zone in zones:
+    zone_plane = zone[4] if len(zone) > 4 else 0
+    if zone_plane == plane:
+      bitmap.set_area((zone[0], zone[1]), (zone[2], zone[3]))
+  return bitmap
+
+def create_multicombat_map_for_zones(zones, plane=0):
+  # Bitmap just big enough to hold the zones, for maps that weren't compiled from a region
+  zones = [zone for zone in zones if (zone[4] if len(zone) > 4 else 0) == plane]
+  if not zones:
+    return None
+  bottom_left = (min(zone[0] for zone in zones), min(zone[1] for zone in zones))
+  top_right = (max(zone[2] for zone in zones), max(zone[3] for zone in zones))
+  bitmap = TileBitmap(bottom_left, top_right[0] - bottom_left[0] + 1, top_right[1] - bottom_left[1] + 1)
+  for zone in zones:
+    bitmap.set_area((zone[0], zone[1]), (zone[2], zone[3]))
+  return bitmap
+
+def relevant_npcs(coordinate, plane=0):
   bottom_left_coord = ((coordinate[0]//64 - 1)*64, (coordinate[1]//64 - 1)*64)
   top_right_coord = ((coordinate[0]//64 + 1)*64 + 63, (coordinate[1]//64 + 1)*64 + 63)
   npcs = []
-  for npc in NPC_MAP:
+  for npc in load_npc_map():
     x = npc['x']
     y = npc['y']
-    plane = npc['p']
-    # TODO: Make this allow multiplane
-    if plane != 0:
+    if npc['p'] != plane:
       continue
     if bottom_left_coord[0] <= x <= top_right_coord[0] and bottom_left_coord[1] <= y <= top_right_coord[1]:
       npcs.append(npc)
@@ -0,0 +1,206 @@
+import argparse
+import math
+import random
+from statistics import fmean, variance
+from cannon_sim import SIMULATOR_VERSION, SimpleWalkabilityStrategy, count_kills
+from scenario import load_scenarios
+from steady_state import DEFAULT_CONFIDENCE, t_critical
+from sweep import read_columns, write_columns
+
+# Checks a candidate engine (a faster strategy, a precomputed table, a rewrite) against the reference Engine.
+#   python differential.py scenarios.json --candidate no-fast-forward --replicates 5
+#   python differential.py scenarios.json --record-golden golden.json.gz
+#   python differential.py scenarios.json --candidate simple-walkability --golden golden.json.gz
+#   python differential.py scenarios.json --candidate no-fast-forward --statistical --replicates 200
+# Traces hold the state after every tick: each npc's tile, hitpoints, mode and whether it's dead, and each
+# cannon's direction and the npc it picked that tick. The first difference is reported with its tick.
+# Golden traces saved from the reference keep the old behaviour around to check against after changing it.
+# Candidates that can't match the reference draw for draw are compared on kill counts instead.
+# A candidate is a function from a scenario to an engine with the same registries as Engine, seeded by the caller.
+
+NPC_FIELDS = ['slot', 'x', 'y', 'hitpoints', 'mode', 'dead']
+CANNON_FIELDS = ['dx', 'dy', 'target']
+
+CANDIDATES = {
+  'reference': lambda scenario: scenario.build_engine(),
+  'no-fast-forward': lambda scenario: scenario.build_engine(fast_forward=False),
+  'simple-walkability': lambda scenario: scenario.build_engine(walkability_strategy_class=SimpleWalkabilityStrategy),
+}
+
+class Divergence:
+  def __init__(self, scenario, replicate, tick, entity, field, expected, actual):
+    self.scenario = scenario
+    self.replicate = replicate
+    self.tick = tick
+    self.entity = entity
+    self.field = field
+    self.expected = expected
+    self.actual = actual
+
+  def __str__(self):
+    return f'{self.scenario} replicate {self.replicate}, tick {self.tick}: {self.entity} {self.field} was {self.actual}, expected {self.expected}'
+
+class _Tracer:
+  def __init__(self, engine):
+    self.engine = engine
+    self.cannons = [player.cannon() for player in engine.player_registry.registered_players if player.cannon() is not None]
+    self.targets = [None] * len(self.cannons)
+    self.states = []
+    for i, cannon in enumerate(self.cannons):
+      self._watch(i, cannon)
+    # State is recorded after every tick, so a single perform_ticks call drives the run with the same
+    # fast forwarding schedule as a normal one
+    perform_tick = engine.perform_tick
+    def perform_tick_and_record(quiet=False):
+      perform_tick(quiet)
+      self.states.append(self.state())
+    engine.perform_tick = perform_tick_and_record
+
+  def _watch(self, i, cannon):
+    # Wrapped on the instance, like stats instrumentation
+    get_target = cannon.get_target
+    def get_target_and_record():
+      npc = get_target()
+      self.targets[i] = npc.slot_index if npc is not None else None
+      return npc
+    cannon.get_target = get_target_and_record
+
+  def state(self):
+    npcs = [[npc.slot_index, npc.x, npc.y, npc.hitpoints, npc.mode.name, npc.is_dead()] for npc in self.engine.npc_registry.registered_npcs]
+    cannons = [[cannon.direction[0], cannon.direction[1], target] for cannon, target in zip(self.cannons, self.targets)]
+    self.targets = [None] * len(self.cannons)
+    return [npcs, cannons]
+
+def trace(scenario, replicate, build=CANDIDATES['reference'], ticks=None):
+  # State after each tick of a replicate, seeded like Scenario.run_replicate
+  random.seed(scenario.seed_for(replicate))
+  tracer = _Tracer(build(scenario))
+  tracer.engine.perform_ticks(scenario.ticks if ticks is None else ticks)
+  return tracer.states
+
+def first_divergence(expected, actual, scenario_name='', replicate=0):
+  # The first difference between two traces, None if they match
+  for tick, (expected_state, actual_state) in enumerate(zip(expected, actual), 1):
+    if expected_state == actual_state:
+      continue
+    for kind, fields, expected_rows, actual_rows in zip(['npc', 'cannon'], [NPC_FIELDS, CANNON_FIELDS], expected_state, actual_state):
+      if len(expected_rows) != len(actual_rows):
+        return Divergence(scenario_name, replicate, tick, f'{kind}s', 'count', len(expected_rows), len(actual_rows))
+      for i, (expected_row, actual_row) in enumerate(zip(expected_rows, actual_rows)):
+        for field, expected_value, actual_value in zip(fields, expected_row, actual_row):
+          if expected_value != actual_value:
+            return Divergence(scenario_name, replicate, tick, f'{kind} {i}', field, expected_value, actual_value)
+  if len(expected) != len(actual):
+    return Divergence(scenario_name, replicate, min(len(expected), len(actual)) + 1, 'trace', 'ticks', len(expected), len(actual))
+  return None
+
+def compare(scenarios, candidate, replicates, ticks=None, golden=None):
+  # Divergences of candidate from the reference (or from golden traces) over the first replicates of each scenario
+  divergences = []
+  for scenario in scenarios:
+    for replicate in range(replicates):
+      if golden is not None:
+        expected = golden_trace(golden, scenario, replicate)
+        if ticks is not None:
+          expected = expected[:ticks]
+      else:
+        expected = trace(scenario, replicate, ticks=ticks)
+      actual = trace(scenario, replicate, candidate, len(expected))
+      divergence = first_divergence(expected, actual, scenario.name, replicate)
+      if divergence is not None:
+        divergences.append(divergence)
+  return divergences
+
+def record_golden(scenarios, replicates, ticks=None):
+  return {
+    'version': SIMULATOR_VERSION,
+    'traces': [
+      {'scenario': scenario.to_dict(), 'replicate': replicate, 'states': trace(scenario, replicate, ticks=ticks)}
+      for scenario in scenarios for replicate in range(replicates)
+    ],
+  }
+
+def golden_trace(golden, scenario, replicate):
+  data = scenario.to_dict()
+  for golden_run in golden['traces']:
+    if golden_run['scenario'] == data and golden_run['replicate'] == replicate:
+      return golden_run['states']
+  raise KeyError(f'No golden trace for {scenario.name} replicate {replicate}')
+
+def compare_statistically(scenarios, candidate, replicates, confidence=DEFAULT_CONFIDENCE):
+  # Welch confidence interval for the difference in mean kills per scenario, the candidate is consistent with
+  # the reference when it holds 0. Candidate replicates use their own seeds so the samples are independent.
+  rows = []
+  for scenario in scenarios:
+    reference_kills = []
+    candidate_kills = []
+    for replicate in range(replicates):
+      random.seed(scenario.seed_for(replicate))
+      engine = scenario.build_engine()
+      engine.perform_ticks(scenario.ticks)
+      reference_kills.append(count_kills(engine.npc_registry))
+
+      random.seed(scenario.seed_for(replicates + replicate))
+      engine = candidate(scenario)
+      engine.perform_ticks(scenario.ticks)
+      candidate_kills.append(count_kills(engine.npc_registry))
+
+    difference = fmean(candidate_kills) - fmean(reference_kills)
+    reference_error = variance(reference_kills) / replicates if replicates > 1 else 0.0
+    candidate_error = variance(candidate_kills) / replicates if replicates > 1 else 0.0
+    standard_error = math.sqrt(reference_error + candidate_error)
+    if standard_error > 0:
+      # Welch-Satterthwaite degrees of freedom
+      degrees_of_freedom = (reference_error + candidate_error) ** 2 / ((reference_error ** 2 + candidate_error ** 2) / (replicates - 1))
+      half_width = t_critical(max(1, round(degrees_of_freedom)), confidence) * standard_error
+    else:
+      half_width = 0.0
+    rows.append({
+      'scenario': scenario.name,
+      'replicates': replicates,
+      'reference_mean_kills': fmean(reference_kills),
+      'candidate_mean_kills': fmean(candidate_kills),
+      'difference': difference,
+      'half_width': half_width,
+      'consistent': abs(difference) <= half_width,
+    })
+  return rows
+
+def main(argv=None):
+  parser = argparse.ArgumentParser(description='Compare a candidate engine with the reference engine tick by tick')
+  parser.add_argument('scenario_file')
+  parser.add_argument('--candidate', choices=sorted(CANDIDATES), default='reference')
+  parser.add_argument('--replicates', type=int, default=3, help='Replicates of each scenario to compare')
+  parser.add_argument('--ticks', type=int, default=None, help='Only compare the first ticks of each replicate')
+  parser.add_argument('--golden', help='Compare against golden traces from this file instead of running the reference')
+  parser.add_argument('--record-golden', help='Save reference traces to this file, gzipped if it ends in .gz')
+  parser.add_argument('--statistical', action='store_true', help='Compare mean kills instead of traces')
+  parser.add_argument('--confidence', type=float, default=DEFAULT_CONFIDENCE)
+  args = parser.parse_args(argv)
+
+  scenarios = load_scenarios(args.scenario_file)
+  if args.record_golden:
+    write_columns(args.record_golden, record_golden(scenarios, args.replicates, args.ticks))
+    print(f'Saved {len(scenarios) * args.replicates} golden traces to {args.record_golden}')
+    return 0
+
+  candidate = CANDIDATES[args.candidate]
+  if args.statistical:
+    rows = compare_statistically(scenarios, candidate, args.replicates, args.confidence)
+    for row in rows:
+      verdict = 'ok' if row['consistent'] else 'DIFFERENT'
+      print(f"{row['scenario']}: {row['candidate_mean_kills']:.2f} vs {row['reference_mean_kills']:.2f} kills, difference {row['difference']:+.2f} ± {row['half_width']:.2f} {verdict}")
+    return 0 if all(row['consistent'] for row in rows) else 1
+
+  golden = read_columns(args.golden) if args.golden else None
+  if golden is not None and golden['version'] != SIMULATOR_VERSION:
+    print(f"Golden traces are from simulator version {golden['version']}, this is version {SIMULATOR_VERSION}")
+  divergences = compare(scenarios, candidate, args.replicates, args.ticks, golden)
+  for divergence in divergences:
+    print(divergence)
+  if not divergences:
+    print(f'{args.candidate} matches on every tick of {len(scenarios) * args.replicates} replicates')
+  return 1 if divergences else 0
+
+if __name__ == '__main__':
+  raise SystemExit(main())
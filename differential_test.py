@@ -0,0 +1,83 @@
+import json
+import random
+from unittest import TestCase, main
+from cannon_sim import DamageAction
+from differential import CANDIDATES, compare, compare_statistically, first_divergence, record_golden, trace
+from sweep_test import skeleton_scenario
+from synthetic import synthetic_scenario
+
+def harder_hitting_cannon(scenario):
+  # Same draws as the reference, one more damage per hit
+  engine = scenario.build_engine()
+  for player in engine.player_registry.registered_players:
+    cannon = player.cannon()
+    def queue_damage(npc, cannon=cannon):
+      npc.add_to_queue(DamageAction(random.randint(0, 30) + 1, cannon.player))
+    cannon.queue_damage = queue_damage
+  return engine
+
+def no_cannon(scenario):
+  engine = scenario.build_engine()
+  for player in engine.player_registry.registered_players:
+    player._cannon = None
+  return engine
+
+class DifferentialTest(TestCase):
+
+  def test_exact_candidates_should_match_the_reference(self):
+    scenarios = [skeleton_scenario()]
+    self.assertEqual(compare(scenarios, CANDIDATES['no-fast-forward'], replicates=3), [])
+    self.assertEqual(compare(scenarios, CANDIDATES['simple-walkability'], replicates=2), [])
+
+  def test_reference_traces_should_fast_forward_like_normal_runs(self):
+    scenario = synthetic_scenario('sparse', 60, 60, 4, seed=3, ticks=400)
+    quiet_ticks = []
+    def counting_quiet_ticks(scenario):
+      engine = scenario.build_engine()
+      perform_tick = engine.perform_tick
+      def perform_tick_and_count(quiet=False):
+        quiet_ticks.append(quiet)
+        perform_tick(quiet)
+      engine.perform_tick = perform_tick_and_count
+      return engine
+
+    states = trace(scenario, 0, counting_quiet_ticks)
+
+    self.assertEqual(len(states), 400)
+    self.assertTrue(any(quiet_ticks))
+    self.assertEqual(states, trace(scenario, 0, CANDIDATES['no-fast-forward']))
+
+  def test_should_report_the_first_divergence(self):
+    scenario = skeleton_scenario()
+    expected = trace(scenario, 0)
+    actual = trace(scenario, 0, harder_hitting_cannon)
+
+    divergence = first_divergence(expected, actual, scenario.name, 0)
+
+    self.assertIsNotNone(divergence)
+    self.assertEqual(divergence.field, 'hitpoints')
+    self.assertEqual(divergence.actual, divergence.expected - 1)
+    self.assertEqual(expected[:divergence.tick - 1], actual[:divergence.tick - 1])
+    self.assertIn(f'tick {divergence.tick}', str(divergence))
+
+  def test_should_compare_against_golden_traces(self):
+    scenarios = [skeleton_scenario()]
+    golden = json.loads(json.dumps(record_golden(scenarios, replicates=2, ticks=100)))
+
+    self.assertEqual(compare(scenarios, CANDIDATES['no-fast-forward'], replicates=2, golden=golden), [])
+    divergences = compare(scenarios, harder_hitting_cannon, replicates=2, golden=golden)
+    self.assertTrue(all(divergence.tick <= 100 for divergence in divergences))
+    with self.assertRaises(KeyError):
+      compare(scenarios, CANDIDATES['reference'], replicates=3, golden=golden)
+
+  def test_statistical_mode_should_tell_apart_different_kill_rates(self):
+    scenarios = [skeleton_scenario()]
+    same, = compare_statistically(scenarios, CANDIDATES['no-fast-forward'], replicates=20)
+    different, = compare_statistically(scenarios, no_cannon, replicates=20)
+
+    self.assertTrue(same['consistent'])
+    self.assertFalse(different['consistent'])
+    self.assertLess(different['difference'], 0)
+
+if __name__ == '__main__':
+  main()
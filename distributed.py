@@ -0,0 +1,262 @@
+import argparse
+import asyncio
+import json
+import multiprocessing
+import socket
+import threading
+from collections import deque
+from time import monotonic
+from scenario import Scenario, load_scenarios
+from sweep import DEFAULT_BATCH_SIZE, build_columns, summarize, work_units, write_columns
+
+# Sweeps spread over several machines. A coordinator hands out work units (a scenario and a replicate
+# range, see sweep.work_units) to workers that connect to it over TCP:
+#   python distributed.py coordinator scenarios.json -o results.json.gz --port 7777
+#   python distributed.py worker --host coordinator-box --port 7777 --processes 8
+# Messages are JSON lines. Workers ask for units, send results back and send heartbeats while they work:
+#   worker -> coordinator: {"type": "hello", "name": ...}, {"type": "request"}, {"type": "heartbeat"},
+#                          {"type": "result", "unit": 3, "kills": [...]}
+#   coordinator -> worker: {"type": "unit", "unit": 3, "scenario": {...}, "start": 50, "stop": 75},
+#                          {"type": "wait", "seconds": 1}, {"type": "done"}
+# Units of workers that stop sending heartbeats (or disconnect) go back in the queue. Once the queue is empty,
+# idle workers are also given copies of units still running elsewhere so a slow worker can't hold up the sweep.
+# Every replicate is seeded from its scenario, so whichever copy finishes first gives the same answer.
+
+HEARTBEAT_INTERVAL = 5
+HEARTBEAT_TIMEOUT = 30
+WAIT_SECONDS = 1
+# Workers running a unit at once, including the first one, before it stops being stolen
+MAX_UNIT_HOLDERS = 2
+
+async def send_message(writer, message):
+  writer.write(json.dumps(message, separators=(',', ':')).encode() + b'\n')
+  await writer.drain()
+
+class _WorkerState:
+  def __init__(self, name, writer):
+    self.name = name
+    self.writer = writer
+    self.label = name
+    self.last_seen = monotonic()
+    self.units = set()
+
+class Coordinator:
+  def __init__(self, scenarios, batch_size=DEFAULT_BATCH_SIZE, heartbeat_timeout=HEARTBEAT_TIMEOUT):
+    self.scenarios = scenarios
+    self.heartbeat_timeout = heartbeat_timeout
+    self.units = dict(enumerate(work_units(scenarios, batch_size)))
+    self.scenario_data = [scenario.to_dict() for scenario in scenarios]
+    self.pending = deque(self.units)
+    # Unit id to the workers running it and when they were given it
+    self.holders = {unit_id: {} for unit_id in self.units}
+    self.results = {}
+    self.workers = {}
+    self.reassigned = 0
+    self.stolen = 0
+    self._next_worker = 0
+    self._done = asyncio.Event()
+    if not self.units:
+      self._done.set()
+    self.server = None
+    self._reaper = None
+
+  async def start(self, host='127.0.0.1', port=0):
+    self.server = await asyncio.start_server(self.handle_connection, host, port)
+    self._reaper = asyncio.create_task(self._reap_lost_workers())
+    return self.server.sockets[0].getsockname()[1]
+
+  async def wait(self):
+    # Returns the same columns run_sweep would
+    await self._done.wait()
+    for worker in list(self.workers.values()):
+      try:
+        await send_message(worker.writer, {'type': 'done'})
+      except ConnectionError:
+        pass
+    self._reaper.cancel()
+    self.server.close()
+    await self.server.wait_closed()
+
+    kills_by_scenario = [[None] * scenario.replicates for scenario in self.scenarios]
+    for unit_id, kills in self.results.items():
+      index, _, start, _ = self.units[unit_id]
+      kills_by_scenario[index][start:start + len(kills)] = kills
+    return build_columns(self.scenarios, kills_by_scenario)
+
+  def _next_unit(self, worker):
+    while self.pending:
+      unit_id = self.pending.popleft()
+      if unit_id not in self.results:
+        return unit_id
+    # Nothing left to hand out, copy the unit that has been running longest with the fewest workers on it
+    candidates = [
+      (len(holders), min(holders.values()), unit_id)
+      for unit_id, holders in self.holders.items()
+      if unit_id not in self.results and holders and worker.name not in holders and len(holders) < MAX_UNIT_HOLDERS
+    ]
+    if candidates:
+      self.stolen += 1
+      return min(candidates)[2]
+    return None
+
+  async def _assign(self, worker):
+    if self._done.is_set():
+      await send_message(worker.writer, {'type': 'done'})
+      return
+    unit_id = self._next_unit(worker)
+    if unit_id is None:
+      await send_message(worker.writer, {'type': 'wait', 'seconds': WAIT_SECONDS})
+      return
+    index, _, start, stop = self.units[unit_id]
+    self.holders[unit_id][worker.name] = monotonic()
+    worker.units.add(unit_id)
+    await send_message(worker.writer, {'type': 'unit', 'unit': unit_id, 'scenario': self.scenario_data[index], 'start': start, 'stop': stop})
+
+  def _finish(self, worker, unit_id, kills):
+    worker.units.discard(unit_id)
+    self.holders[unit_id].pop(worker.name, None)
+    if unit_id in self.results:
+      return
+    self.results[unit_id] = kills
+    self.holders[unit_id] = {}
+    if len(self.results) == len(self.units):
+      self._done.set()
+
+  def _drop_worker(self, worker):
+    # Units nobody else is running go back to the front of the queue
+    if self.workers.pop(worker.name, None) is None:
+      return
+    for unit_id in worker.units:
+      self.holders[unit_id].pop(worker.name, None)
+      if unit_id not in self.results and not self.holders[unit_id]:
+        self.pending.appendleft(unit_id)
+        self.reassigned += 1
+    worker.units = set()
+    worker.writer.close()
+
+  async def _reap_lost_workers(self):
+    while True:
+      await asyncio.sleep(self.heartbeat_timeout / 4)
+      now = monotonic()
+      for worker in list(self.workers.values()):
+        if now - worker.last_seen > self.heartbeat_timeout:
+          self._drop_worker(worker)
+
+  async def handle_connection(self, reader, writer):
+    self._next_worker += 1
+    worker = _WorkerState(f'worker-{self._next_worker}', writer)
+    self.workers[worker.name] = worker
+    try:
+      while line := await reader.readline():
+        if worker.name not in self.workers:
+          # Timed out, anything it sends now is ignored
+          break
+        worker.last_seen = monotonic()
+        message = json.loads(line)
+        if message['type'] == 'hello':
+          worker.label = message.get('name') or worker.name
+        elif message['type'] == 'request':
+          await self._assign(worker)
+        elif message['type'] == 'result':
+          if message['unit'] in worker.units:
+            self._finish(worker, message['unit'], message['kills'])
+    except (ConnectionError, ValueError):
+      pass
+    finally:
+      self._drop_worker(worker)
+
+# Replicates are seeded through the global random module, so workers sharing a process take turns
+_replicate_lock = threading.Lock()
+
+def run_unit(scenario_data, start, stop):
+  with _replicate_lock:
+    return _run_unit(scenario_data, start, stop)
+
+def _run_unit(scenario_data, start, stop):
+  scenario = Scenario.from_dict(scenario_data)
+  return [scenario.run_replicate(replicate) for replicate in range(start, stop)]
+
+async def run_worker(host, port, name=None, heartbeat_interval=HEARTBEAT_INTERVAL):
+  # Runs units until the coordinator says it's done. Returns how many units this worker finished.
+  reader, writer = await asyncio.open_connection(host, port)
+  loop = asyncio.get_running_loop()
+  write_lock = asyncio.Lock()
+  async def send(message):
+    async with write_lock:
+      await send_message(writer, message)
+
+  async def heartbeat():
+    while True:
+      await asyncio.sleep(heartbeat_interval)
+      await send({'type': 'heartbeat'})
+
+  heartbeats = asyncio.create_task(heartbeat())
+  finished = 0
+  try:
+    await send({'type': 'hello', 'name': name or socket.gethostname()})
+    while True:
+      await send({'type': 'request'})
+      line = await reader.readline()
+      if not line:
+        break
+      message = json.loads(line)
+      if message['type'] == 'done':
+        break
+      if message['type'] == 'wait':
+        await asyncio.sleep(message['seconds'])
+        continue
+      # Replicates run on a thread so heartbeats keep going out while they do
+      kills = await loop.run_in_executor(None, run_unit, message['scenario'], message['start'], message['stop'])
+      await send({'type': 'result', 'unit': message['unit'], 'kills': kills})
+      finished += 1
+  except ConnectionError:
+    pass
+  finally:
+    heartbeats.cancel()
+    writer.close()
+  return finished
+
+def _worker_process(host, port, name):
+  asyncio.run(run_worker(host, port, name))
+
+def main(argv=None):
+  parser = argparse.ArgumentParser(description='Run a sweep over several machines')
+  subparsers = parser.add_subparsers(dest='role', required=True)
+
+  coordinator = subparsers.add_parser('coordinator', help='Hand out the work units of a scenario file and collect the results')
+  coordinator.add_argument('scenario_file')
+  coordinator.add_argument('-o', '--output', default='results.json.gz', help='Columnar JSON output, gzipped if it ends in .gz')
+  coordinator.add_argument('--host', default='0.0.0.0')
+  coordinator.add_argument('--port', type=int, default=7777)
+  coordinator.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE, help='Replicates per work unit')
+  coordinator.add_argument('--heartbeat-timeout', type=float, default=HEARTBEAT_TIMEOUT, help='Seconds without hearing from a worker before its units are reassigned')
+
+  worker = subparsers.add_parser('worker', help='Run work units for a coordinator')
+  worker.add_argument('--host', required=True)
+  worker.add_argument('--port', type=int, default=7777)
+  worker.add_argument('--processes', type=int, default=multiprocessing.cpu_count(), help='Worker processes to start on this machine')
+
+  args = parser.parse_args(argv)
+  if args.role == 'coordinator':
+    scenarios = load_scenarios(args.scenario_file)
+    async def coordinate():
+      coordinator = Coordinator(scenarios, args.batch_size, args.heartbeat_timeout)
+      await coordinator.start(args.host, args.port)
+      print(f'Waiting for workers on {args.host}:{args.port} with {len(coordinator.units)} work units', flush=True)
+      columns = await coordinator.wait()
+      print(f'{coordinator.reassigned} units reassigned, {coordinator.stolen} stolen')
+      return columns
+    columns = asyncio.run(coordinate())
+    write_columns(args.output, columns)
+    for row in summarize(scenarios, columns):
+      print(f"{row['scenario']}: {row['mean_kills']:.2f} kills over {row['replicates']} runs ({row['kills_per_hour']:.1f}/hr)")
+  else:
+    hostname = socket.gethostname()
+    processes = [multiprocessing.Process(target=_worker_process, args=(args.host, args.port, f'{hostname}-{i}')) for i in range(args.processes)]
+    for process in processes:
+      process.start()
+    for process in processes:
+      process.join()
+
+if __name__ == '__main__':
+  main()
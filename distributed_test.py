@@ -0,0 +1,72 @@
+import asyncio
+import json
+from unittest import IsolatedAsyncioTestCase, main
+from distributed import Coordinator, run_worker
+from sweep import run_sweep
+from sweep_test import skeleton_scenario
+
+class CoordinatorTest(IsolatedAsyncioTestCase):
+
+  async def start(self, scenarios, heartbeat_timeout):
+    self.coordinator = Coordinator(scenarios, batch_size=2, heartbeat_timeout=heartbeat_timeout)
+    self.port = await self.coordinator.start()
+
+  def worker(self):
+    return asyncio.create_task(run_worker('127.0.0.1', self.port, heartbeat_interval=0.05))
+
+  async def silent_worker(self):
+    # Takes a unit then never answers or sends a heartbeat
+    reader, writer = await asyncio.open_connection('127.0.0.1', self.port)
+    writer.write(json.dumps({'type': 'request'}).encode() + b'\n')
+    await writer.drain()
+    message = json.loads(await reader.readline())
+    self.assertEqual(message['type'], 'unit')
+    return reader, writer
+
+  async def test_results_should_match_a_local_sweep(self):
+    scenarios = [skeleton_scenario(replicates=5), skeleton_scenario(replicates=3, name='skeletons 2')]
+    expected, _ = run_sweep(scenarios, workers=1)
+    await self.start(scenarios, heartbeat_timeout=5)
+
+    workers = [self.worker() for _ in range(3)]
+    columns = await self.coordinator.wait()
+    finished = await asyncio.gather(*workers)
+
+    self.assertEqual(columns, expected)
+    self.assertGreaterEqual(sum(finished), len(self.coordinator.units))
+
+  async def test_units_of_lost_workers_should_be_reassigned(self):
+    scenarios = [skeleton_scenario(replicates=4)]
+    expected, _ = run_sweep(scenarios, workers=1)
+    await self.start(scenarios, heartbeat_timeout=0.2)
+
+    _, writer = await self.silent_worker()
+    while not self.coordinator.reassigned:
+      await asyncio.sleep(0.05)
+    worker = self.worker()
+    columns = await self.coordinator.wait()
+    await worker
+    writer.close()
+
+    self.assertEqual(columns, expected)
+    self.assertEqual(self.coordinator.reassigned, 1)
+    self.assertEqual(self.coordinator.stolen, 0)
+
+  async def test_idle_workers_should_steal_units_held_by_slow_workers(self):
+    scenarios = [skeleton_scenario(replicates=4)]
+    expected, _ = run_sweep(scenarios, workers=1)
+    # Far too long a timeout for the silent worker to be noticed during the test
+    await self.start(scenarios, heartbeat_timeout=60)
+
+    _, writer = await self.silent_worker()
+    worker = self.worker()
+    columns = await asyncio.wait_for(self.coordinator.wait(), 30)
+    await worker
+    writer.close()
+
+    self.assertEqual(columns, expected)
+    self.assertEqual(self.coordinator.reassigned, 0)
+    self.assertEqual(self.coordinator.stolen, 1)
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,260 @@
+import argparse
+import multiprocessing
+import random
+from array import array
+import numpy as np
+from cannon_sim import STEP_DIRECTION_INDEXES, CannonHuntStrategy, cheb
+from scenario import load_scenarios
+from sweep import DEFAULT_BATCH_SIZE, preload_regions, work_units
+
+# Where a spot's npcs die, where they spend their time, where they get stuck and which tiles the cannon hits.
+#   python heatmap.py scenarios.json --scenario skeletons -o skeletons.npz --image kills.pgm --layer kills
+# Layers are integer arrays indexed [x, y] from the heatmap's bottom left tile, cannon hits have one layer per
+# cannon target area (direction index * 3 + ring, in the order of CannonHuntStrategy.get_target).
+# Heatmaps from different replicates or processes add up with merge (or +).
+
+LAYERS = ['kills', 'occupancy', 'stuck']
+TARGET_AREAS = len(STEP_DIRECTION_INDEXES) * len(CannonHuntStrategy.CANNON_RANGES)
+# Buffered tile indexes are added to the layers once there are this many
+FLUSH_SIZE = 1 << 16
+
+class TileHeatmap:
+  def __init__(self, bottom_left, width, height, plane=0):
+    self.bottom_left = tuple(bottom_left)
+    self.width = width
+    self.height = height
+    self.plane = plane
+    self.replicates = 0
+    self.ticks = 0
+    self.kills = np.zeros((width, height), dtype=np.int32)
+    self.occupancy = np.zeros((width, height), dtype=np.int32)
+    self.stuck = np.zeros((width, height), dtype=np.int32)
+    self.cannon_hits = np.zeros((TARGET_AREAS, width, height), dtype=np.int32)
+    # Flat tile indexes recorded since the last flush, tallied with bincount rather than one add per event
+    self._pending = {name: array('q') for name in LAYERS + ['cannon_hits']}
+
+  @classmethod
+  def for_region(cls, coordinate, plane=0):
+    # The same 128x128 area create_map_config compiles for coordinate
+    return cls((coordinate[0] // 64 * 64, coordinate[1] // 64 * 64), 128, 128, plane)
+
+  def _index(self, x, y):
+    x -= self.bottom_left[0]
+    y -= self.bottom_left[1]
+    if 0 <= x < self.width and 0 <= y < self.height:
+      return x * self.height + y
+    return -1
+
+  def attach(self, engine):
+    # Records every tick engine runs from now on. Entity methods are wrapped per instance,
+    # so engines without a heatmap are untouched.
+    npcs = [npc for npc in engine.npc_registry.registered_npcs if npc.plane == self.plane]
+    for npc in npcs:
+      self._watch_npc(npc)
+    for player in engine.player_registry.registered_players:
+      cannon = player.cannon()
+      if cannon is not None and cannon.plane == self.plane:
+        self._watch_cannon(cannon)
+
+    occupancy = self._pending['occupancy']
+    index = self._index
+    perform_tick = engine.perform_tick
+    def perform_tick_and_record(quiet=False):
+      perform_tick(quiet)
+      for npc in npcs:
+        if not npc._is_dead:
+          tile = index(npc._x, npc._y)
+          if tile >= 0:
+            occupancy.append(tile)
+      self.ticks += 1
+      if len(occupancy) >= FLUSH_SIZE:
+        self.flush()
+    engine.perform_tick = perform_tick_and_record
+
+  def _watch_npc(self, npc):
+    kills = self._pending['kills']
+    stuck = self._pending['stuck']
+    index = self._index
+
+    die = npc.die
+    def die_and_record():
+      tile = index(npc._x, npc._y)
+      if tile >= 0:
+        kills.append(tile)
+      die()
+    npc.die = die_and_record
+
+    move = npc.move
+    def move_and_record():
+      start = (npc._x, npc._y)
+      move()
+      # Wanted to go somewhere but didn't move
+      if (npc._x, npc._y) == start and npc.destination_tile != start:
+        tile = index(npc._x, npc._y)
+        if tile >= 0:
+          stuck.append(tile)
+    npc.move = move_and_record
+
+  def _watch_cannon(self, cannon):
+    hits = self._pending['cannon_hits']
+    index = self._index
+    tiles = self.width * self.height
+
+    queue_damage = cannon.queue_damage
+    def queue_damage_and_record(npc):
+      area = self.target_area(cannon, npc.coordinate)
+      tile = index(npc._x, npc._y)
+      if area is not None and tile >= 0:
+        hits.append(area * tiles + tile)
+      queue_damage(npc)
+    cannon.queue_damage = queue_damage_and_record
+
+  @staticmethod
+  def target_area(cannon, coordinate):
+    # The cannon picks its target from the first ring holding an npc, so the target is in no ring before its own
+    direction = cannon.direction
+    is_cardinal = (direction[0] + direction[1]) % 2 != 0
+    distances = CannonHuntStrategy.CARDINAL_CANNON_DISTANCES if is_cardinal else CannonHuntStrategy.ORDINAL_CANNON_DISTANCES
+    for ring, (distance, radius) in enumerate(zip(distances, CannonHuntStrategy.CANNON_RANGES)):
+      center = (cannon._x + direction[0] * distance, cannon._y + direction[1] * distance)
+      if cheb(center, coordinate) <= radius:
+        return STEP_DIRECTION_INDEXES[direction] * len(distances) + ring
+    return None
+
+  def flush(self):
+    for name, pending in self._pending.items():
+      if pending:
+        layer = getattr(self, name)
+        counts = np.bincount(np.frombuffer(pending, dtype=np.int64), minlength=layer.size)
+        layer += counts.reshape(layer.shape).astype(layer.dtype)
+        del pending[:]
+
+  def merge(self, other: 'TileHeatmap'):
+    if (other.bottom_left, other.width, other.height, other.plane) != (self.bottom_left, self.width, self.height, self.plane):
+      raise ValueError('Heatmaps cover different areas')
+    self.flush()
+    other.flush()
+    for name in LAYERS + ['cannon_hits']:
+      getattr(self, name)[...] += getattr(other, name)
+    self.replicates += other.replicates
+    self.ticks += other.ticks
+    return self
+
+  def __add__(self, other: 'TileHeatmap'):
+    combined = TileHeatmap(self.bottom_left, self.width, self.height, self.plane)
+    return combined.merge(self).merge(other)
+
+  def __getstate__(self):
+    # Pending events are flushed rather than pickled
+    self.flush()
+    state = dict(self.__dict__)
+    del state['_pending']
+    return state
+
+  def __setstate__(self, state):
+    self.__dict__.update(state)
+    self._pending = {name: array('q') for name in LAYERS + ['cannon_hits']}
+
+  def save(self, path):
+    self.flush()
+    np.savez_compressed(
+      path,
+      bottom_left=np.array(self.bottom_left),
+      plane=self.plane,
+      replicates=self.replicates,
+      ticks=self.ticks,
+      kills=self.kills,
+      occupancy=self.occupancy,
+      stuck=self.stuck,
+      cannon_hits=self.cannon_hits,
+    )
+
+  @classmethod
+  def load(cls, path):
+    with np.load(path) as data:
+      width, height = data['kills'].shape
+      heatmap = cls(tuple(int(v) for v in data['bottom_left']), width, height, int(data['plane']))
+      heatmap.replicates = int(data['replicates'])
+      heatmap.ticks = int(data['ticks'])
+      for name in LAYERS + ['cannon_hits']:
+        getattr(heatmap, name)[...] = data[name]
+    return heatmap
+
+  def layer(self, name):
+    # One of LAYERS, 'cannon_hits' for every target area summed, or 'cannon_hits:<area>' for one of them
+    self.flush()
+    if name == 'cannon_hits':
+      return self.cannon_hits.sum(axis=0)
+    if name.startswith('cannon_hits:'):
+      return self.cannon_hits[int(name.split(':', 1)[1])]
+    if name not in LAYERS:
+      raise ValueError(f'Unknown layer {name}')
+    return getattr(self, name)
+
+  def save_image(self, path, name='kills'):
+    # Greyscale PGM with north up, brighter is more. Square root scaling so a few hot tiles don't hide everything else.
+    values = np.sqrt(self.layer(name).astype(np.float64))
+    peak = values.max()
+    pixels = (values * (255 / peak) if peak > 0 else values).round().astype(np.uint8)
+    rows = np.ascontiguousarray(pixels.T[::-1])
+    with open(path, 'wb') as image:
+      image.write(f'P5 {self.width} {self.height} 255\n'.encode())
+      image.write(rows.tobytes())
+
+def record_replicate(scenario, replicate, heatmap):
+  # Same run as Scenario.run_replicate, recorded into heatmap
+  random.seed(scenario.seed_for(replicate))
+  engine = scenario.build_engine()
+  heatmap.attach(engine)
+  engine.perform_ticks(scenario.ticks)
+  heatmap.flush()
+  heatmap.replicates += 1
+  return heatmap
+
+def _record_work_unit(unit):
+  _, scenario, start, stop = unit
+  heatmap = TileHeatmap.for_region(scenario.player_tile, scenario.plane)
+  for replicate in range(start, stop):
+    record_replicate(scenario, replicate, heatmap)
+  return heatmap
+
+def run_heatmap(scenario, workers=None, batch_size=DEFAULT_BATCH_SIZE):
+  # Heatmap of every replicate of scenario, over the region around its player tile
+  units = work_units([scenario], batch_size)
+  heatmap = TileHeatmap.for_region(scenario.player_tile, scenario.plane)
+  if workers == 1:
+    for unit in units:
+      heatmap.merge(_record_work_unit(unit))
+    return heatmap
+  preload_regions([scenario])
+  with multiprocessing.Pool(workers) as pool:
+    for unit_heatmap in pool.imap_unordered(_record_work_unit, units):
+      heatmap.merge(unit_heatmap)
+  return heatmap
+
+def main(argv=None):
+  parser = argparse.ArgumentParser(description='Per tile heatmaps of a scenario over all of its replicates')
+  parser.add_argument('scenario_file')
+  parser.add_argument('--scenario', help='Name of the scenario to run, the first one by default')
+  parser.add_argument('-o', '--output', default='heatmap.npz', help='Where the layers are saved (numpy .npz)')
+  parser.add_argument('--image', help='Also write one layer as a PGM image')
+  parser.add_argument('--layer', default='kills', help=f"Layer for --image: {', '.join(LAYERS)}, cannon_hits or cannon_hits:<area>")
+  parser.add_argument('-w', '--workers', type=int, default=None, help='Worker processes (defaults to the cpu count)')
+  parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE, help='Replicates per work unit')
+  args = parser.parse_args(argv)
+
+  scenarios = load_scenarios(args.scenario_file)
+  if args.scenario is not None:
+    scenarios = [scenario for scenario in scenarios if scenario.name == args.scenario]
+    if not scenarios:
+      parser.error(f'No scenario named {args.scenario}')
+  scenario = scenarios[0]
+
+  heatmap = run_heatmap(scenario, args.workers, args.batch_size)
+  heatmap.save(args.output)
+  if args.image:
+    heatmap.save_image(args.image, args.layer)
+  print(f'{scenario.name}: {int(heatmap.kills.sum())} kills over {heatmap.replicates} runs, saved to {args.output}')
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,107 @@
+import pickle
+import random
+import tempfile
+from pathlib import Path
+from unittest import TestCase, main, skipIf
+from cannon_sim import Engine, MapRegistry, NpcRegistry, PlayerRegistry, SimpleHuntStrategy, SimpleWalkabilityStrategy
+from create_map import FULL_BLOCK_MOVEMENT_FLAGS
+from sweep_test import skeleton_scenario
+
+try:
+  import numpy
+except ImportError:
+  numpy = None
+
+if numpy is not None:
+  from heatmap import TileHeatmap, record_replicate, run_heatmap
+
+@skipIf(numpy is None, 'numpy is not installed')
+class TileHeatmapTest(TestCase):
+
+  def record(self, scenario, replicate=0):
+    heatmap = TileHeatmap((-30, -30), 60, 60)
+    return record_replicate(scenario, replicate, heatmap)
+
+  def test_recording_should_not_change_the_run(self):
+    scenario = skeleton_scenario()
+    heatmap = self.record(scenario, 2)
+
+    self.assertEqual(int(heatmap.kills.sum()), scenario.run_replicate(2))
+    self.assertEqual(heatmap.ticks, scenario.ticks)
+    self.assertEqual(heatmap.replicates, 1)
+
+  def test_every_cannon_hit_should_be_in_its_target_area(self):
+    scenario = skeleton_scenario()
+    heatmap = self.record(scenario)
+
+    self.assertGreater(heatmap.cannon_hits.sum(), 0)
+    cannon_x, cannon_y = scenario.cannon_tile
+    for area, x, y in zip(*numpy.nonzero(heatmap.cannon_hits)):
+      tile = (x + heatmap.bottom_left[0], y + heatmap.bottom_left[1])
+      # Rings are 1, 2 and 5 tiles around centers 2-3, 5-7 and 12-14 tiles out
+      distance = max(abs(tile[0] - cannon_x), abs(tile[1] - cannon_y))
+      low, high = [(1, 4), (3, 9), (7, 19)][area % 3]
+      self.assertTrue(low <= distance <= high, (area, tile))
+
+  def test_should_count_stuck_ticks_and_occupancy(self):
+    # An npc boxed into its spawn tile keeps trying to wander out
+    map_config = {x: {} for x in range(4, 7)}
+    for x, y in [(5, 6), (6, 5), (4, 5), (5, 4), (4, 4), (4, 6), (6, 4), (6, 6)]:
+      map_config[x][y] = {'movement_flags': FULL_BLOCK_MOVEMENT_FLAGS, 'projectile_flags': 0}
+    map_registry = MapRegistry(map_config)
+    npc_registry = NpcRegistry()
+    player_registry = PlayerRegistry()
+    strategy = SimpleWalkabilityStrategy(map_registry, npc_registry, player_registry)
+    npc_registry.create_npc(5, 5, strategy, SimpleHuntStrategy(map_registry, npc_registry, player_registry), opts={'wander_range': 3})
+    engine = Engine(map_registry, npc_registry, player_registry)
+
+    heatmap = TileHeatmap((0, 0), 10, 10)
+    heatmap.attach(engine)
+    random.seed(1)
+    engine.perform_ticks(200)
+    heatmap.flush()
+
+    self.assertEqual(heatmap.occupancy[5, 5], 200)
+    self.assertEqual(heatmap.occupancy.sum(), 200)
+    self.assertGreater(heatmap.stuck[5, 5], 0)
+    self.assertEqual(heatmap.stuck.sum(), heatmap.stuck[5, 5])
+
+  def test_heatmaps_should_add_up(self):
+    scenario = skeleton_scenario()
+    first = self.record(scenario, 0)
+    second = self.record(scenario, 1)
+    both = record_replicate(scenario, 1, self.record(scenario, 0))
+
+    combined = first + pickle.loads(pickle.dumps(second))
+    for name in ['kills', 'occupancy', 'stuck', 'cannon_hits']:
+      numpy.testing.assert_array_equal(getattr(combined, name), getattr(both, name))
+    self.assertEqual(combined.replicates, 2)
+    with self.assertRaises(ValueError):
+      first.merge(TileHeatmap((0, 0), 60, 60))
+
+  def test_should_match_across_worker_counts(self):
+    scenario = skeleton_scenario(replicates=4)
+    single = run_heatmap(scenario, workers=1, batch_size=1)
+    pooled = run_heatmap(scenario, workers=2, batch_size=1)
+    for name in ['kills', 'occupancy', 'stuck', 'cannon_hits']:
+      numpy.testing.assert_array_equal(getattr(single, name), getattr(pooled, name))
+    self.assertEqual(pooled.replicates, 4)
+
+  def test_should_save_and_load(self):
+    heatmap = self.record(skeleton_scenario())
+    with tempfile.TemporaryDirectory() as directory:
+      path = Path(directory) / 'heatmap.npz'
+      heatmap.save(path)
+      loaded = TileHeatmap.load(path)
+      image_path = Path(directory) / 'kills.pgm'
+      heatmap.save_image(image_path, 'kills')
+      image = image_path.read_bytes()
+
+    self.assertEqual((loaded.bottom_left, loaded.width, loaded.height), (heatmap.bottom_left, heatmap.width, heatmap.height))
+    numpy.testing.assert_array_equal(loaded.cannon_hits, heatmap.cannon_hits)
+    self.assertEqual(loaded.ticks, heatmap.ticks)
+    self.assertTrue(image.startswith(b'P5 60 60 255\n'))
+    self.assertEqual(len(image), len(b'P5 60 60 255\n') + 60 * 60)
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,192 @@
+import argparse
+import hashlib
+import random
+import cannon_sim
+from cannon_sim import SIMULATOR_VERSION, count_kills
+from scenario import Scenario, load_scenarios
+from sweep import read_columns, write_columns
+
+# Reproducing single runs, such as an outlier from a sweep, without keeping anything from the original run but a small log.
+#   python replay.py record scenarios.json --scenario skeletons --replicate 417 -o run417.json
+#   python replay.py replay run417.json --trace-from 5200 --until 5300
+# A run only depends on its scenario, its seed and anything changed from outside between ticks (player moves,
+# cannon placement), so that's all the log holds. Hashes of the random state every checkpoint_ticks catch a
+# replay drifting from the recording, for example after a change to the simulator.
+# Replays can stop at any tick and switch on npc path tracing (DEBUG_NPC_PATHING) only from a given tick.
+
+DEFAULT_CHECKPOINT_TICKS = 1000
+
+class ReplayDivergence(ValueError):
+  pass
+
+def random_state_hash():
+  return hashlib.blake2b(repr(random.getstate()).encode(), digest_size=8).hexdigest()
+
+class _Run:
+  # An engine and the tick it is on, started exactly like Scenario.run_replicate
+  def __init__(self, scenario, replicate):
+    self.scenario = scenario
+    self.replicate = replicate
+    random.seed(scenario.seed_for(replicate))
+    self.engine = scenario.build_engine()
+    self.tick = 0
+
+  def move_player(self, player_index, coordinate):
+    self.engine.player_registry.registered_players[player_index].coordinate = tuple(coordinate)
+
+  def place_cannon(self, player_index, coordinate):
+    self.engine.player_registry.registered_players[player_index].place_cannon(tuple(coordinate))
+
+  def _apply(self, kind, player_index, coordinate):
+    if kind == 'move_player':
+      self.move_player(player_index, coordinate)
+    elif kind == 'place_cannon':
+      self.place_cannon(player_index, coordinate)
+    else:
+      raise ValueError(f'Unknown input {kind}')
+
+class Recorder(_Run):
+  def __init__(self, scenario, replicate, checkpoint_ticks=DEFAULT_CHECKPOINT_TICKS):
+    super().__init__(scenario, replicate)
+    self.checkpoint_ticks = checkpoint_ticks
+    self.checkpoints = []
+    self.inputs = []
+
+  def perform_ticks(self, ticks):
+    # Stops at every checkpoint on the way, fast forwarding gives the same run however the ticks are split up
+    end = self.tick + ticks
+    while self.tick < end:
+      next_checkpoint = (self.tick // self.checkpoint_ticks + 1) * self.checkpoint_ticks
+      step = min(end, next_checkpoint) - self.tick
+      self.engine.perform_ticks(step)
+      self.tick += step
+      if self.tick == next_checkpoint:
+        self.checkpoints.append(random_state_hash())
+
+  def move_player(self, player_index, coordinate):
+    self.inputs.append([self.tick, 'move_player', player_index, list(coordinate)])
+    super().move_player(player_index, coordinate)
+
+  def place_cannon(self, player_index, coordinate):
+    self.inputs.append([self.tick, 'place_cannon', player_index, list(coordinate)])
+    super().place_cannon(player_index, coordinate)
+
+  def log(self):
+    return {
+      'version': SIMULATOR_VERSION,
+      'scenario': self.scenario.to_dict(),
+      'replicate': self.replicate,
+      'ticks': self.tick,
+      'checkpoint_ticks': self.checkpoint_ticks,
+      'checkpoints': self.checkpoints,
+      'inputs': self.inputs,
+      'kills': count_kills(self.engine.npc_registry),
+    }
+
+class Replayer(_Run):
+  def __init__(self, log):
+    if log['version'] != SIMULATOR_VERSION:
+      raise ReplayDivergence(f"Recorded with simulator version {log['version']}, this is version {SIMULATOR_VERSION}")
+    super().__init__(Scenario.from_dict(log['scenario']), log['replicate'])
+    self.log = log
+    self._next_input = 0
+
+  def run_to(self, tick, trace=False):
+    # Runs until tick ticks have been performed, checking every checkpoint passed. With trace, npcs record
+    # their paths (Npc.travel_path) for the ticks run by this call only.
+    tick = min(tick, self.log['ticks'])
+    checkpoint_ticks = self.log['checkpoint_ticks']
+    inputs = self.log['inputs']
+    tracing = cannon_sim.DEBUG_NPC_PATHING
+    cannon_sim.DEBUG_NPC_PATHING = trace
+    try:
+      while self.tick < tick:
+        while self._next_input < len(inputs) and inputs[self._next_input][0] == self.tick:
+          self._apply(*inputs[self._next_input][1:])
+          self._next_input += 1
+        next_checkpoint = (self.tick // checkpoint_ticks + 1) * checkpoint_ticks
+        next_input = inputs[self._next_input][0] if self._next_input < len(inputs) else tick
+        step = min(tick, next_checkpoint, next_input) - self.tick
+        self.engine.perform_ticks(step)
+        self.tick += step
+        if self.tick == next_checkpoint:
+          self._check(self.tick // checkpoint_ticks - 1)
+    finally:
+      cannon_sim.DEBUG_NPC_PATHING = tracing
+    return self.engine
+
+  def _check(self, index):
+    checkpoints = self.log['checkpoints']
+    if index < len(checkpoints) and random_state_hash() != checkpoints[index]:
+      raise ReplayDivergence(f'Replay diverged from the recording before tick {self.tick}')
+
+  def finish(self, trace=False):
+    # Runs to the end of the recording and checks it ended with the same kills
+    self.run_to(self.log['ticks'], trace)
+    kills = count_kills(self.engine.npc_registry)
+    if kills != self.log['kills']:
+      raise ReplayDivergence(f"Replay got {kills} kills, the recording {self.log['kills']}")
+    return self.engine
+
+def record_replicate(scenario, replicate, checkpoint_ticks=DEFAULT_CHECKPOINT_TICKS):
+  # The log of the same run as scenario.run_replicate(replicate)
+  recorder = Recorder(scenario, replicate, checkpoint_ticks)
+  recorder.perform_ticks(scenario.ticks)
+  return recorder.log()
+
+def replay(log, until=None, trace_from=None):
+  # Engine as it was at tick until (the end of the run by default), tracing npc paths from trace_from on
+  replayer = Replayer(log)
+  if trace_from is not None:
+    replayer.run_to(trace_from)
+  if until is None:
+    return replayer.finish(trace=trace_from is not None)
+  return replayer.run_to(until, trace=trace_from is not None)
+
+def main(argv=None):
+  parser = argparse.ArgumentParser(description='Record a run as a replay log, or replay one')
+  subparsers = parser.add_subparsers(dest='command', required=True)
+
+  record = subparsers.add_parser('record', help='Record one replicate of a scenario')
+  record.add_argument('scenario_file')
+  record.add_argument('--scenario', help='Name of the scenario, the first one by default')
+  record.add_argument('--replicate', type=int, required=True)
+  record.add_argument('-o', '--output', default='replay.json', help='Log to write, gzipped if it ends in .gz')
+  record.add_argument('--checkpoint-ticks', type=int, default=DEFAULT_CHECKPOINT_TICKS)
+
+  play = subparsers.add_parser('replay', help='Replay a recorded run')
+  play.add_argument('log')
+  play.add_argument('--until', type=int, help='Stop at this tick instead of the end of the run')
+  play.add_argument('--trace-from', type=int, help='Print npc movements from this tick on')
+
+  args = parser.parse_args(argv)
+  if args.command == 'record':
+    scenarios = load_scenarios(args.scenario_file)
+    if args.scenario is not None:
+      scenarios = [scenario for scenario in scenarios if scenario.name == args.scenario]
+      if not scenarios:
+        parser.error(f'No scenario named {args.scenario}')
+    log = record_replicate(scenarios[0], args.replicate, args.checkpoint_ticks)
+    write_columns(args.output, log)
+    print(f"{scenarios[0].name} replicate {args.replicate}: {log['kills']} kills, saved to {args.output}")
+  else:
+    replayer = Replayer(read_columns(args.log))
+    until = replayer.log['ticks'] if args.until is None else min(args.until, replayer.log['ticks'])
+    if args.trace_from is not None:
+      replayer.run_to(args.trace_from)
+      # One tick at a time so each movement can be printed with its tick
+      while replayer.tick < until:
+        tick = replayer.tick
+        replayer.run_to(tick + 1, trace=True)
+        for npc in replayer.engine.npc_registry.registered_npcs:
+          for movement in npc.travel_path:
+            print(f'{tick} {npc.name}: {movement.start_coord} -> {movement.end_coord} towards {movement.destination_tile} ({movement.successful})')
+          npc.travel_path.clear()
+    if until == replayer.log['ticks']:
+      replayer.finish()
+    else:
+      replayer.run_to(until)
+    print(f'{count_kills(replayer.engine.npc_registry)} kills after {replayer.tick} ticks')
+
+if __name__ == '__main__':
+  main()
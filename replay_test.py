@@ -0,0 +1,72 @@
+import json
+import random
+from unittest import TestCase, main
+import cannon_sim
+from replay import Recorder, ReplayDivergence, Replayer, record_replicate, replay
+from sweep_test import skeleton_scenario
+
+def npc_state(engine):
+  return [(npc.coordinate, npc.hitpoints, npc.is_dead()) for npc in engine.npc_registry.registered_npcs]
+
+class ReplayTest(TestCase):
+
+  def test_log_should_reproduce_the_replicate(self):
+    scenario = skeleton_scenario()
+    log = record_replicate(scenario, 3, checkpoint_ticks=50)
+
+    self.assertEqual(log['kills'], scenario.run_replicate(3))
+    self.assertEqual(len(log['checkpoints']), scenario.ticks // 50)
+    engine = replay(json.loads(json.dumps(log)))
+    self.assertEqual(cannon_sim.count_kills(engine.npc_registry), log['kills'])
+
+  def test_should_stop_at_any_tick(self):
+    scenario = skeleton_scenario()
+    log = record_replicate(scenario, 1, checkpoint_ticks=50)
+
+    random.seed(scenario.seed_for(1))
+    engine = scenario.build_engine()
+    engine.perform_ticks(123)
+
+    self.assertEqual(npc_state(replay(log, until=123)), npc_state(engine))
+
+  def test_should_only_trace_from_the_given_tick(self):
+    log = record_replicate(skeleton_scenario(), 0)
+    replayer = Replayer(log)
+    replayer.run_to(150)
+    self.assertTrue(all(not npc.travel_path for npc in replayer.engine.npc_registry.registered_npcs))
+
+    replayer.finish(trace=True)
+
+    self.assertFalse(cannon_sim.DEBUG_NPC_PATHING)
+    traced = [len(npc.travel_path) for npc in replayer.engine.npc_registry.registered_npcs]
+    # At most one move a tick, none while dead
+    self.assertTrue(all(moves <= 50 for moves in traced), traced)
+    self.assertGreater(sum(traced), 0)
+
+  def test_should_replay_inputs(self):
+    scenario = skeleton_scenario()
+    recorder = Recorder(scenario, 0, checkpoint_ticks=20)
+    recorder.perform_ticks(60)
+    recorder.place_cannon(0, (4, 4))
+    recorder.perform_ticks(140)
+    log = recorder.log()
+
+    self.assertEqual(log['inputs'], [[60, 'place_cannon', 0, [4, 4]]])
+    engine = replay(log)
+    self.assertEqual(engine.player_registry.registered_players[0].cannon().coordinate, (4, 4))
+    with self.assertRaises(ReplayDivergence):
+      replay({**log, 'inputs': []})
+
+  def test_should_notice_divergence(self):
+    log = record_replicate(skeleton_scenario(), 0, checkpoint_ticks=50)
+    tampered = {**log, 'checkpoints': log['checkpoints'][:2] + ['0' * 16] + log['checkpoints'][3:]}
+
+    replayer = Replayer(tampered)
+    replayer.run_to(100)
+    with self.assertRaises(ReplayDivergence):
+      replayer.run_to(150)
+    with self.assertRaises(ReplayDivergence):
+      Replayer({**log, 'version': cannon_sim.SIMULATOR_VERSION + 1})
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,127 @@
+import hashlib
+import json
+import os
+import tempfile
+import weakref
+from pathlib import Path
+from cannon_sim import NPC_DEFINITIONS_PATH, SIMULATOR_VERSION, load_npc_definitions
+
+# On disk cache of per replicate kill counts. Entries are keyed by a hash of everything that affects a run
+# except the seed, and hold kills by seed, so sweeps that add replicates or move the base seed reuse what
+# has already been computed. Least recently used entries are evicted once the cache is over its size.
+
+DEFAULT_MAX_BYTES = 256 * 1024 * 1024
+
+def _digest(data):
+  return hashlib.sha256(json.dumps(data, sort_keys=True, separators=(',', ':')).encode()).hexdigest()
+
+# Compiled maps are only hashed once per process
+_map_hashes = weakref.WeakKeyDictionary()
+def map_hash(map_registry):
+  if map_registry not in _map_hashes:
+    hasher = hashlib.sha256()
+    hasher.update(json.dumps(map_registry.map_config, sort_keys=True, separators=(',', ':')).encode())
+    multicombat = map_registry.multicombat
+    if multicombat is not None:
+      hasher.update(json.dumps([multicombat.origin, multicombat.width, multicombat.height]).encode())
+      hasher.update(bytes(multicombat.data))
+    _map_hashes[map_registry] = hasher.hexdigest()
+  return _map_hashes[map_registry]
+
+def scenario_key(scenario):
+  # Everything a replicate's outcome depends on besides its seed
+  npc_structs = [s for s in scenario.get_npc_structs() if s.get('p', scenario.plane) == scenario.plane and (scenario.npc_ids is None or s['id'] in scenario.npc_ids)]
+  definitions = load_npc_definitions(scenario.npc_definitions or NPC_DEFINITIONS_PATH)
+  spawned_ids = sorted({s['id'] for s in npc_structs})
+  return _digest({
+    'version': SIMULATOR_VERSION,
+    'map': map_hash(scenario.get_map_registry()),
+    'plane': scenario.plane,
+    'player_tile': list(scenario.player_tile),
+    'cannon_tile': list(scenario.cannon_tile),
+    'ticks': scenario.ticks,
+    'npcs': sorted([s['id'], s['x'], s['y']] for s in npc_structs),
+    'npc_definitions': [definitions.get(npc_id) for npc_id in spawned_ids],
+    'npc_stats': {str(npc_id): overrides for npc_id, overrides in scenario.npc_stats.items()},
+  })
+
+class ResultCache:
+  # Writes between full scans of the directory, which pick up entries other processes have added or removed
+  RESCAN_WRITES = 256
+
+  def __init__(self, directory, max_bytes=DEFAULT_MAX_BYTES):
+    self.directory = Path(directory)
+    self.directory.mkdir(parents=True, exist_ok=True)
+    self.max_bytes = max_bytes
+    # Running size and entry count, None until the directory is first scanned
+    self.total_bytes = None
+    self.entry_count = None
+    self._writes_since_scan = 0
+
+  def _path(self, key):
+    return self.directory / f'{key}.json'
+
+  def _read(self, key):
+    try:
+      with self._path(key).open() as entry_file:
+        return {int(seed): kills for seed, kills in json.load(entry_file).items()}
+    except (FileNotFoundError, ValueError):
+      return {}
+
+  def get(self, key, seeds):
+    # Cached kills for whichever of seeds have been run
+    entry = self._read(key)
+    if not entry:
+      return {}
+    # Reading counts as a use for eviction
+    os.utime(self._path(key))
+    return {seed: entry[seed] for seed in seeds if seed in entry}
+
+  def put(self, key, kills_by_seed):
+    if not kills_by_seed:
+      return
+    entry = self._read(key)
+    entry.update(kills_by_seed)
+    path = self._path(key)
+    try:
+      old_size = path.stat().st_size
+    except FileNotFoundError:
+      old_size = None
+    # Written to a temporary file first so a crash never leaves half an entry behind
+    with tempfile.NamedTemporaryFile('w', dir=self.directory, suffix='.tmp', delete=False) as entry_file:
+      json.dump({str(seed): kills for seed, kills in sorted(entry.items())}, entry_file, separators=(',', ':'))
+    size = os.path.getsize(entry_file.name)
+    os.replace(entry_file.name, path)
+
+    self._writes_since_scan += 1
+    if self.total_bytes is None or self._writes_since_scan >= self.RESCAN_WRITES:
+      self._scan()
+    else:
+      self.total_bytes += size - (old_size or 0)
+      if old_size is None:
+        self.entry_count += 1
+    if self.total_bytes > self.max_bytes:
+      self.evict(keep=key)
+
+  def _scan(self):
+    # Every entry as (mtime, size, path), refreshing the running totals
+    entries = []
+    for path in self.directory.glob('*.json'):
+      stat = path.stat()
+      entries.append((stat.st_mtime, stat.st_size, path))
+    self.total_bytes = sum(size for _, size, _ in entries)
+    self.entry_count = len(entries)
+    self._writes_since_scan = 0
+    return entries
+
+  def evict(self, keep=None):
+    # Drop least recently used entries until the cache fits, never the one just written
+    entries = sorted(self._scan())
+    for _, size, path in entries:
+      if self.total_bytes <= self.max_bytes:
+        break
+      if path.stem == keep:
+        continue
+      path.unlink()
+      self.total_bytes -= size
+      self.entry_count -= 1
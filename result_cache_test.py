@@ -0,0 +1,80 @@
+import os
+import tempfile
+from unittest import TestCase, main
+from unittest.mock import patch
+from result_cache import ResultCache, scenario_key
+from scenario import Scenario
+from sweep import run_sweep
+from sweep_test import skeleton_scenario
+
+class ScenarioKeyTest(TestCase):
+
+  def test_key_should_ignore_name_seed_and_replicates(self):
+    scenario = skeleton_scenario('a', replicates=4)
+    other = skeleton_scenario('b', replicates=10)
+    other.seed = 7
+    self.assertEqual(scenario_key(scenario), scenario_key(other))
+
+  def test_key_should_change_with_anything_affecting_a_run(self):
+    key = scenario_key(skeleton_scenario())
+
+    # Inline maps are compiled once per scenario name
+    changed = [skeleton_scenario(f'changed {i}') for i in range(4)]
+    changed[0].ticks = 300
+    changed[1].npc_stats = {70: {'hitpoints': 40}}
+    changed[2].cannon_tile = (2, 1)
+    changed[3].map_config = {0: {3: {'movement_flags': 15, 'projectile_flags': 15}}}
+    for scenario in changed:
+      self.assertNotEqual(scenario_key(scenario), key)
+    with patch('result_cache.SIMULATOR_VERSION', -1):
+      self.assertNotEqual(scenario_key(skeleton_scenario()), key)
+
+class ResultCacheTest(TestCase):
+
+  def test_sweep_should_only_run_missing_replicates(self):
+    with tempfile.TemporaryDirectory() as directory:
+      cache = ResultCache(directory)
+      uncached, _ = run_sweep([skeleton_scenario(replicates=6)], workers=1)
+      run_sweep([skeleton_scenario(replicates=4)], workers=1, cache=cache)
+
+      with patch.object(Scenario, 'run_replicate', autospec=True, side_effect=Scenario.run_replicate) as run_replicate:
+        cached, _ = run_sweep([skeleton_scenario(replicates=6)], workers=1, batch_size=25, cache=cache)
+
+      self.assertEqual([call.args[1] for call in run_replicate.call_args_list], [4, 5])
+      self.assertEqual(cached, uncached)
+
+  def test_should_evict_least_recently_used_entries(self):
+    with tempfile.TemporaryDirectory() as directory:
+      cache = ResultCache(directory, max_bytes=10**6)
+      for i, key in enumerate(['a', 'b', 'c']):
+        cache.put(key, {seed: seed for seed in range(10)})
+        os.utime(cache._path(key), (1000 + i, 1000 + i))
+      cache.get('a', [0])
+
+      cache.max_bytes = 2 * cache._path('a').stat().st_size
+      cache.put('d', {0: 1})
+
+      self.assertEqual(sorted(path.stem for path in cache.directory.glob('*.json')), ['a', 'd'])
+      self.assertEqual(cache.get('a', [1, 20]), {1: 1})
+
+  def test_puts_should_only_scan_the_directory_when_over_the_cap(self):
+    with tempfile.TemporaryDirectory() as directory:
+      cache = ResultCache(directory, max_bytes=10**6)
+      cache.put('a', {0: 1})
+
+      with patch.object(ResultCache, '_scan', autospec=True, side_effect=ResultCache._scan) as scan:
+        cache.put('b', {seed: seed for seed in range(10)})
+        cache.put('a', {1: 2})
+        self.assertEqual(scan.call_count, 0)
+        self.assertEqual(cache.entry_count, 2)
+        self.assertEqual(cache.total_bytes, sum(path.stat().st_size for path in cache.directory.glob('*.json')))
+
+        cache.max_bytes = cache._path('a').stat().st_size
+        cache.put('a', {2: 3})
+        self.assertEqual(scan.call_count, 1)
+
+      self.assertEqual([path.stem for path in cache.directory.glob('*.json')], ['a'])
+      self.assertEqual(cache.entry_count, 1)
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,188 @@
+import hashlib
+import json
+import random
+from pathlib import Path
+from cannon_sim import DEFAULT_TICKS, MapRegistry, build_engine, count_kills, get_map_registry, load_npc_definitions
+from create_map import create_multicombat_map, create_multicombat_map_for_zones, region_for, relevant_npcs
+
+# A scenario file is JSON with optional defaults applied to every scenario:
+# {
+#   "defaults": {"ticks": 6000, "replicates": 1000, "seed": 0},
+#   "scenarios": [
+#     {
+#       "name": "skeletons",
+#       "player_tile": [3378, 9749],
+#       "cannon_tile": [3379, 9746],
+#       "plane": 0,                             # optional, the plane the player, cannon and npcs are on
+#       "npc_ids": [70, 71, 72, 73],          # optional, all spawns in the region otherwise
+#       "npc_stats": {"70": {"hitpoints": 35}}, # optional overrides on top of NpcRegistry.get_npc_stats
+#       "npc_definitions": "my_npcs.csv",       # optional npc table replacing npc_definitions.csv
+#       "multicombat_zones": [[3370, 9740, 3390, 9760]] # optional [x1, y1, x2, y2] multi-combat rectangles
+#     }
+#   ]
+# }
+# A scenario can also carry its own "npcs" (spawn structs with id/x/y) and "map_config"
+# (same layout as create_map_config) to run without the game data.
+
+DEFAULT_REPLICATES = 1000
+
+class Scenario:
+  def __init__(self, name, player_tile, cannon_tile, npc_ids=None, npc_stats=None, ticks=DEFAULT_TICKS, replicates=DEFAULT_REPLICATES, seed=0, npcs=None, map_config=None, npc_definitions=None, multicombat_zones=None, plane=0):
+    self.name = name
+    self.plane = plane
+    self.player_tile = tuple(player_tile)
+    self.cannon_tile = tuple(cannon_tile)
+    self.npc_ids = set(npc_ids) if npc_ids is not None else None
+    self.npc_stats = npc_stats or {}
+    self.ticks = ticks
+    self.replicates = replicates
+    self.seed = seed
+    self.npcs = npcs
+    self.map_config = map_config
+    self.npc_definitions = npc_definitions
+    # None uses the zones compiled with the region (see create_multicombat_map)
+    self.multicombat_zones = [list(zone) for zone in multicombat_zones] if multicombat_zones is not None else None
+
+  @classmethod
+  def from_dict(cls, data, defaults={}):
+    data = {**defaults, **data}
+    npc_stats = {int(npc_id): overrides for npc_id, overrides in data.get('npc_stats', {}).items()}
+    map_config = data.get('map_config')
+    if map_config is not None:
+      # JSON object keys are always strings
+      map_config = {int(x): {int(y): flags for y, flags in column.items()} for x, column in map_config.items()}
+    return cls(
+      data['name'],
+      data['player_tile'],
+      data['cannon_tile'],
+      npc_ids=data.get('npc_ids'),
+      npc_stats=npc_stats,
+      ticks=data.get('ticks', DEFAULT_TICKS),
+      replicates=data.get('replicates', DEFAULT_REPLICATES),
+      seed=data.get('seed', 0),
+      npcs=data.get('npcs'),
+      map_config=map_config,
+      npc_definitions=data.get('npc_definitions'),
+      multicombat_zones=data.get('multicombat_zones'),
+      plane=data.get('plane', 0),
+    )
+
+  def to_dict(self):
+    data = {
+      'name': self.name,
+      'player_tile': list(self.player_tile),
+      'cannon_tile': list(self.cannon_tile),
+      'npc_ids': sorted(self.npc_ids) if self.npc_ids is not None else None,
+      'npc_stats': {str(npc_id): overrides for npc_id, overrides in sorted(self.npc_stats.items())},
+      'ticks': self.ticks,
+      'replicates': self.replicates,
+      'seed': self.seed,
+      'plane': self.plane,
+    }
+    if self.npcs is not None:
+      data['npcs'] = self.npcs
+    if self.npc_definitions is not None:
+      data['npc_definitions'] = self.npc_definitions
+    if self.multicombat_zones is not None:
+      data['multicombat_zones'] = self.multicombat_zones
+    if self.map_config is not None:
+      data['map_config'] = {str(x): {str(y): flags for y, flags in column.items()} for x, column in self.map_config.items()}
+    return data
+
+  @property
+  def region(self):
+    # Scenarios with their own map share map data with scenarios that have the same map, zones and plane
+    if self.map_config is not None:
+      return ('inline', self._inline_map_digest())
+    return region_for(self.player_tile) + (self.plane,)
+
+  def _inline_map_digest(self):
+    # Hashing a big map for every replicate adds up, so the digest is kept until map_config is replaced.
+    # Changing map_config in place after it's been used isn't picked up.
+    source = (id(self.map_config), str(self.multicombat_zones), self.plane)
+    cached = self.__dict__.get('_inline_map_key')
+    if cached is None or cached[0] != source:
+      content = json.dumps([self.map_config, self.multicombat_zones, self.plane], sort_keys=True, separators=(',', ':'))
+      cached = (source, hashlib.blake2b(content.encode(), digest_size=16).hexdigest())
+      self._inline_map_key = cached
+    return cached[1]
+
+  def seed_for(self, replicate):
+    return self.seed + replicate
+
+  def get_map_registry(self):
+    zones = self.multicombat_zones
+    if self.map_config is not None:
+      if self.region not in _inline_map_registries:
+        multicombat = create_multicombat_map_for_zones(zones, self.plane) if zones else None
+        _inline_map_registries[self.region] = MapRegistry(self.map_config, multicombat, self.plane)
+      return _inline_map_registries[self.region]
+
+    region_map_registry = get_map_registry(self.player_tile, self.plane)
+    if zones is None:
+      return region_map_registry
+    key = (self.region, tuple(tuple(zone) for zone in zones))
+    if key not in _zoned_map_registries:
+      # Same compiled map as the region, only the multi-combat tiles differ
+      map_registry = MapRegistry(region_map_registry.map_config, create_multicombat_map(self.player_tile, zones, self.plane), self.plane)
+      map_registry.clearance_owner = region_map_registry
+      _zoned_map_registries[key] = map_registry
+    return _zoned_map_registries[key]
+
+  def get_npc_structs(self):
+    if self.npcs is not None:
+      return self.npcs
+    # Spawns only depend on where the player is, even for scenarios with their own map
+    region = region_for(self.player_tile) + (self.plane,)
+    if region not in _region_npc_structs:
+      _region_npc_structs[region] = relevant_npcs(self.player_tile, self.plane)
+    return _region_npc_structs[region]
+
+  def build_engine(self, stats=None, **options):
+    # options go to cannon_sim.build_engine, ex. walkability_strategy_class or fast_forward
+    return build_engine(
+      self.player_tile,
+      self.cannon_tile,
+      map_registry=self.get_map_registry(),
+      npc_structs=self.get_npc_structs(),
+      npc_ids=self.npc_ids,
+      npc_stats=self.npc_stats,
+      stats=stats,
+      npc_definitions=load_npc_definitions(self.npc_definitions) if self.npc_definitions else None,
+      plane=self.plane,
+      **options,
+    )
+
+  def run_replicate(self, replicate, stats=None):
+    # Every replicate has its own seed so results don't depend on which process ran it
+    random.seed(self.seed_for(replicate))
+    engine = self.build_engine(stats)
+    engine.perform_ticks(self.ticks)
+    return count_kills(engine.npc_registry)
+
+  def run_long(self, run, ticks, chunk_ticks, stats=None):
+    # One long run from a cold start, returning the kills in each chunk_ticks chunk of it (see steady_state.py).
+    # Every chunk is scaled as chunk_ticks long, so ticks has to be a whole number of chunks.
+    if ticks % chunk_ticks != 0:
+      raise ValueError(f'{ticks} ticks is not a whole number of {chunk_ticks} tick chunks')
+    random.seed(self.seed_for(run))
+    engine = self.build_engine(stats)
+    chunk_kills = []
+    kills = 0
+    for start in range(0, ticks, chunk_ticks):
+      engine.perform_ticks(chunk_ticks)
+      total = count_kills(engine.npc_registry)
+      chunk_kills.append(total - kills)
+      kills = total
+    return chunk_kills
+
+# Per process caches, filled on first use
+_inline_map_registries = {}
+_zoned_map_registries = {}
+_region_npc_structs = {}
+
+def load_scenarios(path):
+  with Path(path).open() as scenario_file:
+    data = json.load(scenario_file)
+  defaults = data.get('defaults', {})
+  return [Scenario.from_dict(scenario, defaults) for scenario in data['scenarios']]
@@ -0,0 +1,190 @@
+import argparse
+import copy
+import itertools
+import json
+import math
+import multiprocessing
+import random
+from statistics import fmean, variance
+from cannon_sim import count_kills
+from scenario import load_scenarios
+from steady_state import DEFAULT_CONFIDENCE, t_critical
+from sweep import TICKS_PER_HOUR, preload_regions, write_columns
+
+# What-if sweeps over npc stats, hit ranges and attack speed at one spot:
+#   python sensitivity.py scenarios.json grid.json --scenario skeletons --replicates 50 -o sensitivity.json.gz
+# The grid is JSON listing the values to try for each parameter, every combination is a point:
+# {
+#   "npc_stats": {"hitpoints": [29, 35], "respawn_time": [50, 70]}, # applied to every simulated npc
+#   "cannon_hit": [[0, 30], [0, 35]],                             # [min, max] cannon damage
+#   "player_hit": [[5, 30]],                                      # [min, max] player damage
+#   "attack_speed": [4, 5, 6]                                     # player attack speed in ticks
+# }
+# The first point (the first value of everything) is the baseline the others are compared with.
+# Points use common random numbers: in replicate r every point gives each npc, player and cannon its own random
+# stream seeded from the scenario seed for r, so wandering and damage rolls line up between points and the paired
+# differences have much less noise than independent runs would. Every point runs on the scenario's compiled map.
+
+GRID_PARAMETERS = ('cannon_hit', 'player_hit', 'attack_speed')
+
+def grid_points(grid):
+  # Every combination of the grid's values as {parameter: value}, npc stats by their stat name
+  names = []
+  values = []
+  for stat, stat_values in grid.get('npc_stats', {}).items():
+    names.append(stat)
+    values.append(stat_values)
+  for parameter in GRID_PARAMETERS:
+    if parameter in grid:
+      names.append(parameter)
+      values.append([tuple(value) if isinstance(value, list) else value for value in grid[parameter]])
+  unknown = set(grid) - set(GRID_PARAMETERS) - {'npc_stats'}
+  if unknown:
+    raise ValueError(f'Unknown grid parameters {sorted(unknown)}')
+  return [dict(zip(names, combination)) for combination in itertools.product(*values)]
+
+def point_label(point):
+  return ' '.join(f'{name}={value[0]}-{value[1]}' if isinstance(value, tuple) else f'{name}={value}' for name, value in point.items()) or 'baseline'
+
+def _simulated_npc_ids(scenario):
+  return {s['id'] for s in scenario.get_npc_structs() if s.get('p', scenario.plane) == scenario.plane and (scenario.npc_ids is None or s['id'] in scenario.npc_ids)}
+
+def point_scenario(scenario, point):
+  # The scenario with the point's npc stats layered over its own overrides. It keeps its name and region so it
+  # shares the map and spawns compiled for the scenario.
+  stats = {name: value for name, value in point.items() if name not in GRID_PARAMETERS}
+  if not stats:
+    return scenario
+  point_scenario = copy.copy(scenario)
+  point_scenario.npc_stats = {npc_id: {**scenario.npc_stats.get(npc_id, {}), **stats} for npc_id in _simulated_npc_ids(scenario)}
+  return point_scenario
+
+def use_common_random_numbers(engine, seed):
+  # A stream per entity, so what one entity draws doesn't shift what the others get when a parameter changes
+  for npc in engine.npc_registry.registered_npcs:
+    npc.rng = random.Random(f'{seed}:npc:{npc.slot_index}')
+  for index, player in enumerate(engine.player_registry.registered_players):
+    player.rng = random.Random(f'{seed}:player:{index}')
+    cannon = player.cannon()
+    if cannon is not None:
+      cannon.rng = random.Random(f'{seed}:cannon:{index}')
+
+def build_point_engine(scenario, point, replicate):
+  seed = scenario.seed_for(replicate)
+  random.seed(seed)
+  engine = point_scenario(scenario, point).build_engine()
+  for player in engine.player_registry.registered_players:
+    if 'attack_speed' in point:
+      player.attack_speed = point['attack_speed']
+    if 'player_hit' in point:
+      player.min_hit, player.max_hit = point['player_hit']
+    cannon = player.cannon()
+    if cannon is not None and 'cannon_hit' in point:
+      cannon.min_hit, cannon.max_hit = point['cannon_hit']
+  use_common_random_numbers(engine, seed)
+  return engine
+
+def run_point(scenario, point, replicate):
+  engine = build_point_engine(scenario, point, replicate)
+  engine.perform_ticks(scenario.ticks)
+  return count_kills(engine.npc_registry)
+
+def _run_unit(unit):
+  index, scenario, point, replicates = unit
+  return index, [run_point(scenario, point, replicate) for replicate in range(replicates)]
+
+def run_sensitivity(scenario, grid, replicates, workers=1):
+  # Columns with a row per point and replicate
+  points = grid_points(grid)
+  units = [(index, scenario, point, replicates) for index, point in enumerate(points)]
+  if workers == 1:
+    results = map(_run_unit, units)
+    pool = None
+  else:
+    preload_regions([scenario])
+    pool = multiprocessing.Pool(workers)
+    results = pool.imap_unordered(_run_unit, units)
+  kills_by_point = [None] * len(points)
+  try:
+    for index, kills in results:
+      kills_by_point[index] = kills
+  finally:
+    if pool is not None:
+      pool.close()
+      pool.join()
+
+  columns = {'point': [], 'label': [], 'replicate': [], 'seed': [], 'ticks': [], 'kills': []}
+  for index, (point, kills) in enumerate(zip(points, kills_by_point)):
+    for replicate, kill_count in enumerate(kills):
+      columns['point'].append(index)
+      columns['label'].append(point_label(point))
+      columns['replicate'].append(replicate)
+      columns['seed'].append(scenario.seed_for(replicate))
+      columns['ticks'].append(scenario.ticks)
+      columns['kills'].append(kill_count)
+  return columns
+
+def summarize_sensitivity(columns, confidence=DEFAULT_CONFIDENCE):
+  # Kills per hour at each point and its difference from the baseline, with the half width of the paired
+  # confidence interval and the half width independent runs with as many replicates would have had
+  kills_by_point = {}
+  labels = {}
+  ticks = {}
+  for point, label, replicate, point_ticks, kills in zip(columns['point'], columns['label'], columns['replicate'], columns['ticks'], columns['kills']):
+    kills_by_point.setdefault(point, {})[replicate] = kills
+    labels[point] = label
+    ticks[point] = point_ticks
+  baseline = kills_by_point[0]
+  rows = []
+  for point in sorted(kills_by_point):
+    kills = kills_by_point[point]
+    replicates = sorted(kills.keys() & baseline.keys())
+    per_hour = TICKS_PER_HOUR / ticks[point]
+    differences = [(kills[replicate] - baseline[replicate]) * per_hour for replicate in replicates]
+    if len(replicates) > 1:
+      t = t_critical(len(replicates) - 1, confidence)
+      half_width = t * math.sqrt(variance(differences) / len(replicates))
+      unpaired = [kills[replicate] * per_hour for replicate in replicates], [baseline[replicate] * per_hour for replicate in replicates]
+      unpaired_half_width = t * math.sqrt((variance(unpaired[0]) + variance(unpaired[1])) / len(replicates))
+    else:
+      half_width = unpaired_half_width = None
+    rows.append({
+      'point': point,
+      'label': labels[point],
+      'replicates': len(kills),
+      'kills_per_hour': fmean(kills.values()) * per_hour,
+      'difference': fmean(differences) if differences else None,
+      'half_width': half_width,
+      'unpaired_half_width': unpaired_half_width,
+    })
+  return rows
+
+def main(argv=None):
+  parser = argparse.ArgumentParser(description='Sweep npc stats, hit ranges and attack speed at a spot with common random numbers')
+  parser.add_argument('scenario_file')
+  parser.add_argument('grid_file')
+  parser.add_argument('--scenario', help='Name of the scenario to vary, the first one by default')
+  parser.add_argument('--replicates', type=int, default=50, help='Replicates per point')
+  parser.add_argument('-w', '--workers', type=int, default=None, help='Worker processes (defaults to the cpu count)')
+  parser.add_argument('-o', '--output', help='Columnar JSON output, gzipped if it ends in .gz')
+  args = parser.parse_args(argv)
+
+  scenarios = load_scenarios(args.scenario_file)
+  if args.scenario is not None:
+    scenarios = [scenario for scenario in scenarios if scenario.name == args.scenario]
+    if not scenarios:
+      parser.error(f'No scenario named {args.scenario}')
+  with open(args.grid_file) as grid_file:
+    grid = json.load(grid_file)
+
+  columns = run_sensitivity(scenarios[0], grid, args.replicates, args.workers)
+  if args.output:
+    write_columns(args.output, columns)
+  for row in summarize_sensitivity(columns):
+    if row['point'] == 0 or row['half_width'] is None:
+      print(f"{row['label']}: {row['kills_per_hour']:.1f} kills/hr")
+    else:
+      print(f"{row['label']}: {row['kills_per_hour']:.1f} kills/hr, {row['difference']:+.1f} ± {row['half_width']:.1f} (± {row['unpaired_half_width']:.1f} unpaired)")
+
+if __name__ == '__main__':
+  main()
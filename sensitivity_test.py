@@ -0,0 +1,54 @@
+from unittest import TestCase, main
+from sensitivity import build_point_engine, grid_points, point_scenario, run_point, run_sensitivity, summarize_sensitivity
+from sweep_test import skeleton_scenario
+
+class GridTest(TestCase):
+
+  def test_should_list_every_combination_starting_with_the_baseline(self):
+    points = grid_points({'npc_stats': {'hitpoints': [29, 35]}, 'cannon_hit': [[0, 30], [0, 35]], 'attack_speed': [5]})
+
+    self.assertEqual(len(points), 4)
+    self.assertEqual(points[0], {'hitpoints': 29, 'cannon_hit': (0, 30), 'attack_speed': 5})
+    self.assertEqual(points[-1], {'hitpoints': 35, 'cannon_hit': (0, 35), 'attack_speed': 5})
+    self.assertEqual(grid_points({}), [{}])
+    with self.assertRaises(ValueError):
+      grid_points({'cannon_speed': [1]})
+
+  def test_points_should_apply_their_parameters(self):
+    scenario = skeleton_scenario()
+    engine = build_point_engine(scenario, {'hitpoints': 40, 'respawn_time': 10, 'cannon_hit': (3, 4), 'player_hit': (1, 2), 'attack_speed': 7}, 0)
+
+    self.assertTrue(all(npc.max_hitpoints == 40 and npc.respawn_time == 10 for npc in engine.npc_registry.registered_npcs))
+    player = engine.player_registry.registered_players[0]
+    self.assertEqual((player.min_hit, player.max_hit, player.attack_speed), (1, 2, 7))
+    self.assertEqual((player.cannon().min_hit, player.cannon().max_hit), (3, 4))
+    # Stats are layered on the scenario without touching it, on the same compiled map
+    self.assertEqual(scenario.npc_stats, {})
+    self.assertIs(point_scenario(scenario, {'hitpoints': 40}).get_map_registry(), scenario.get_map_registry())
+
+  def test_nothing_should_die_without_damage(self):
+    self.assertEqual(run_point(skeleton_scenario(), {'cannon_hit': (0, 0), 'player_hit': (0, 0)}, 0), 0)
+
+class CommonRandomNumbersTest(TestCase):
+
+  def test_should_repeat_draws_between_points(self):
+    scenario = skeleton_scenario()
+    self.assertEqual(run_point(scenario, {'attack_speed': 5}, 3), run_point(scenario, {}, 3))
+
+    engines = [build_point_engine(scenario, {'hitpoints': hitpoints}, 1) for hitpoints in (29, 60)]
+    draws = [[npc.rng.random() for npc in engine.npc_registry.registered_npcs] for engine in engines]
+    self.assertEqual(draws[0], draws[1])
+    self.assertEqual(len(set(draws[0])), len(draws[0]))
+
+  def test_paired_differences_should_be_tighter_than_independent_runs(self):
+    scenario = skeleton_scenario()
+    columns = run_sensitivity(scenario, {'cannon_hit': [[0, 30], [0, 31]]}, replicates=8)
+
+    self.assertEqual(columns['point'], [0] * 8 + [1] * 8)
+    baseline, nudged = summarize_sensitivity(columns)
+    self.assertEqual(baseline['difference'], 0)
+    self.assertEqual(nudged['label'], 'cannon_hit=0-31')
+    self.assertLess(nudged['half_width'], nudged['unpaired_half_width'])
+
+if __name__ == '__main__':
+  main()
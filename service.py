@@ -0,0 +1,214 @@
+import argparse
+import asyncio
+import hashlib
+import json
+from concurrent.futures import ProcessPoolExecutor
+from result_cache import DEFAULT_MAX_BYTES, ResultCache
+from scenario import Scenario, load_scenarios
+from sweep import DEFAULT_BATCH_SIZE, TICKS_PER_HOUR, lookup_cached, preload_regions, run_work_unit, store_cached, work_units
+
+# Long running simulation service, so tools don't pay for process startup and map compilation per query:
+#   python service.py --socket /tmp/cannon_sim.sock --workers 8
+# Clients send one JSON request per line, {"id": ..., "scenario": {...}} with a scenario in the scenario file
+# format (see scenario.py), and get JSON lines back tagged with the same id:
+#   {"id": ..., "type": "progress", "done": 250, "replicates": 1000, "mean_kills": 41.2}
+#   {"id": ..., "type": "result", "replicates": 1000, "mean_kills": 41.5, "kills_per_hour": 41.5, "kills": [...]}
+#   {"id": ..., "type": "error", "message": "..."}
+# Worker processes live as long as the service, so each one keeps the regions it has compiled.
+# Identical requests that arrive while one is running share its run rather than starting another.
+
+DEFAULT_SOCKET_PATH = './cannon_sim.sock'
+
+def request_key(scenario):
+  # The name is only a label, anything else changes the answer
+  data = scenario.to_dict()
+  data.pop('name')
+  return hashlib.sha256(json.dumps(data, sort_keys=True).encode()).hexdigest()
+
+def _summary(kills):
+  done = [kill_count for kill_count in kills if kill_count is not None]
+  return {'done': len(done), 'replicates': len(kills), 'mean_kills': sum(done) / len(done) if done else None}
+
+class _Job:
+  # A running scenario and the queues of everyone waiting on it
+  def __init__(self):
+    self.subscribers = []
+    self.latest = None
+
+  def subscribe(self):
+    queue = asyncio.Queue()
+    # Late subscribers start from the most recent progress
+    if self.latest is not None:
+      queue.put_nowait(self.latest)
+    self.subscribers.append(queue)
+    return queue
+
+  def unsubscribe(self, queue):
+    if queue in self.subscribers:
+      self.subscribers.remove(queue)
+
+  def publish(self, update):
+    self.latest = update
+    for queue in self.subscribers:
+      queue.put_nowait(update)
+
+  def finish(self, update):
+    self.publish(update)
+    for queue in self.subscribers:
+      queue.put_nowait(None)
+
+class SimulationService:
+  def __init__(self, workers=None, batch_size=DEFAULT_BATCH_SIZE, cache=None):
+    self.executor = ProcessPoolExecutor(workers)
+    self.batch_size = batch_size
+    self.cache = cache
+    self._jobs = {}
+    self.jobs_started = 0
+
+  def preload(self, scenarios):
+    # Compile regions before the workers are forked so they all start warm
+    preload_regions(scenarios)
+
+  async def simulate(self, scenario):
+    # Yields progress updates then the result (or an error) for scenario
+    key = request_key(scenario)
+    job = self._jobs.get(key)
+    if job is None:
+      job = _Job()
+      self._jobs[key] = job
+      self.jobs_started += 1
+      asyncio.get_running_loop().create_task(self._run(key, job, scenario))
+    queue = job.subscribe()
+    try:
+      while True:
+        update = await queue.get()
+        if update is None:
+          return
+        yield update
+    finally:
+      # A client that went away stops getting updates, the run itself carries on for anyone else waiting
+      job.unsubscribe(queue)
+
+  async def _run(self, key, job, scenario):
+    loop = asyncio.get_running_loop()
+    try:
+      # Looking the scenario up can mean compiling its region for the cache key, so it runs in a worker process
+      # rather than holding up every other request. No threads: worker processes are forked from this one and
+      # shouldn't inherit other threads' locks. The small cache writes stay on the loop.
+      (kills,), pending, keys = await loop.run_in_executor(self.executor, lookup_cached, [scenario], self.cache)
+      futures = [loop.run_in_executor(self.executor, run_work_unit, unit) for unit in work_units([scenario], self.batch_size, pending)]
+      for future in asyncio.as_completed(futures):
+        _, start, unit_kills, _ = await future
+        kills[start:start + len(unit_kills)] = unit_kills
+        if self.cache is not None:
+          store_cached(self.cache, keys[0], scenario, start, unit_kills)
+        job.publish({'type': 'progress', **_summary(kills)})
+      summary = _summary(kills)
+      job.finish({
+        'type': 'result',
+        'replicates': summary['replicates'],
+        'mean_kills': summary['mean_kills'],
+        'kills_per_hour': summary['mean_kills'] * TICKS_PER_HOUR / scenario.ticks if summary['mean_kills'] is not None else None,
+        'kills': kills,
+      })
+    except Exception as e:
+      job.finish({'type': 'error', 'message': f'{type(e).__name__}: {e}'})
+    finally:
+      del self._jobs[key]
+
+  async def handle_connection(self, reader, writer):
+    # Requests on one connection run concurrently, responses are interleaved and tagged with the request id
+    write_lock = asyncio.Lock()
+    async def send(message):
+      async with write_lock:
+        writer.write(json.dumps(message, separators=(',', ':')).encode() + b'\n')
+        await writer.drain()
+
+    async def answer(request_id, data):
+      try:
+        scenario = Scenario.from_dict(data.get('scenario', {}), data.get('defaults', {}))
+      except (KeyError, TypeError, ValueError) as e:
+        await send({'id': request_id, 'type': 'error', 'message': f'Invalid scenario: {e}'})
+        return
+      async for update in self.simulate(scenario):
+        await send({'id': request_id, **update})
+
+    tasks = set()
+    try:
+      while line := await reader.readline():
+        try:
+          data = json.loads(line)
+        except ValueError:
+          data = None
+        if not isinstance(data, dict):
+          await send({'id': None, 'type': 'error', 'message': 'Requests must be one JSON object per line'})
+          continue
+        task = asyncio.create_task(answer(data.get('id'), data))
+        tasks.add(task)
+        task.add_done_callback(tasks.discard)
+      if tasks:
+        await asyncio.gather(*tasks)
+    except ConnectionError:
+      pass
+    finally:
+      for task in tasks:
+        task.cancel()
+      writer.close()
+
+  def close(self):
+    self.executor.shutdown(cancel_futures=True)
+
+async def start_server(service, socket_path=None, host=None, port=None):
+  if port is not None:
+    return await asyncio.start_server(service.handle_connection, host, port)
+  return await asyncio.start_unix_server(service.handle_connection, socket_path or DEFAULT_SOCKET_PATH)
+
+async def request(scenario_data, request_id=0, socket_path=None, host=None, port=None):
+  # Client side: yields every response to one request, ending with its result or error
+  if port is not None:
+    reader, writer = await asyncio.open_connection(host, port)
+  else:
+    reader, writer = await asyncio.open_unix_connection(socket_path or DEFAULT_SOCKET_PATH)
+  try:
+    writer.write(json.dumps({'id': request_id, 'scenario': scenario_data}).encode() + b'\n')
+    await writer.drain()
+    while line := await reader.readline():
+      response = json.loads(line)
+      yield response
+      if response['type'] in ('result', 'error'):
+        return
+  finally:
+    writer.close()
+
+def main(argv=None):
+  parser = argparse.ArgumentParser(description='Serve simulation requests over a unix socket or TCP')
+  parser.add_argument('--socket', default=DEFAULT_SOCKET_PATH, help='Unix socket to listen on')
+  parser.add_argument('--host', default='127.0.0.1')
+  parser.add_argument('--port', type=int, default=None, help='Listen on TCP instead of the unix socket')
+  parser.add_argument('-w', '--workers', type=int, default=None, help='Worker processes (defaults to the cpu count)')
+  parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE, help='Replicates per work unit')
+  parser.add_argument('--cache', help='Directory of cached replicate results to reuse and add to')
+  parser.add_argument('--cache-size', type=int, default=DEFAULT_MAX_BYTES // (1024 * 1024), help='Size the cache is trimmed to, in MiB')
+  parser.add_argument('--preload', help='Scenario file whose regions are compiled before serving')
+  args = parser.parse_args(argv)
+
+  cache = ResultCache(args.cache, args.cache_size * 1024 * 1024) if args.cache else None
+  service = SimulationService(args.workers, args.batch_size, cache)
+  if args.preload:
+    service.preload(load_scenarios(args.preload))
+
+  async def serve():
+    server = await start_server(service, args.socket, args.host, args.port)
+    print(f"Listening on {args.host}:{args.port}" if args.port is not None else f'Listening on {args.socket}', flush=True)
+    async with server:
+      await server.serve_forever()
+
+  try:
+    asyncio.run(serve())
+  except KeyboardInterrupt:
+    pass
+  finally:
+    service.close()
+
+if __name__ == '__main__':
+  main()
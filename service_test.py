@@ -0,0 +1,90 @@
+import asyncio
+import json
+import tempfile
+from pathlib import Path
+from unittest import IsolatedAsyncioTestCase, main
+from result_cache import ResultCache
+from service import SimulationService, request, start_server
+from sweep import run_sweep
+from sweep_test import skeleton_scenario
+
+class SimulationServiceTest(IsolatedAsyncioTestCase):
+
+  async def asyncSetUp(self):
+    self.directory = tempfile.TemporaryDirectory()
+    self.socket_path = str(Path(self.directory.name) / 'sim.sock')
+    self.service = SimulationService(workers=2, batch_size=2)
+    self.server = await start_server(self.service, self.socket_path)
+
+  async def asyncTearDown(self):
+    self.server.close()
+    await self.server.wait_closed()
+    self.service.close()
+    self.directory.cleanup()
+
+  async def collect(self, scenario_data, request_id=0):
+    return [response async for response in request(scenario_data, request_id, self.socket_path)]
+
+  async def test_should_stream_progress_then_the_result(self):
+    scenario = skeleton_scenario(replicates=6)
+    expected, _ = run_sweep([scenario], workers=1)
+
+    responses = await self.collect(scenario.to_dict(), 'a')
+
+    self.assertTrue(all(response['id'] == 'a' for response in responses))
+    self.assertEqual([response['type'] for response in responses], ['progress'] * 3 + ['result'])
+    self.assertEqual([response['done'] for response in responses[:-1]], [2, 4, 6])
+    self.assertEqual(responses[-1]['kills'], expected['kills'])
+
+  async def test_identical_requests_should_share_a_run(self):
+    data = skeleton_scenario(replicates=6).to_dict()
+    renamed = {**data, 'name': 'same spot'}
+
+    first, second = await asyncio.gather(self.collect(data, 1), self.collect(renamed, 2))
+
+    self.assertEqual(self.service.jobs_started, 1)
+    self.assertEqual(first[-1]['kills'], second[-1]['kills'])
+    self.assertEqual(second[-1]['id'], 2)
+
+  async def test_cached_replicates_should_not_be_run_again(self):
+    self.service.cache = ResultCache(Path(self.directory.name) / 'cache')
+    data = skeleton_scenario(replicates=6).to_dict()
+
+    first = await self.collect(data)
+    second = await self.collect(data)
+
+    self.assertEqual([response['type'] for response in second], ['result'])
+    self.assertEqual(second[-1]['kills'], first[-1]['kills'])
+
+  async def test_invalid_scenarios_should_get_an_error(self):
+    responses = await self.collect({'name': 'no tiles'})
+    self.assertEqual(responses[-1]['type'], 'error')
+
+  async def test_requests_that_are_not_objects_should_get_an_error(self):
+    reader, writer = await asyncio.open_unix_connection(self.socket_path)
+    try:
+      for line in (b'[1]\n', b'not json\n'):
+        writer.write(line)
+        await writer.drain()
+        self.assertEqual(json.loads(await reader.readline()), {'id': None, 'type': 'error', 'message': 'Requests must be one JSON object per line'})
+    finally:
+      writer.close()
+
+  async def test_clients_that_stop_listening_should_be_unsubscribed(self):
+    scenario = skeleton_scenario(replicates=6)
+    leaving = self.service.simulate(scenario)
+    staying = self.service.simulate(scenario)
+    await anext(leaving)
+    first = await anext(staying)
+    job, = self.service._jobs.values()
+    self.assertEqual(len(job.subscribers), 2)
+
+    await leaving.aclose()
+    self.assertEqual(len(job.subscribers), 1)
+    updates = [first] + [update async for update in staying]
+
+    self.assertEqual(updates[-1]['type'], 'result')
+    self.assertEqual(job.subscribers, [])
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,108 @@
+import math
+from statistics import NormalDist, fmean
+
+# Steady state estimates from a few long runs instead of many short cold start replicates.
+# Each long run is recorded as kills per chunk of ticks. The start of the run (while npcs are still
+# at their spawns and the cannon hasn't settled) is cut off with MSER, then what's left is split into
+# batches whose means are treated as independent samples for a t confidence interval.
+
+DEFAULT_RUN_TICKS = 600000
+DEFAULT_CHUNK_TICKS = 100
+DEFAULT_BATCHES = 20
+DEFAULT_CONFIDENCE = 0.95
+
+def t_critical(degrees_of_freedom, confidence=DEFAULT_CONFIDENCE):
+  # Two sided Student t quantile. One and two degrees of freedom have closed forms, past that it's the
+  # normal quantile with a Cornish-Fisher expansion, within 0.005 of the exact value from 3 degrees of freedom up.
+  n = degrees_of_freedom
+  p = 0.5 + confidence / 2
+  if n == 1:
+    return math.tan(math.pi * (p - 0.5))
+  if n == 2:
+    return (2*p - 1) / math.sqrt(2 * p * (1 - p))
+  z = NormalDist().inv_cdf(p)
+  return (
+    z
+    + (z**3 + z) / (4 * n)
+    + (5*z**5 + 16*z**3 + 3*z) / (96 * n**2)
+    + (3*z**7 + 19*z**5 + 17*z**3 - 15*z) / (384 * n**3)
+    + (79*z**9 + 776*z**7 + 1482*z**5 - 1920*z**3 - 945*z) / (92160 * n**4)
+  )
+
+def mser_truncation(series):
+  # Number of leading points to drop: the d (at most half the series) minimising the squared standard
+  # error of the mean of what's left, sum((y - mean)^2) / (n - d)^2
+  n = len(series)
+  if n < 2:
+    return 0
+  best = None
+  best_d = 0
+  total = 0.0
+  total_squares = 0.0
+  # Walk d down from n // 2 with suffix sums so every candidate is O(1)
+  for d in range(n - 1, -1, -1):
+    total += series[d]
+    total_squares += series[d] * series[d]
+    if d > n // 2:
+      continue
+    count = n - d
+    squared_error = (total_squares - total * total / count) / (count * count)
+    if best is None or squared_error <= best:
+      best = squared_error
+      best_d = d
+  return best_d
+
+def batch_means(series, batches=DEFAULT_BATCHES):
+  # Means of batches consecutive equal sized groups, any remainder is dropped from the start
+  batches = min(batches, len(series))
+  if batches == 0:
+    return []
+  size = len(series) // batches
+  start = len(series) - size * batches
+  return [fmean(series[start + i*size:start + (i + 1)*size]) for i in range(batches)]
+
+def lag1_autocorrelation(values):
+  if len(values) < 3:
+    return None
+  mean = fmean(values)
+  variance = sum((v - mean) ** 2 for v in values)
+  if variance == 0:
+    return 0.0
+  return sum((a - mean) * (b - mean) for a, b in zip(values, values[1:])) / variance
+
+def estimate(runs, chunk_ticks, batches=DEFAULT_BATCHES, confidence=DEFAULT_CONFIDENCE, ticks_per_hour=6000):
+  # runs is the per chunk kills of each long run. Batches from every run are pooled, each run is
+  # truncated separately since each one starts cold.
+  # Returns kills per hour with its confidence interval, plus the numbers needed to judge it.
+  means = []
+  burn_in_chunks = []
+  autocorrelations = []
+  for chunk_kills in runs:
+    truncation = mser_truncation(chunk_kills)
+    burn_in_chunks.append(truncation)
+    run_means = batch_means(chunk_kills[truncation:], batches)
+    means.extend(run_means)
+    # Per run, the last batch of one run and the first of the next aren't neighbours
+    autocorrelation = lag1_autocorrelation(run_means)
+    if autocorrelation is not None:
+      autocorrelations.append(autocorrelation)
+
+  scale = ticks_per_hour / chunk_ticks
+  result = {
+    'runs': len(runs),
+    'batches': len(means),
+    'burn_in_ticks': [chunks * chunk_ticks for chunks in burn_in_chunks],
+    'kills_per_hour': fmean(means) * scale if means else None,
+    'ci_low': None,
+    'ci_high': None,
+    'half_width': None,
+    'lag1_autocorrelation': fmean(autocorrelations) if autocorrelations else None,
+  }
+  if len(means) >= 2:
+    mean = fmean(means)
+    standard_error = math.sqrt(sum((m - mean) ** 2 for m in means) / (len(means) - 1) / len(means))
+    half_width = t_critical(len(means) - 1, confidence) * standard_error * scale
+    result['half_width'] = half_width
+    result['ci_low'] = result['kills_per_hour'] - half_width
+    result['ci_high'] = result['kills_per_hour'] + half_width
+  return result
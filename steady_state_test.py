@@ -0,0 +1,66 @@
+import random
+from unittest import TestCase, main
+from steady_state import batch_means, estimate, mser_truncation, t_critical
+from sweep import run_steady_state, summarize_steady_state
+from sweep_test import skeleton_scenario
+
+class SteadyStateTest(TestCase):
+
+  def test_t_critical_should_match_tables(self):
+    for degrees_of_freedom, expected in [(1, 12.706), (2, 4.303), (4, 2.776), (10, 2.228), (19, 2.093), (60, 2.000)]:
+      self.assertAlmostEqual(t_critical(degrees_of_freedom), expected, places=2)
+    self.assertAlmostEqual(t_critical(10, 0.9), 1.812, places=2)
+
+  def test_mser_should_cut_off_the_transient(self):
+    rng = random.Random(0)
+    series = [30 - i for i in range(20)] + [rng.gauss(10, 2) for _ in range(200)]
+    truncation = mser_truncation(series)
+
+    self.assertGreaterEqual(truncation, 15)
+    self.assertLessEqual(truncation, 40)
+    self.assertEqual(mser_truncation([rng.gauss(10, 2) for _ in range(4)] + [10] * 4), 4)
+
+  def test_batch_means_should_drop_the_remainder_from_the_start(self):
+    self.assertEqual(batch_means([100, 1, 3, 5, 7], 2), [2, 6])
+    self.assertEqual(batch_means([1, 2], 5), [1, 2])
+
+  def test_interval_should_cover_the_true_rate(self):
+    rng = random.Random(1)
+    runs = [[rng.gauss(5, 2) for _ in range(400)] for _ in range(3)]
+    result = estimate(runs, chunk_ticks=100, batches=10)
+
+    self.assertEqual(result['batches'], 30)
+    self.assertLess(result['ci_low'], 300)
+    self.assertGreater(result['ci_high'], 300)
+    self.assertLess(result['half_width'], 30)
+
+  def test_autocorrelation_should_not_pair_batches_across_runs(self):
+    rng = random.Random(2)
+    # Independent noise within each run, but the runs settle at different levels
+    runs = [[rng.gauss(level, 1) for _ in range(400)] for level in (5, 15)]
+    result = estimate(runs, chunk_ticks=100, batches=20)
+
+    # Pooled, the jump between the runs would read as strong positive correlation
+    self.assertLess(abs(result['lag1_autocorrelation']), 0.3)
+    self.assertIsNone(estimate([[1, 2, 3, 4]], chunk_ticks=100, batches=2)['lag1_autocorrelation'])
+
+  def test_steady_state_sweep_should_not_depend_on_worker_count(self):
+    scenarios = [skeleton_scenario('a')]
+
+    serial, _ = run_steady_state(scenarios, workers=1, runs=2, ticks=1000, chunk_ticks=50)
+    parallel, _ = run_steady_state(scenarios, workers=2, runs=2, ticks=1000, chunk_ticks=50)
+
+    self.assertEqual(serial, parallel)
+    self.assertEqual(len(serial['kills']), 40)
+    row, = summarize_steady_state(scenarios, serial, batches=5)
+    self.assertEqual(row['runs'], 2)
+    self.assertLessEqual(row['ci_low'], row['kills_per_hour'])
+
+  def test_should_refuse_runs_that_end_in_a_partial_chunk(self):
+    with self.assertRaises(ValueError):
+      run_steady_state([skeleton_scenario('a')], workers=1, runs=1, ticks=1020, chunk_ticks=50)
+    with self.assertRaises(ValueError):
+      skeleton_scenario('a').run_long(0, 1020, 50)
+
+if __name__ == '__main__':
+  main()
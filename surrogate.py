@@ -0,0 +1,203 @@
+import argparse
+from statistics import fmean
+from time import perf_counter
+from cannon_sim import DEFAULT_TICKS, STEP_DIRECTIONS, CannonHuntStrategy
+from create_map import Mask
+from scenario import load_scenarios
+from sweep import TICKS_PER_HOUR
+
+# Quick kill rate estimates for throwing out bad spots before simulating them:
+#   python surrogate.py scenarios.json
+#   python surrogate.py scenarios.json --calibrate --replicates 50
+# Every npc is treated as a renewal process: wander until the cannon first hits it, get killed, respawn.
+#  * While wandering an npc is spread evenly over the open tiles of its wander box. A tile the cannon can hit from
+#    k of its 8 directions gets hit on k of every 8 ticks, so the first hit comes after 8 / sum(k) / tiles ticks.
+#  * After the first hit, npcs that can reach the player walk over and fight it, taking hits from the player and
+#    from the cannon wherever it covers the tiles next to the player. Npcs that can't reach it run off and are only
+#    hit by the cannon at the wandering rate.
+#  * Then it waits out its respawn time.
+# In singles the cannon only hits the npc the player is fighting, so the other npcs' clocks stop while it's busy.
+# That's solved as a fixed point of the busy fraction. Competition between npcs for the cannon is ignored.
+# The estimate only needs the engine as built (nothing is simulated), so it takes milliseconds.
+# calibrate compares it with simulated runs.
+
+DIRECTIONS = len(STEP_DIRECTIONS)
+
+def expected_hits_to_kill(hitpoints, min_hit=0, max_hit=30):
+  # Expected number of uniform min_hit..max_hit hits for the damage to reach hitpoints
+  outcomes = max_hit - min_hit + 1
+  expected = [0.0] * (hitpoints + 1)
+  for hp in range(1, hitpoints + 1):
+    # Hits of 0 leave hp where it was: E = 1 + (zeros * E + sum over damaging hits) / outcomes
+    zeros = 1 if min_hit == 0 else 0
+    total = sum(expected[max(0, hp - damage)] for damage in range(max(1, min_hit), max_hit + 1))
+    expected[hp] = (outcomes + total) / (outcomes - zeros)
+  return expected[hitpoints]
+
+def cannon_coverage(cannon):
+  # {tile: number of directions the cannon can hit it from}, with the cannon's line of sight rules
+  strategy = cannon.hunt_strategy
+  origin = cannon.coordinate
+  coverage = {}
+  for direction in STEP_DIRECTIONS:
+    is_cardinal = (direction[0] + direction[1]) % 2 != 0
+    distances = CannonHuntStrategy.CARDINAL_CANNON_DISTANCES if is_cardinal else CannonHuntStrategy.ORDINAL_CANNON_DISTANCES
+    hit = set()
+    for distance, radius in zip(distances, CannonHuntStrategy.CANNON_RANGES):
+      center = (origin[0] + direction[0] * distance, origin[1] + direction[1] * distance)
+      for x in range(center[0] - radius, center[0] + radius + 1):
+        for y in range(center[1] - radius, center[1] + radius + 1):
+          if (x, y) not in hit and CannonHuntStrategy.has_line_of_sight(strategy, origin, center, (x, y)):
+            hit.add((x, y))
+    for tile in hit:
+      coverage[tile] = coverage.get(tile, 0) + 1
+  return coverage
+
+SOLID = Mask.TOP | Mask.LEFT | Mask.RIGHT | Mask.BOTTOM
+
+def _is_open(map_registry, tile, size=1):
+  # Whether an npc of size can stand with its south west corner on tile. Solid objects are stored
+  # either as Mask.OBJECT or as all four edges blocked (see create_map_config).
+  for x in range(tile[0], tile[0] + size):
+    for y in range(tile[1], tile[1] + size):
+      flags = map_registry.get_objs((x, y)).get('movement_flags', 0)
+      if flags & Mask.OBJECT or flags & SOLID == SOLID:
+        return False
+  return True
+
+def _npc_model(npc, player, cannon, coverage, map_registry):
+  # (first hit rate while wandering, ticks from first hit to death)
+  x, y = npc.respawn_coordinate
+  w = npc.wanderrange
+  tiles = [(x + dx, y + dy) for dx in range(-w, w + 1) for dy in range(-w, w + 1)]
+  tiles = [tile for tile in tiles if _is_open(map_registry, tile, npc.size)] or [npc.respawn_coordinate]
+  hit_rate = sum(coverage.get(tile, 0) for tile in tiles) / len(tiles) / DIRECTIONS
+  if hit_rate == 0:
+    return 0.0, None
+
+  cannon_damage = (cannon.min_hit + cannon.max_hit) / 2
+  remaining = max(0.0, npc.max_hitpoints - cannon_damage)
+  if remaining == 0:
+    return hit_rate, 0.0
+  if not npc.can_follow(player):
+    return hit_rate, expected_hits_to_kill(int(round(remaining)), cannon.min_hit, cannon.max_hit) / hit_rate
+
+  # Walks from where it was hit (somewhere the cannon covers) to the player, then fights next to it
+  hit_tiles = [tile for tile in tiles if coverage.get(tile)]
+  weights = [coverage[tile] for tile in hit_tiles]
+  approach = sum(max(abs(tile[0] - player.x), abs(tile[1] - player.y)) * weight for tile, weight in zip(hit_tiles, weights)) / sum(weights)
+  adjacent = [(player.x + 1, player.y), (player.x - 1, player.y), (player.x, player.y + 1), (player.x, player.y - 1)]
+  adjacent = [tile for tile in adjacent if _is_open(map_registry, tile, npc.size)] or adjacent
+  engaged_cannon_rate = sum(coverage.get(tile, 0) for tile in adjacent) / len(adjacent) / DIRECTIONS
+  damage_rate = engaged_cannon_rate * cannon_damage + (player.min_hit + player.max_hit) / 2 / player.attack_speed
+  # The cannon keeps hitting it at the wandering rate on the way over
+  approach_damage = approach * hit_rate * cannon_damage
+  if approach_damage >= remaining:
+    return hit_rate, remaining / (hit_rate * cannon_damage)
+  # The player's first swing comes half an attack later
+  return hit_rate, approach + player.attack_speed / 2 + (remaining - approach_damage) / damage_rate
+
+def estimate_engine(engine, ticks=DEFAULT_TICKS):
+  # Estimated kills over ticks for a freshly built engine with one player and cannon
+  player = engine.player_registry.registered_players[0]
+  cannon = player.cannon()
+  map_registry = engine.map_registry
+  coverage = cannon_coverage(cannon)
+  singles = not map_registry.is_in_multicombat(player.coordinate)
+
+  models = []
+  for npc in engine.npc_registry.registered_npcs:
+    if not npc.is_attackable() or npc.plane != cannon.plane:
+      continue
+    hit_rate, kill_ticks = _npc_model(npc, player, cannon, coverage, map_registry)
+    if kill_ticks is None:
+      continue
+    # Only npcs that fight the player keep the cannon busy in singles
+    blocking = singles and npc.can_follow(player) and not map_registry.is_in_multicombat(npc.respawn_coordinate)
+    models.append((hit_rate, kill_ticks, npc.respawn_time, blocking))
+
+  # Busy fraction b: kill rate r_i = 1 / (first_hit_i / (1 - b) + kill_i + respawn_i), b = sum of r_i * kill_i over blocking npcs
+  busy = 0.0
+  rates = []
+  for _ in range(100):
+    rates = [1 / (1 / hit_rate / (1 - busy) + kill_ticks + respawn_time) for hit_rate, kill_ticks, respawn_time, _ in models]
+    new_busy = min(0.99, sum(rate * kill_ticks for rate, (_, kill_ticks, _, blocking) in zip(rates, models) if blocking))
+    if abs(new_busy - busy) < 1e-9:
+      break
+    busy = (busy + new_busy) / 2
+  return sum(rates) * ticks
+
+def estimate(scenario):
+  # Estimated kills over the scenario's ticks
+  return estimate_engine(scenario.build_engine(), scenario.ticks)
+
+def _ranks(values):
+  order = sorted(range(len(values)), key=lambda i: values[i])
+  ranks = [0.0] * len(values)
+  i = 0
+  while i < len(order):
+    j = i
+    while j + 1 < len(order) and values[order[j + 1]] == values[order[i]]:
+      j += 1
+    for k in range(i, j + 1):
+      ranks[order[k]] = (i + j) / 2
+    i = j + 1
+  return ranks
+
+def spearman(a, b):
+  if len(a) < 2:
+    return None
+  ra, rb = _ranks(a), _ranks(b)
+  ma, mb = fmean(ra), fmean(rb)
+  covariance = sum((x - ma) * (y - mb) for x, y in zip(ra, rb))
+  spread = (sum((x - ma) ** 2 for x in ra) * sum((y - mb) ** 2 for y in rb)) ** 0.5
+  return covariance / spread if spread else None
+
+def calibrate(scenarios, replicates):
+  # Surrogate against the mean of simulated replicates for each scenario. Returns (rows, summary) where summary has
+  # the least squares scale from surrogate to simulated kills, the mean absolute error after scaling and the
+  # rank correlation, which is what matters for screening.
+  rows = []
+  for scenario in scenarios:
+    start = perf_counter()
+    surrogate_kills = estimate(scenario)
+    surrogate_seconds = perf_counter() - start
+    start = perf_counter()
+    simulated = fmean(scenario.run_replicate(replicate) for replicate in range(replicates))
+    rows.append({
+      'scenario': scenario.name,
+      'surrogate_kills_per_hour': surrogate_kills * TICKS_PER_HOUR / scenario.ticks,
+      'simulated_kills_per_hour': simulated * TICKS_PER_HOUR / scenario.ticks,
+      'surrogate_ms': 1000 * surrogate_seconds,
+      'simulated_ms': 1000 * (perf_counter() - start),
+    })
+  surrogate = [row['surrogate_kills_per_hour'] for row in rows]
+  simulated = [row['simulated_kills_per_hour'] for row in rows]
+  squares = sum(s * s for s in surrogate)
+  scale = sum(s * k for s, k in zip(surrogate, simulated)) / squares if squares else None
+  summary = {
+    'scale': scale,
+    'mean_absolute_error': fmean(abs(s * scale - k) for s, k in zip(surrogate, simulated)) if scale is not None and rows else None,
+    'rank_correlation': spearman(surrogate, simulated),
+  }
+  return rows, summary
+
+def main(argv=None):
+  parser = argparse.ArgumentParser(description='Estimate kill rates without simulating')
+  parser.add_argument('scenario_file')
+  parser.add_argument('--calibrate', action='store_true', help='Also simulate each scenario and compare')
+  parser.add_argument('--replicates', type=int, default=20, help='Simulated replicates per scenario when calibrating')
+  args = parser.parse_args(argv)
+
+  scenarios = load_scenarios(args.scenario_file)
+  if not args.calibrate:
+    for scenario in scenarios:
+      print(f'{scenario.name}: ~{estimate(scenario) * TICKS_PER_HOUR / scenario.ticks:.1f} kills/hr')
+    return
+  rows, summary = calibrate(scenarios, args.replicates)
+  for row in rows:
+    print(f"{row['scenario']}: surrogate {row['surrogate_kills_per_hour']:.1f}/hr ({row['surrogate_ms']:.1f}ms), simulated {row['simulated_kills_per_hour']:.1f}/hr ({row['simulated_ms']:.0f}ms)")
+  print(f"scale {summary['scale']}, mean absolute error after scaling {summary['mean_absolute_error']}, rank correlation {summary['rank_correlation']}")
+
+if __name__ == '__main__':
+  main()
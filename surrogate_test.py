@@ -0,0 +1,70 @@
+from unittest import TestCase, main
+from create_map import Mask
+from scenario import Scenario
+from surrogate import calibrate, cannon_coverage, estimate, expected_hits_to_kill, spearman
+from sweep_test import skeleton_scenario
+from synthetic import synthetic_scenario
+
+class SurrogateTest(TestCase):
+
+  def test_expected_hits_should_count_misses(self):
+    self.assertEqual(expected_hits_to_kill(0), 0)
+    # Anything but a 0 kills a 1 hp npc
+    self.assertAlmostEqual(expected_hits_to_kill(1), 31 / 30)
+    self.assertAlmostEqual(expected_hits_to_kill(5, min_hit=5, max_hit=30), 1)
+    self.assertGreater(expected_hits_to_kill(60), 60 / 15)
+
+  def test_coverage_should_follow_the_cannon_areas(self):
+    engine = skeleton_scenario().build_engine()
+    cannon = engine.player_registry.registered_players[0].cannon()
+    coverage = cannon_coverage(cannon)
+
+    x, y = cannon.coordinate
+    # Straight north: the first area is centered 3 tiles away
+    self.assertEqual(coverage.get((x, y + 3)), 1)
+    self.assertNotIn((x, y + 1), coverage)
+    self.assertNotIn((x + 30, y), coverage)
+    self.assertTrue(all(1 <= count <= 8 for count in coverage.values()))
+
+  def test_should_not_expect_kills_out_of_reach(self):
+    far = [{'id': 70, 'x': 200, 'y': 200}]
+    scenario = Scenario('far', (0, 0), (1, 1), npc_ids=[70], npcs=far, map_config={})
+    self.assertEqual(estimate(scenario), 0)
+
+  def test_should_leave_solid_objects_out_of_the_wander_area(self):
+    def spot(flags):
+      # Projectiles pass over the object, so only where the npc can stand changes
+      map_config = {0: {4: {'movement_flags': flags, 'projectile_flags': 0}}} if flags else {}
+      npcs = [{'id': 70, 'x': 1, 'y': 5}]
+      return estimate(Scenario('spot', (0, 0), (1, 1), npc_ids=[70], npc_stats={70: {'wander_range': 1}}, npcs=npcs, map_config=map_config))
+
+    # Solid objects are stored with all four edges blocked, the same as a tile flagged as an object
+    solid = spot(Mask.TOP | Mask.LEFT | Mask.RIGHT | Mask.BOTTOM)
+    self.assertEqual(solid, spot(Mask.OBJECT))
+    self.assertNotEqual(solid, spot(0))
+    # A single wall edge doesn't stop anything standing there
+    self.assertEqual(spot(Mask.TOP), spot(0))
+
+  def test_should_grow_with_the_population(self):
+    few = estimate(synthetic_scenario('few', 40, 40, 5, seed=1))
+    many = estimate(synthetic_scenario('many', 40, 40, 40, seed=1))
+    self.assertGreater(few, 0)
+    self.assertGreater(many, few)
+
+  def test_calibration_should_rank_spots_like_the_simulation(self):
+    # Same map, more npcs: both the surrogate and the simulation should put them in this order
+    scenarios = [synthetic_scenario(f'{npc_count} npcs', 30, 30, npc_count, seed=2, ticks=300) for npc_count in (2, 10, 40)]
+    rows, summary = calibrate(scenarios, replicates=2)
+
+    self.assertEqual([row['scenario'] for row in rows], ['2 npcs', '10 npcs', '40 npcs'])
+    self.assertTrue(all(row['surrogate_kills_per_hour'] > 0 for row in rows))
+    self.assertGreater(summary['scale'], 0)
+    self.assertGreater(summary['rank_correlation'], 0)
+
+  def test_spearman_should_use_ranks(self):
+    self.assertEqual(spearman([1, 2, 3], [10, 30, 20]), 0.5)
+    self.assertEqual(spearman([1, 2, 3], [1, 4, 9]), 1)
+    self.assertIsNone(spearman([1], [2]))
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,240 @@
+import argparse
+import gzip
+import json
+import multiprocessing
+from collections import defaultdict
+from pathlib import Path
+import steady_state
+from cannon_sim import EngineStats
+from result_cache import DEFAULT_MAX_BYTES, ResultCache, scenario_key
+from scenario import load_scenarios
+
+# Headless sweeps over a scenario file:
+#   python sweep.py scenarios.json -o results.json.gz --workers 8
+# Results are written column-wise: one list per field with a row per replicate.
+# With --steady-state each scenario is instead run as a few long runs and rows are chunks of those runs
+# (see steady_state.py).
+
+TICKS_PER_HOUR = 6000
+# Replicates handed to a worker at a time, big enough that scheduling overhead doesn't matter
+DEFAULT_BATCH_SIZE = 25
+
+def work_units(scenarios, batch_size, pending=None):
+  # pending lists the replicates still to run for each scenario (all of them by default).
+  # Units cover contiguous replicates, units of the same region are queued next to each other
+  # so workers mostly hit their map cache.
+  units = []
+  for index, scenario in enumerate(scenarios):
+    replicates = range(scenario.replicates) if pending is None else pending[index]
+    start = None
+    for replicate in replicates:
+      if start is not None and (replicate != stop or stop - start == batch_size):
+        units.append((index, scenario, start, stop))
+        start = None
+      if start is None:
+        start = replicate
+      stop = replicate + 1
+    if start is not None:
+      units.append((index, scenario, start, stop))
+  units.sort(key=lambda unit: (str(unit[1].region), unit[0], unit[2]))
+  return units
+
+def run_work_unit(unit, profile=False):
+  index, scenario, start, stop = unit
+  stats = EngineStats() if profile else None
+  kills = [scenario.run_replicate(replicate, stats) for replicate in range(start, stop)]
+  return index, start, kills, stats
+
+def _run_profiled_work_unit(unit):
+  return run_work_unit(unit, profile=True)
+
+def preload_regions(scenarios):
+  # Compile each region once in the parent. Forked workers inherit the compiled maps instead of building their own.
+  for scenario in scenarios:
+    scenario.get_map_registry()
+    scenario.get_npc_structs()
+
+def lookup_cached(scenarios, cache):
+  # Returns (kills_by_scenario, pending, keys): kills filled in from the cache with None for the replicates
+  # still to run, the replicates still to run for each scenario, and each scenario's cache key
+  kills_by_scenario = [[None] * scenario.replicates for scenario in scenarios]
+  if cache is None:
+    return kills_by_scenario, None, None
+  keys = [scenario_key(scenario) for scenario in scenarios]
+  pending = []
+  for scenario, key, kills in zip(scenarios, keys, kills_by_scenario):
+    cached = cache.get(key, [scenario.seed_for(replicate) for replicate in range(scenario.replicates)])
+    for replicate in range(scenario.replicates):
+      kills[replicate] = cached.get(scenario.seed_for(replicate))
+    pending.append([replicate for replicate, kill_count in enumerate(kills) if kill_count is None])
+  return kills_by_scenario, pending, keys
+
+def store_cached(cache, key, scenario, start, kills):
+  cache.put(key, {scenario.seed_for(start + i): kill_count for i, kill_count in enumerate(kills)})
+
+def run_sweep(scenarios, workers=None, batch_size=DEFAULT_BATCH_SIZE, profile=False, progress=None, cache=None):
+  # Returns (columns, stats) where columns holds one row per replicate.
+  # With a ResultCache only replicates missing from it are run, and new ones are added to it.
+  kills_by_scenario, pending, keys = lookup_cached(scenarios, cache)
+  units = work_units(scenarios, batch_size, pending)
+  stats = EngineStats() if profile else None
+  worker = _run_profiled_work_unit if profile else run_work_unit
+
+  if workers == 1 or not units:
+    results = map(worker, units)
+    pool = None
+  else:
+    preload_regions(scenarios)
+    pool = multiprocessing.Pool(workers)
+    results = pool.imap_unordered(worker, units)
+
+  try:
+    for done, (index, start, kills, unit_stats) in enumerate(results, 1):
+      kills_by_scenario[index][start:start + len(kills)] = kills
+      if cache is not None:
+        store_cached(cache, keys[index], scenarios[index], start, kills)
+      if unit_stats is not None:
+        stats.merge(unit_stats)
+      if progress:
+        progress(done, len(units))
+  finally:
+    if pool is not None:
+      pool.close()
+      pool.join()
+
+  return build_columns(scenarios, kills_by_scenario), stats
+
+def build_columns(scenarios, kills_by_scenario):
+  columns = defaultdict(list)
+  for scenario, kills in zip(scenarios, kills_by_scenario):
+    for replicate, kill_count in enumerate(kills):
+      columns['scenario'].append(scenario.name)
+      columns['replicate'].append(replicate)
+      columns['seed'].append(scenario.seed_for(replicate))
+      columns['ticks'].append(scenario.ticks)
+      columns['kills'].append(kill_count)
+  return dict(columns)
+
+def _run_long_unit(unit):
+  index, scenario, run, ticks, chunk_ticks, profile = unit
+  stats = EngineStats() if profile else None
+  return index, run, scenario.run_long(run, ticks, chunk_ticks, stats), stats
+
+def run_steady_state(scenarios, workers=None, runs=4, ticks=steady_state.DEFAULT_RUN_TICKS, chunk_ticks=steady_state.DEFAULT_CHUNK_TICKS, profile=False, progress=None):
+  # Returns (columns, stats) where columns holds one row per chunk of each long run
+  if ticks % chunk_ticks != 0:
+    raise ValueError(f'{ticks} ticks is not a whole number of {chunk_ticks} tick chunks')
+  units = [(index, scenario, run, ticks, chunk_ticks, profile) for index, scenario in enumerate(scenarios) for run in range(runs)]
+  chunk_kills = [[None] * runs for _ in scenarios]
+  stats = EngineStats() if profile else None
+
+  if workers == 1:
+    results = map(_run_long_unit, units)
+    pool = None
+  else:
+    preload_regions(scenarios)
+    pool = multiprocessing.Pool(workers)
+    results = pool.imap_unordered(_run_long_unit, units)
+
+  try:
+    for done, (index, run, kills, unit_stats) in enumerate(results, 1):
+      chunk_kills[index][run] = kills
+      if unit_stats is not None:
+        stats.merge(unit_stats)
+      if progress:
+        progress(done, len(units))
+  finally:
+    if pool is not None:
+      pool.close()
+      pool.join()
+
+  columns = defaultdict(list)
+  for scenario, scenario_runs in zip(scenarios, chunk_kills):
+    for run, kills in enumerate(scenario_runs):
+      for chunk, kill_count in enumerate(kills):
+        columns['scenario'].append(scenario.name)
+        columns['run'].append(run)
+        columns['seed'].append(scenario.seed_for(run))
+        columns['chunk'].append(chunk)
+        columns['ticks'].append(chunk_ticks)
+        columns['kills'].append(kill_count)
+  return dict(columns), stats
+
+def summarize_steady_state(scenarios, columns, batches=steady_state.DEFAULT_BATCHES):
+  runs_by_name = defaultdict(lambda: defaultdict(list))
+  chunk_ticks = {}
+  for name, run, ticks, kills in zip(columns['scenario'], columns['run'], columns['ticks'], columns['kills']):
+    runs_by_name[name][run].append(kills)
+    chunk_ticks[name] = ticks
+  rows = []
+  for scenario in scenarios:
+    runs = [kills for _, kills in sorted(runs_by_name[scenario.name].items())]
+    estimate = steady_state.estimate(runs, chunk_ticks.get(scenario.name, 1), batches, ticks_per_hour=TICKS_PER_HOUR)
+    rows.append({'scenario': scenario.name, **estimate})
+  return rows
+
+def summarize(scenarios, columns):
+  kills_by_name = defaultdict(list)
+  for name, kills in zip(columns['scenario'], columns['kills']):
+    kills_by_name[name].append(kills)
+  rows = []
+  for scenario in scenarios:
+    kills = kills_by_name[scenario.name]
+    mean = sum(kills) / len(kills) if kills else 0
+    rows.append({'scenario': scenario.name, 'replicates': len(kills), 'mean_kills': mean, 'kills_per_hour': mean * TICKS_PER_HOUR / scenario.ticks})
+  return rows
+
+def write_columns(path, columns):
+  path = Path(path)
+  opener = gzip.open if path.suffix == '.gz' else open
+  with opener(path, 'wt') as output:
+    json.dump(columns, output, separators=(',', ':'))
+
+def read_columns(path):
+  path = Path(path)
+  opener = gzip.open if path.suffix == '.gz' else open
+  with opener(path, 'rt') as result_file:
+    return json.load(result_file)
+
+def main(argv=None):
+  parser = argparse.ArgumentParser(description='Run every scenario in a scenario file and write per replicate kill counts')
+  parser.add_argument('scenario_file')
+  parser.add_argument('-o', '--output', default='results.json.gz', help='Columnar JSON output, gzipped if it ends in .gz')
+  parser.add_argument('-w', '--workers', type=int, default=None, help='Worker processes (defaults to the cpu count)')
+  parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE, help='Replicates per work unit')
+  parser.add_argument('--profile', action='store_true', help='Collect and print hot path stats merged over every run')
+  parser.add_argument('--cache', help='Directory of cached replicate results to reuse and add to')
+  parser.add_argument('--cache-size', type=int, default=DEFAULT_MAX_BYTES // (1024 * 1024), help='Size the cache is trimmed to, in MiB')
+  parser.add_argument('--steady-state', action='store_true', help='Estimate kills per hour from a few long runs with batch means instead of replicates')
+  parser.add_argument('--runs', type=int, default=4, help='Long runs per scenario with --steady-state')
+  parser.add_argument('--run-ticks', type=int, default=steady_state.DEFAULT_RUN_TICKS, help='Length of each long run with --steady-state')
+  parser.add_argument('--chunk-ticks', type=int, default=steady_state.DEFAULT_CHUNK_TICKS, help='Ticks per recorded chunk with --steady-state')
+  parser.add_argument('--batches', type=int, default=steady_state.DEFAULT_BATCHES, help='Batches per long run with --steady-state')
+  args = parser.parse_args(argv)
+  if args.steady_state and args.run_ticks % args.chunk_ticks != 0:
+    parser.error('--run-ticks has to be a multiple of --chunk-ticks')
+
+  scenarios = load_scenarios(args.scenario_file)
+  def progress(done, total):
+    print(f'Finished {done}/{total} work units', flush=True)
+
+  if args.steady_state:
+    columns, stats = run_steady_state(scenarios, args.workers, args.runs, args.run_ticks, args.chunk_ticks, args.profile, progress)
+    write_columns(args.output, columns)
+    for row in summarize_steady_state(scenarios, columns, args.batches):
+      if row['half_width'] is None:
+        print(f"{row['scenario']}: not enough batches for an estimate")
+        continue
+      autocorrelation = 'n/a' if row['lag1_autocorrelation'] is None else f"{row['lag1_autocorrelation']:.2f}"
+      print(f"{row['scenario']}: {row['kills_per_hour']:.1f}/hr +- {row['half_width']:.1f} over {row['batches']} batches (burn in {max(row['burn_in_ticks'])} ticks, lag 1 autocorrelation {autocorrelation})")
+  else:
+    cache = ResultCache(args.cache, args.cache_size * 1024 * 1024) if args.cache else None
+    columns, stats = run_sweep(scenarios, args.workers, args.batch_size, args.profile, progress, cache)
+    write_columns(args.output, columns)
+    for row in summarize(scenarios, columns):
+      print(f"{row['scenario']}: {row['mean_kills']:.2f} kills over {row['replicates']} runs ({row['kills_per_hour']:.1f}/hr)")
+  if stats is not None:
+    print(stats.report())
+
+if __name__ == '__main__':
+  main()
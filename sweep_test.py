@@ -0,0 +1,95 @@
+import json
+import tempfile
+from pathlib import Path
+from unittest import TestCase, main
+from scenario import Scenario, load_scenarios
+from sweep import read_columns, run_sweep, summarize, write_columns
+
+def skeleton_scenario(name='open field', replicates=4):
+  # Small spot with its own map so it runs without the game data
+  npcs = [{'id': 70, 'x': x, 'y': y} for (x, y) in [(0, 5), (3, 6), (-4, 8), (6, -2)]]
+  return Scenario(name, (0, 0), (1, 1), npc_ids=[70], ticks=200, replicates=replicates, npcs=npcs, map_config={0: {2: {'movement_flags': 15, 'projectile_flags': 15}}})
+
+class ScenarioTest(TestCase):
+
+  def test_load_scenarios_should_apply_defaults_and_overrides(self):
+    data = {
+      'defaults': {'ticks': 100, 'replicates': 3},
+      'scenarios': [
+        {'name': 'a', 'player_tile': [1, 2], 'cannon_tile': [2, 2], 'npc_stats': {'70': {'hitpoints': 35}}},
+        {'name': 'b', 'player_tile': [1, 2], 'cannon_tile': [2, 2], 'ticks': 50, 'map_config': {'1': {'3': {'movement_flags': 1}}}},
+      ]
+    }
+    with tempfile.TemporaryDirectory() as directory:
+      path = Path(directory) / 'scenarios.json'
+      path.write_text(json.dumps(data))
+      a, b = load_scenarios(path)
+
+    self.assertEqual(a.ticks, 100)
+    self.assertEqual(a.replicates, 3)
+    self.assertEqual(a.player_tile, (1, 2))
+    self.assertEqual(a.npc_stats, {70: {'hitpoints': 35}})
+    self.assertEqual(b.ticks, 50)
+    self.assertEqual(b.map_config, {1: {3: {'movement_flags': 1}}})
+
+  def test_multicombat_zones_should_apply_to_inline_maps(self):
+    scenario = Scenario.from_dict({'name': 'multi', 'player_tile': [0, 0], 'cannon_tile': [1, 1], 'map_config': {}, 'multicombat_zones': [[0, 0, 3, 3]]})
+    map_registry = scenario.get_map_registry()
+
+    self.assertTrue(map_registry.is_in_multicombat((3, 3)))
+    self.assertFalse(map_registry.is_in_multicombat((4, 3)))
+
+  def test_inline_maps_should_be_shared_by_content_not_name(self):
+    walled = {0: {2: {'movement_flags': 15, 'projectile_flags': 15}}}
+    empty = Scenario('s', (0, 0), (1, 1), map_config={})
+    same_name = Scenario('s', (0, 0), (1, 1), map_config=walled)
+    same_map = Scenario('other', (5, 5), (6, 6), map_config={0: {2: {'movement_flags': 15, 'projectile_flags': 15}}})
+
+    self.assertEqual(empty.get_map_registry().map_config, {})
+    self.assertEqual(same_name.get_map_registry().map_config, walled)
+    self.assertIs(same_map.get_map_registry(), same_name.get_map_registry())
+    zoned = Scenario('s', (0, 0), (1, 1), map_config=walled, multicombat_zones=[[0, 0, 3, 3]])
+    self.assertIsNot(zoned.get_map_registry(), same_name.get_map_registry())
+
+  def test_to_dict_should_round_trip(self):
+    scenario = skeleton_scenario()
+    copy = Scenario.from_dict(json.loads(json.dumps(scenario.to_dict())))
+    self.assertEqual(copy.to_dict(), scenario.to_dict())
+
+  def test_run_replicate_should_be_deterministic(self):
+    scenario = skeleton_scenario()
+    self.assertEqual(scenario.run_replicate(2), scenario.run_replicate(2))
+
+class SweepTest(TestCase):
+
+  def test_sweep_should_not_depend_on_worker_count(self):
+    scenarios = [skeleton_scenario('a'), skeleton_scenario('b', replicates=3)]
+
+    serial, _ = run_sweep(scenarios, workers=1, batch_size=2)
+    parallel, _ = run_sweep(scenarios, workers=2, batch_size=2)
+
+    self.assertEqual(serial, parallel)
+    self.assertEqual(serial['scenario'], ['a'] * 4 + ['b'] * 3)
+    self.assertEqual(serial['replicate'], [0, 1, 2, 3, 0, 1, 2])
+
+  def test_sweep_should_merge_stats_from_every_unit(self):
+    scenarios = [skeleton_scenario(replicates=3)]
+
+    _, stats = run_sweep(scenarios, workers=1, batch_size=1, profile=True)
+
+    self.assertEqual(stats.counts['ticks'], 3 * 200)
+
+  def test_columns_should_round_trip_through_gzip(self):
+    scenarios = [skeleton_scenario(replicates=2)]
+    columns, _ = run_sweep(scenarios, workers=1)
+    with tempfile.TemporaryDirectory() as directory:
+      path = Path(directory) / 'results.json.gz'
+      write_columns(path, columns)
+      self.assertEqual(read_columns(path), columns)
+
+    summary, = summarize(scenarios, columns)
+    self.assertEqual(summary['replicates'], 2)
+    self.assertEqual(summary['mean_kills'], sum(columns['kills']) / 2)
+
+if __name__ == '__main__':
+  main()
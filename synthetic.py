@@ -0,0 +1,104 @@
+import random
+from cannon_sim import MapRegistry, build_engine
+from create_map import Mask
+from scenario import Scenario
+
+# Generated spots, for tests and benchmarks that have to run without the game data.
+# Maps are built from the same kinds of locs create_map_config reads (walls, diagonal walls, solid objects of
+# one or more tiles, some of which don't block projectiles) into the same map_config layout, and npc populations
+# are spawn structs like relevant_npcs returns with their stats given as npc_stats overrides.
+
+DEFAULT_WALL_DENSITY = 0.03
+DEFAULT_DIAGONAL_DENSITY = 0.01
+DEFAULT_OBJECT_DENSITY = 0.02
+# Share of walls and objects that projectiles pass over (fences, low rocks, ...)
+DEFAULT_SEE_THROUGH = 0.3
+# Stats of generated npcs, like a skeleton
+SYNTHETIC_NPC_STATS = {'hitpoints': 29, 'combat_level': 22, 'max_range': 10, 'wander_range': 8, 'respawn_time': 70}
+# Generated npcs of size s get id SYNTHETIC_NPC_ID + s
+SYNTHETIC_NPC_ID = 100000
+# Tiles around the player and cannon that are kept clear
+CLEARING_RADIUS = 2
+
+def _add_loc(map_config, x, y, blockers, blocks_projectiles):
+  # Same merge as create_map_config
+  column = map_config.setdefault(x, {})
+  current = column.get(y, {'movement_flags': 0, 'projectile_flags': 0})
+  column[y] = {
+    'movement_flags': current['movement_flags'] | blockers,
+    'projectile_flags': current['projectile_flags'] | (blockers if blocks_projectiles else 0),
+  }
+
+def synthetic_map_config(width, height, seed=0, wall_density=DEFAULT_WALL_DENSITY, diagonal_density=DEFAULT_DIAGONAL_DENSITY, object_density=DEFAULT_OBJECT_DENSITY, see_through=DEFAULT_SEE_THROUGH, clear=()):
+  # Densities are the chance of each tile getting that kind of loc. Tiles within CLEARING_RADIUS of a tile in clear are left empty.
+  rng = random.Random(seed)
+  map_config = {}
+  cleared = {(x + dx, y + dy) for x, y in clear for dx in range(-CLEARING_RADIUS, CLEARING_RADIUS + 1) for dy in range(-CLEARING_RADIUS, CLEARING_RADIUS + 1)}
+  for x in range(width):
+    for y in range(height):
+      if (x, y) in cleared:
+        continue
+      roll = rng.random()
+      blocks_projectiles = rng.random() >= see_through
+      if roll < wall_density:
+        # Straight wall (type 0) or wall corner (type 2)
+        if rng.random() < 0.8:
+          blockers = rng.choice([Mask.LEFT, Mask.TOP, Mask.RIGHT, Mask.BOTTOM])
+        else:
+          blockers = rng.choice([Mask.TOP + Mask.LEFT, Mask.TOP + Mask.RIGHT, Mask.BOTTOM + Mask.RIGHT, Mask.BOTTOM + Mask.LEFT])
+        _add_loc(map_config, x, y, blockers, blocks_projectiles)
+      elif roll < wall_density + diagonal_density:
+        _add_loc(map_config, x, y, rng.choice([Mask.TOP_LEFT, Mask.TOP_RIGHT, Mask.BOTTOM_RIGHT, Mask.BOTTOM_LEFT]), blocks_projectiles)
+      elif roll < wall_density + diagonal_density + object_density:
+        # Solid objects (type 10) up to 3x3, cut off at the clearing and the edge of the map
+        dim_x = rng.choice([1, 1, 1, 2, 3])
+        dim_y = rng.choice([1, 1, 1, 2, 3])
+        for ox in range(x, min(x + dim_x, width)):
+          for oy in range(y, min(y + dim_y, height)):
+            if (ox, oy) not in cleared:
+              _add_loc(map_config, ox, oy, Mask.TOP + Mask.LEFT + Mask.RIGHT + Mask.BOTTOM, blocks_projectiles)
+  return map_config
+
+def synthetic_npcs(map_config, width, height, count, sizes=(1,), seed=0, reserved=()):
+  # count spawn structs on tiles with nothing on them, not overlapping each other or the reserved tiles.
+  # Sizes are picked evenly from sizes. Raises ValueError when the map is too full to fit them.
+  rng = random.Random(seed)
+  occupied = set(reserved)
+  npcs = []
+  attempts = 0
+  while len(npcs) < count:
+    attempts += 1
+    if attempts > 100 * count + 1000:
+      raise ValueError(f'Could only fit {len(npcs)} of {count} npcs on a {width}x{height} map')
+    size = rng.choice(sizes)
+    x = rng.randrange(width - size + 1)
+    y = rng.randrange(height - size + 1)
+    tiles = [(x + i, y + j) for i in range(size) for j in range(size)]
+    if any(tile in occupied or map_config.get(tile[0], {}).get(tile[1]) for tile in tiles):
+      continue
+    occupied.update(tiles)
+    npcs.append({'id': SYNTHETIC_NPC_ID + size, 'x': x, 'y': y})
+  return npcs
+
+def synthetic_npc_stats(sizes=(1,)):
+  return {SYNTHETIC_NPC_ID + size: {**SYNTHETIC_NPC_STATS, 'size': size} for size in sizes}
+
+def _player_and_cannon_tiles(width, height):
+  player_tile = (width // 2, height // 2)
+  return player_tile, (player_tile[0] + 1, player_tile[1] - 1)
+
+def synthetic_scenario(name, width, height, npc_count, sizes=(1,), seed=0, ticks=6000, replicates=100, **map_options):
+  # A Scenario with its own map and spawns, the player in the middle with the cannon to the south east
+  player_tile, cannon_tile = _player_and_cannon_tiles(width, height)
+  map_config = synthetic_map_config(width, height, seed, clear=[player_tile, cannon_tile], **map_options)
+  npcs = synthetic_npcs(map_config, width, height, npc_count, sizes, seed, reserved=[player_tile, cannon_tile])
+  return Scenario(name, player_tile, cannon_tile, npc_stats=synthetic_npc_stats(sizes), ticks=ticks, replicates=replicates, seed=seed, npcs=npcs, map_config=map_config)
+
+def build_synthetic_engine(width, height, npc_count, sizes=(1,), seed=0, map_registry=None, fast_forward=True, **map_options):
+  # Engine for a generated spot, without going through a Scenario. Pass a map_registry built from
+  # synthetic_map_config(width, height, seed, ...) to share its clearance map between engines.
+  player_tile, cannon_tile = _player_and_cannon_tiles(width, height)
+  if map_registry is None:
+    map_registry = MapRegistry(synthetic_map_config(width, height, seed, clear=[player_tile, cannon_tile], **map_options))
+  npcs = synthetic_npcs(map_registry.map_config, width, height, npc_count, sizes, seed, reserved=[player_tile, cannon_tile])
+  return build_engine(player_tile, cannon_tile, map_registry=map_registry, npc_structs=npcs, npc_stats=synthetic_npc_stats(sizes), fast_forward=fast_forward)
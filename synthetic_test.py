@@ -0,0 +1,66 @@
+import random
+from unittest import TestCase, main
+from cannon_sim import count_kills
+from scenario import Scenario
+from synthetic import CLEARING_RADIUS, SYNTHETIC_NPC_ID, build_synthetic_engine, synthetic_map_config, synthetic_npcs, synthetic_scenario
+
+class SyntheticMapTest(TestCase):
+
+  def test_should_be_the_same_for_a_seed(self):
+    self.assertEqual(synthetic_map_config(40, 30, seed=5), synthetic_map_config(40, 30, seed=5))
+    self.assertNotEqual(synthetic_map_config(40, 30, seed=5), synthetic_map_config(40, 30, seed=6))
+
+  def test_should_hold_every_kind_of_blocker(self):
+    map_config = synthetic_map_config(64, 64, seed=1, wall_density=0.1, diagonal_density=0.1, object_density=0.1)
+    tiles = [(x, y, flags) for x, column in map_config.items() for y, flags in column.items()]
+
+    self.assertTrue(all(0 <= x < 64 and 0 <= y < 64 for x, y, _ in tiles))
+    movement_flags = {flags['movement_flags'] for _, _, flags in tiles}
+    self.assertTrue(movement_flags & {1, 2, 4, 8})
+    self.assertTrue(movement_flags & {16, 32, 64, 128})
+    self.assertIn(15, movement_flags)
+    # Some blockers let projectiles through
+    self.assertTrue(any(flags['projectile_flags'] == 0 for _, _, flags in tiles))
+    self.assertTrue(any(flags['projectile_flags'] == flags['movement_flags'] for _, _, flags in tiles))
+
+  def test_should_keep_the_clearing_empty(self):
+    map_config = synthetic_map_config(20, 20, seed=2, object_density=0.9, clear=[(10, 10)])
+    for x in range(10 - CLEARING_RADIUS, 11 + CLEARING_RADIUS):
+      for y in range(10 - CLEARING_RADIUS, 11 + CLEARING_RADIUS):
+        self.assertNotIn(y, map_config.get(x, {}), (x, y))
+
+class SyntheticNpcsTest(TestCase):
+
+  def test_should_place_npcs_on_free_tiles(self):
+    map_config = synthetic_map_config(50, 50, seed=3)
+    npcs = synthetic_npcs(map_config, 50, 50, 200, sizes=(1, 2, 3), seed=3, reserved=[(25, 25)])
+
+    self.assertEqual(len(npcs), 200)
+    self.assertEqual({npc['id'] - SYNTHETIC_NPC_ID for npc in npcs}, {1, 2, 3})
+    covered = set()
+    for npc in npcs:
+      size = npc['id'] - SYNTHETIC_NPC_ID
+      tiles = {(npc['x'] + i, npc['y'] + j) for i in range(size) for j in range(size)}
+      self.assertFalse(tiles & covered)
+      self.assertTrue(all(0 <= x < 50 and 0 <= y < 50 and y not in map_config.get(x, {}) for x, y in tiles))
+      covered |= tiles
+    self.assertNotIn((25, 25), covered)
+
+  def test_should_refuse_populations_that_do_not_fit(self):
+    with self.assertRaises(ValueError):
+      synthetic_npcs({}, 4, 4, 17)
+
+  def test_scenarios_should_run_like_engines_built_directly(self):
+    scenario = synthetic_scenario('generated', 32, 32, 20, sizes=(1, 2), seed=4, ticks=300)
+    copy = Scenario.from_dict(scenario.to_dict())
+
+    engine = build_synthetic_engine(32, 32, 20, sizes=(1, 2), seed=4)
+    self.assertEqual(len(engine.npc_registry.registered_npcs), 20)
+    self.assertEqual({npc.size for npc in engine.npc_registry.registered_npcs}, {1, 2})
+    random.seed(scenario.seed_for(0))
+    engine.perform_ticks(300)
+    self.assertEqual(scenario.run_replicate(0), count_kills(engine.npc_registry))
+    self.assertEqual(copy.run_replicate(0), scenario.run_replicate(0))
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,115 @@
+import numpy as np
+from cannon_sim import STEP_DIRECTIONS, CannonHuntStrategy
+from create_map import Mask
+
+# Batch versions of HuntStrategy.has_line_of_sight for spot analysis and precomputing targets.
+# Every target tile is stepped at once with the same fixed point maths as the scalar port,
+# so the results match it exactly.
+
+# Same as CannonHuntStrategy.get_target
+CANNON_DIRECTIONS = STEP_DIRECTIONS
+ORDINAL_CANNON_DISTANCES = CannonHuntStrategy.ORDINAL_CANNON_DISTANCES
+CARDINAL_CANNON_DISTANCES = CannonHuntStrategy.CARDINAL_CANNON_DISTANCES
+CANNON_RANGES = CannonHuntStrategy.CANNON_RANGES
+
+def projectile_flag_grid(map_registry, bottom_left, width, height):
+  # projectile_flags of every tile in the area as an int32 array indexed [x, y] from bottom_left
+  grid = np.zeros((width, height), dtype=np.int32)
+  map_config = map_registry.map_config
+  for x in range(bottom_left[0], bottom_left[0] + width):
+    column = map_config.get(x)
+    if not column:
+      continue
+    for y, objs in column.items():
+      if bottom_left[1] <= y < bottom_left[1] + height:
+        grid[x - bottom_left[0], y - bottom_left[1]] = objs.get('projectile_flags', 0)
+  return grid
+
+def _zero_fill_right_shift(val, n):
+  return np.where(val >= 0, val, val + 0x100000000) >> n
+
+def _flags_at(grid, bottom_left, x, y):
+  # Tiles outside of the grid have no flags, like tiles missing from the map config
+  gx = x - bottom_left[0]
+  gy = y - bottom_left[1]
+  inside = (gx >= 0) & (gx < grid.shape[0]) & (gy >= 0) & (gy < grid.shape[1])
+  return np.where(inside, grid[np.where(inside, gx, 0), np.where(inside, gy, 0)], 0)
+
+def lines_of_sight(grid, bottom_left, source, targets_x, targets_y):
+  # Whether source has line of sight to each (targets_x[i], targets_y[i]), over a grid from projectile_flag_grid
+  targets_x = np.asarray(targets_x, dtype=np.int64)
+  targets_y = np.asarray(targets_y, dtype=np.int64)
+  dx = targets_x - source[0]
+  dy = targets_y - source[1]
+  dx_abs = np.abs(dx)
+  dy_abs = np.abs(dy)
+  x_flags = np.where(dx < 0, Mask.RIGHT, Mask.LEFT)
+  y_flags = np.where(dy < 0, Mask.TOP, Mask.BOTTOM)
+
+  # Step along whichever axis is longer, the other one moves by a 16.16 fixed point slope
+  x_major = dx_abs > dy_abs
+  steps = np.where(x_major, dx_abs, dy_abs)
+  major_direction = np.where(x_major, np.where(dx < 0, -1, 1), np.where(dy < 0, -1, 1))
+  major_start = np.where(x_major, source[0], source[1])
+  minor_delta = np.where(x_major, dy, dx)
+  slope = (minor_delta << 16) // np.maximum(steps, 1)
+  minor_big = (np.where(x_major, source[1], source[0]) << 16) + 0x8000 - (minor_delta < 0)
+  major_flags = np.where(x_major, x_flags, y_flags)
+  minor_flags = np.where(x_major, y_flags, x_flags)
+
+  visible = np.ones(dx.shape, dtype=bool)
+  for step in range(1, int(steps.max(initial=0)) + 1):
+    active = visible & (step <= steps)
+    if not active.any():
+      break
+    major = major_start + step * major_direction
+    minor = _zero_fill_right_shift(minor_big, 16)
+    x = np.where(x_major, major, minor)
+    y = np.where(x_major, minor, major)
+    blocked = _flags_at(grid, bottom_left, x, y) & major_flags != 0
+
+    minor_big = minor_big + slope
+    next_minor = _zero_fill_right_shift(minor_big, 16)
+    next_x = np.where(x_major, major, next_minor)
+    next_y = np.where(x_major, next_minor, major)
+    blocked |= (next_minor != minor) & (_flags_at(grid, bottom_left, next_x, next_y) & minor_flags != 0)
+
+    visible &= ~(active & blocked)
+  return visible
+
+def visibility_map(map_registry, source, radius, grid=None, bottom_left=None):
+  # (2*radius + 1) x (2*radius + 1) bool array, [radius + dx, radius + dy] is whether source sees source + (dx, dy)
+  if grid is None:
+    bottom_left = (source[0] - radius, source[1] - radius)
+    grid = projectile_flag_grid(map_registry, bottom_left, 2*radius + 1, 2*radius + 1)
+  offsets = np.arange(-radius, radius + 1)
+  targets_x, targets_y = np.meshgrid(source[0] + offsets, source[1] + offsets, indexing='ij')
+  return lines_of_sight(grid, bottom_left, source, targets_x, targets_y)
+
+def cannon_target_areas(cannon_coordinate):
+  # The 24 (direction, center, range) areas a cannon at cannon_coordinate scans
+  areas = []
+  for direction in CANNON_DIRECTIONS:
+    is_cardinal = (direction[0] + direction[1]) % 2 != 0
+    distances = CARDINAL_CANNON_DISTANCES if is_cardinal else ORDINAL_CANNON_DISTANCES
+    for distance, cannon_range in zip(distances, CANNON_RANGES):
+      center = (cannon_coordinate[0] + direction[0] * distance, cannon_coordinate[1] + direction[1] * distance)
+      areas.append((direction, center, cannon_range))
+  return areas
+
+def cannon_visibility_maps(map_registry, cannon_coordinate):
+  # For each of the cannon's target areas, which tiles of the area it could hit.
+  # Returns {(direction, center): array} with arrays indexed like visibility_map around the center.
+  # A tile is hittable when it can be seen from both the cannon and the area center (see CannonHuntStrategy.has_line_of_sight).
+  reach = CARDINAL_CANNON_DISTANCES[-1] + CANNON_RANGES[-1]
+  bottom_left = (cannon_coordinate[0] - reach, cannon_coordinate[1] - reach)
+  grid = projectile_flag_grid(map_registry, bottom_left, 2*reach + 1, 2*reach + 1)
+
+  maps = {}
+  for direction, center, cannon_range in cannon_target_areas(cannon_coordinate):
+    offsets = np.arange(-cannon_range, cannon_range + 1)
+    targets_x, targets_y = np.meshgrid(center[0] + offsets, center[1] + offsets, indexing='ij')
+    from_cannon = lines_of_sight(grid, bottom_left, cannon_coordinate, targets_x, targets_y)
+    from_center = lines_of_sight(grid, bottom_left, center, targets_x, targets_y)
+    maps[(direction, center)] = from_cannon & from_center
+  return maps
@@ -0,0 +1,46 @@
+import random
+from unittest import TestCase, main, skipIf
+from cannon_sim import CannonHuntStrategy, HuntStrategy, MapRegistry
+from cannon_sim_test import random_map_config
+
+try:
+  import numpy
+except ImportError:
+  numpy = None
+
+if numpy is not None:
+  from visibility import cannon_target_areas, cannon_visibility_maps, visibility_map
+
+@skipIf(numpy is None, 'numpy is not installed')
+class VisibilityMapTest(TestCase):
+
+  def test_should_match_scalar_line_of_sight(self):
+    rng = random.Random(3)
+    for source in [(10, 10), (0, 3), (19, 19), (-2, 5)]:
+      map_registry = MapRegistry(random_map_config(rng, 20, 20, density=0.2))
+      strategy = HuntStrategy(map_registry, None, None)
+      radius = 9
+      visible = visibility_map(map_registry, source, radius)
+      for dx in range(-radius, radius + 1):
+        for dy in range(-radius, radius + 1):
+          target = (source[0] + dx, source[1] + dy)
+          self.assertEqual(bool(visible[radius + dx, radius + dy]), strategy.has_line_of_sight(source, target), (source, target))
+
+  def test_cannon_maps_should_match_cannon_line_of_sight(self):
+    rng = random.Random(4)
+    map_registry = MapRegistry(random_map_config(rng, 40, 40, density=0.1))
+    strategy = CannonHuntStrategy(map_registry, None, None)
+    cannon = (20, 20)
+    maps = cannon_visibility_maps(map_registry, cannon)
+
+    self.assertEqual(len(maps), 24)
+    for direction, center, cannon_range in cannon_target_areas(cannon):
+      hittable = maps[(direction, center)]
+      self.assertEqual(hittable.shape, (2*cannon_range + 1, 2*cannon_range + 1))
+      for dx in range(-cannon_range, cannon_range + 1):
+        for dy in range(-cannon_range, cannon_range + 1):
+          target = (center[0] + dx, center[1] + dy)
+          self.assertEqual(bool(hittable[cannon_range + dx, cannon_range + dy]), strategy.has_line_of_sight(cannon, center, target))
+
+if __name__ == '__main__':
+  main()